@@ -1,12 +1,28 @@
+import csv
+import heapq
 import json
+import math
+import operator
 import os
 import re
 import pickle
-from datetime import datetime
-from typing import Dict, List, Tuple, Any, Set, Optional
-from collections import defaultdict
-from dataclasses import dataclass, field
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, datetime
+from itertools import accumulate, chain, islice, product, repeat
+from typing import Dict, List, Tuple, Any, Set, Optional, Iterable, Iterator, Callable, Union
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
 from enum import Enum
+from functools import lru_cache, partial
+from hashlib import blake2b
 
 
 class DataType(Enum):
@@ -24,509 +40,4487 @@ class Column:
     is_primary: bool = False
     is_unique: bool = False
     is_nullable: bool = True
+    default: Any = None
+
+
+class IndexType(Enum):
+    HASH = "HASH"
+    BTREE = "BTREE"
+
+
+def order_key(value: Any) -> Tuple:
+    # Sort key that orders NULLs before every other value
+    return (value is not None, value)
+
+
+class Descending:
+    # Reverses the order of one sort key inside a composite key
+    __slots__ = ("key",)
+    
+    def __init__(self, key: Any):
+        self.key = key
+    
+    def __lt__(self, other: "Descending") -> bool:
+        return other.key < self.key
+    
+    def __eq__(self, other: "Descending") -> bool:
+        return self.key == other.key
 
 
 @dataclass
 class Index:
     column_names: List[str]
     entries: Dict[Tuple, List[int]] = field(default_factory=dict)
+    index_type: IndexType = IndexType.HASH
+    # BTREE only: the keys of entries in order, as tuples of order_key()
+    sorted_keys: Optional[List[Tuple]] = None
+    
+    @property
+    def ordered(self) -> bool:
+        return self.sorted_keys is not None
+    
+    def scan(self, lower: Optional[Tuple[Any, bool]] = None, upper: Optional[Tuple[Any, bool]] = None,
+             reverse: bool = False) -> Iterator[int]:
+        # Row ids in key order whose first column lies within the
+        # (value, inclusive) bounds. A range with only an upper bound
+        # still excludes NULLs, as the comparison would.
+        keys = self.sorted_keys
+        first = lambda key: key[0]
+        if lower is not None:
+            find = bisect_left if lower[1] else bisect_right
+            start = find(keys, order_key(lower[0]), key=first)
+        elif upper is not None:
+            start = bisect_right(keys, order_key(None), key=first)
+        else:
+            start = 0
+        if upper is not None:
+            find = bisect_right if upper[1] else bisect_left
+            end = find(keys, order_key(upper[0]), key=first)
+        else:
+            end = len(keys)
+        keys = keys[start:end]
+        return self._row_ids(keys[::-1] if reverse else keys, self.entries)
+    
+    def prefix_scan(self, prefix: Tuple) -> Iterator[int]:
+        # Row ids in key order whose leading columns equal prefix, found by
+        # bisecting the sorted keys on their first len(prefix) columns
+        head = tuple(map(order_key, prefix))
+        leading = lambda key: key[:len(head)]
+        start = bisect_left(self.sorted_keys, head, key=leading)
+        end = bisect_right(self.sorted_keys, head, key=leading)
+        return self._row_ids(self.sorted_keys[start:end], self.entries)
+    
+    @staticmethod
+    def _row_ids(keys: List[Tuple], entries: Dict[Tuple, List[int]]) -> Iterator[int]:
+        # The keys in range are copied when the scan starts and each posting
+        # list before it is read, since a cursor (iterate_sql) lets writers
+        # change the index between rows. Rows sharing a key come in row id
+        # order in either direction (the posting lists are kept sorted), the
+        # order a table scan sees them in, so ties match a stable sort.
+        for key in keys:
+            yield from tuple(entries.get(tuple(value for _, value in key), ()))
+
+
+class StorageLayout(Enum):
+    ROW = "ROW"
+    COLUMNAR = "COLUMNAR"
+
+
+class Bitmap:
+    # One bit per row, e.g. set where a value is NULL or a row is deleted
+    def __init__(self):
+        self.bits = bytearray()
+        self.length = 0
+        self.count = 0
+    
+    def __getitem__(self, i: int) -> bool:
+        return bool(self.bits[i >> 3] >> (i & 7) & 1)
+    
+    def set(self, i: int, flag: bool):
+        if self[i] != flag:
+            self.bits[i >> 3] ^= 1 << (i & 7)
+            self.count += 1 if flag else -1
+    
+    def append(self, flag: bool):
+        if self.length & 7 == 0:
+            self.bits.append(0)
+        self.length += 1
+        self.set(self.length - 1, flag)
+
+
+class TypedVector:
+    # Fixed-width column values in an array buffer plus a null bitmap
+    typecode = "q"
+    
+    def __init__(self):
+        self.values = array(self.typecode)
+        self.nulls = Bitmap()
+    
+    def _encode(self, value):
+        return value
+    
+    def _decode(self, value):
+        return value
+    
+    def __len__(self) -> int:
+        return len(self.values)
+    
+    def __getitem__(self, i: int):
+        if self.nulls.count and self.nulls[i]:
+            return None
+        return self._decode(self.values[i])
+    
+    def __setitem__(self, i: int, value):
+        self.nulls.set(i, value is None)
+        self.values[i] = 0 if value is None else self._encode(value)
+    
+    def __iter__(self) -> Iterator:
+        if self.nulls.count:
+            return (self[i] for i in range(len(self.values)))
+        if type(self)._decode is TypedVector._decode:
+            return iter(self.values)
+        return map(self._decode, self.values)
+    
+    def append(self, value):
+        try:
+            self.values.append(0 if value is None else self._encode(value))
+        except OverflowError:
+            raise ValueError(f"Value {value!r} is out of range for this column")
+        self.nulls.append(value is None)
+    
+    def match(self, values: Iterable) -> List[int]:
+        wanted = {v for v in values if v is not None}
+        return [i for i, value in enumerate(self) if value in wanted]
+
+
+class IntegerVector(TypedVector):
+    typecode = "q"
+    
+    def __getstate__(self):
+        # Snapshots use the narrowest integer type that holds every value
+        values = self.values
+        if values:
+            low, high = min(values), max(values)
+            for typecode in "bhi":
+                bits = 8 * array(typecode).itemsize - 1
+                if -(1 << bits) <= low and high < (1 << bits):
+                    values = array(typecode, values)
+                    break
+        return {"values": values, "nulls": self.nulls}
+    
+    def __setstate__(self, state):
+        self.values = array(self.typecode, state["values"])
+        self.nulls = state["nulls"]
+
+
+class RealVector(TypedVector):
+    typecode = "d"
+    
+    def _encode(self, value):
+        return float(value)
+
+
+class BooleanVector(TypedVector):
+    typecode = "b"
+    
+    def _encode(self, value):
+        return 1 if value else 0
+    
+    def _decode(self, value):
+        return value == 1
+
+
+class DateVector(TypedVector):
+    # Days since 0001-01-01; values come back as ISO date strings
+    typecode = "i"
+    
+    def _encode(self, value):
+        if isinstance(value, str):
+            value = date.fromisoformat(value)
+        return value.toordinal()
+    
+    def _decode(self, value):
+        return date.fromordinal(value).isoformat()
+
+
+class TextVector:
+    # UTF-8 bytes of every value in one buffer, addressed by offset and length.
+    # Overwritten values leave garbage behind that is reclaimed by compact().
+    def __init__(self, values: Iterable = ()):
+        self.data = bytearray()
+        self.offsets = array("Q")
+        self.lengths = array("I")
+        self.nulls = Bitmap()
+        self.garbage = 0
+        for value in values:
+            self.append(value)
+    
+    def __getstate__(self):
+        # Snapshots store the values back to back; offsets are rebuilt on load
+        if self.garbage:
+            self.compact()
+        return {"data": self.data, "lengths": self.lengths, "nulls": self.nulls}
+    
+    def __setstate__(self, state):
+        self.data = state["data"]
+        self.lengths = state["lengths"]
+        self.nulls = state["nulls"]
+        self.garbage = 0
+        self.offsets = array("Q", accumulate(self.lengths, initial=0))
+        self.offsets.pop()
+    
+    def __len__(self) -> int:
+        return len(self.offsets)
+    
+    def __getitem__(self, i: int):
+        if self.nulls.count and self.nulls[i]:
+            return None
+        start = self.offsets[i]
+        return self.data[start:start + self.lengths[i]].decode("utf-8")
+    
+    def __setitem__(self, i: int, value):
+        self.garbage += self.lengths[i]
+        start, length = self._store(value)
+        self.offsets[i] = start
+        self.lengths[i] = length
+        self.nulls.set(i, value is None)
+        if self.garbage > len(self.data) // 2:
+            self.compact()
+    
+    def __iter__(self) -> Iterator:
+        return (self[i] for i in range(len(self.offsets)))
+    
+    def append(self, value):
+        start, length = self._store(value)
+        self.offsets.append(start)
+        self.lengths.append(length)
+        self.nulls.append(value is None)
+    
+    def match(self, values: Iterable) -> List[int]:
+        wanted = set(values)
+        return [i for i, value in enumerate(self) if value in wanted]
+    
+    def compact(self):
+        values = list(self)
+        self.data = bytearray()
+        self.offsets = array("Q")
+        self.lengths = array("I")
+        self.nulls = Bitmap()
+        self.garbage = 0
+        for value in values:
+            self.append(value)
+    
+    def _store(self, value) -> Tuple[int, int]:
+        if value is None:
+            return len(self.data), 0
+        encoded = str(value).encode("utf-8")
+        start = len(self.data)
+        self.data += encoded
+        return start, len(encoded)
+
+
+# A columnar TEXT column stays dictionary-encoded while it has at most
+# DICTIONARY_MIN_ENTRIES distinct values or fewer distinct values than
+# DICTIONARY_MAX_RATIO of its rows; codes are 16-bit so the dictionary is capped.
+DICTIONARY_MIN_ENTRIES = 256
+DICTIONARY_MAX_RATIO = 0.5
+DICTIONARY_MAX_ENTRIES = 32767
+
+
+class DictionaryTextVector:
+    # Low-cardinality TEXT: one small integer code per row plus the list of
+    # distinct strings. Code -1 is NULL.
+    def __init__(self, values: Iterable = ()):
+        self.codes = array("h")
+        self.dictionary: List[str] = []
+        self.lookup: Dict[str, int] = {}
+        for value in values:
+            self.append(value)
+    
+    def __getstate__(self):
+        return {"codes": self.codes, "dictionary": self.dictionary}
+    
+    def __setstate__(self, state):
+        self.codes = state["codes"]
+        self.dictionary = state["dictionary"]
+        self.lookup = {value: code for code, value in enumerate(self.dictionary)}
+    
+    def __len__(self) -> int:
+        return len(self.codes)
+    
+    def __getitem__(self, i: int):
+        code = self.codes[i]
+        return self.dictionary[code] if code >= 0 else None
+    
+    def __setitem__(self, i: int, value):
+        self.codes[i] = self._code(value)
+    
+    def __iter__(self) -> Iterator:
+        # Index -1 lands on the trailing None, which decodes NULL codes
+        decoded = self.dictionary + [None]
+        return map(decoded.__getitem__, self.codes)
+    
+    def append(self, value):
+        self.codes.append(self._code(value))
+    
+    def is_overflowing(self) -> bool:
+        return len(self.dictionary) > DICTIONARY_MIN_ENTRIES and (
+            len(self.dictionary) > DICTIONARY_MAX_RATIO * len(self.codes)
+            or len(self.dictionary) >= DICTIONARY_MAX_ENTRIES)
+    
+    def match(self, values: Iterable) -> List[int]:
+        # Equality and IN compare codes, never strings
+        codes = {self.lookup[v] for v in values if isinstance(v, str) and v in self.lookup}
+        if not codes:
+            return []
+        if len(codes) == 1:
+            code = codes.pop()
+            return [i for i, c in enumerate(self.codes) if c == code]
+        return [i for i, c in enumerate(self.codes) if c in codes]
+    
+    def _code(self, value) -> int:
+        if value is None:
+            return -1
+        value = str(value)
+        code = self.lookup.get(value)
+        if code is None:
+            if len(self.dictionary) >= DICTIONARY_MAX_ENTRIES:
+                raise OverflowError("Dictionary is full")
+            code = len(self.dictionary)
+            self.dictionary.append(value)
+            self.lookup[value] = code
+        return code
+
+
+VECTOR_TYPES = {
+    DataType.INTEGER: IntegerVector,
+    DataType.REAL: RealVector,
+    DataType.BOOLEAN: BooleanVector,
+    DataType.DATE: DateVector,
+    DataType.TEXT: DictionaryTextVector,
+}
+
+
+class ColumnStore:
+    # Columnar container for Table.rows. It offers the same interface as the
+    # row layout's list of tuples (deleted rows read back as None), plus
+    # scans that only read some columns.
+    def __init__(self, columns: List[Column], rows: Iterable[Tuple] = ()):
+        self.vectors = [VECTOR_TYPES[col.data_type]() for col in columns]
+        self.deleted = Bitmap()
+        for row in rows:
+            self.append(row)
+    
+    def __len__(self) -> int:
+        return self.deleted.length
+    
+    def __getitem__(self, i: int) -> Optional[Tuple]:
+        if i < 0:
+            i += len(self)
+        if self.deleted.count and self.deleted[i]:
+            return None
+        return tuple(vector[i] for vector in self.vectors)
+    
+    def __setitem__(self, i: int, row: Optional[Tuple]):
+        if row is None:
+            # Tombstone; the values stay in the buffers until vacuum
+            self.deleted.set(i, True)
+            return
+        for vector, value in zip(self.vectors, row):
+            vector[i] = value
+        self._check_dictionaries()
+    
+    def __iter__(self) -> Iterator[Optional[Tuple]]:
+        return self._skip_deleted(zip(*self.vectors))
+    
+    def append(self, row: Tuple):
+        for vector, value in zip(self.vectors, row):
+            vector.append(value)
+        self.deleted.append(False)
+        self._check_dictionaries()
+    
+    def _skip_deleted(self, rows: Iterator[Tuple]) -> Iterator[Optional[Tuple]]:
+        if not self.deleted.count:
+            return rows
+        deleted = self.deleted
+        return (None if deleted[i] else row for i, row in enumerate(rows))
+    
+    def _check_dictionaries(self):
+        for pos, vector in enumerate(self.vectors):
+            if isinstance(vector, DictionaryTextVector) and vector.is_overflowing():
+                # Too many distinct values for codes to pay off
+                self.vectors[pos] = TextVector(vector)
+    
+    def optimize(self):
+        # Re-pick the TEXT encodings from current cardinality and drop
+        # dictionary entries and bytes that no row references any more
+        for pos, vector in enumerate(self.vectors):
+            if isinstance(vector, DictionaryTextVector):
+                encoded = DictionaryTextVector(vector)
+            elif isinstance(vector, TextVector):
+                distinct = len(set(vector))
+                if distinct < DICTIONARY_MAX_ENTRIES and (
+                        distinct <= DICTIONARY_MIN_ENTRIES or distinct <= DICTIONARY_MAX_RATIO * len(vector) / 2):
+                    encoded = DictionaryTextVector(vector)
+                else:
+                    vector.compact()
+                    continue
+            else:
+                continue
+            self.vectors[pos] = encoded if not encoded.is_overflowing() else TextVector(vector)
+    
+    def scan(self, positions: Iterable[int]) -> Iterator[Optional[Tuple]]:
+        # Full-width tuples with only the requested columns filled in;
+        # the buffers of all other columns are never touched
+        wanted = set(positions)
+        return self._skip_deleted(zip(*(iter(vector) if pos in wanted else repeat(None, len(self))
+                                        for pos, vector in enumerate(self.vectors))))
+    
+    def memory_usage(self) -> int:
+        size = sys.getsizeof(self.deleted.bits)
+        for vector in self.vectors:
+            for buffer in vars(vector).values():
+                if isinstance(buffer, Bitmap):
+                    buffer = buffer.bits
+                if isinstance(buffer, (array, bytearray)):
+                    size += sys.getsizeof(buffer)
+            if isinstance(vector, DictionaryTextVector):
+                size += sum(sys.getsizeof(v) for v in vector.dictionary)
+        return size
+    
+    def gather(self, row_ids: Iterable[int], positions: Iterable[int]) -> Iterator[Tuple]:
+        # Like scan(), restricted to the given live row ids
+        wanted = set(positions)
+        vectors = [vector if pos in wanted else None for pos, vector in enumerate(self.vectors)]
+        for i in row_ids:
+            yield tuple(vector[i] if vector is not None else None for vector in vectors)
+    
+    def match(self, pos: int, values: Iterable) -> List[int]:
+        # Live row ids whose value in column pos is one of values
+        matched = self.vectors[pos].match(values)
+        if self.deleted.count:
+            deleted = self.deleted
+            matched = [i for i in matched if not deleted[i]]
+        return matched
+
+
+# Checkpoints vacuum tables with more than this many tombstones that also
+# make up more than this share of their slots
+VACUUM_MIN_TOMBSTONES = 1000
+VACUUM_RATIO = 0.2
+
+
+@dataclass
+class ColumnStats:
+    null_count: int = 0
+    min: Any = None
+    max: Any = None
+    # Deleting or overwriting the current min or max leaves the bounds
+    # unknown until the next refresh()
+    stale: bool = False
+
+
+@dataclass
+class TableStats:
+    # Kept up to date by every row mutation, so reading them costs nothing.
+    # data_bytes sums the sizes of the values of live rows.
+    columns: List[ColumnStats] = field(default_factory=list)
+    data_bytes: int = 0
+    
+    @classmethod
+    def collect(cls, width: int, rows: Iterable[Optional[Tuple]]) -> "TableStats":
+        stats = cls([ColumnStats() for _ in range(width)])
+        for row in rows:
+            if row is not None:
+                stats.add(row)
+        return stats
+    
+    def add(self, row: Tuple, positions: Optional[List[int]] = None):
+        # positions limits the update to the columns an UPDATE assigned
+        size = 0
+        for col, value in self._pairs(row, positions):
+            if value is None:
+                col.null_count += 1
+                continue
+            size += sys.getsizeof(value)
+            if col.stale:
+                continue
+            if col.min is None or value < col.min:
+                col.min = value
+            if col.max is None or value > col.max:
+                col.max = value
+        self.data_bytes += size
+    
+    def add_rows(self, rows: List[Tuple]):
+        # add() for a batch, a column at a time
+        for pos, col in enumerate(self.columns):
+            values = [row[pos] for row in rows if row[pos] is not None]
+            col.null_count += len(rows) - len(values)
+            if not values:
+                continue
+            self.data_bytes += sum(map(sys.getsizeof, values))
+            if col.stale:
+                continue
+            least, greatest = min(values), max(values)
+            if col.min is None or least < col.min:
+                col.min = least
+            if col.max is None or greatest > col.max:
+                col.max = greatest
+    
+    def remove(self, row: Tuple, positions: Optional[List[int]] = None):
+        size = 0
+        for col, value in self._pairs(row, positions):
+            if value is None:
+                col.null_count -= 1
+                continue
+            size += sys.getsizeof(value)
+            if value == col.min or value == col.max:
+                col.stale = True
+        self.data_bytes -= size
+    
+    def _pairs(self, row: Tuple, positions: Optional[List[int]]) -> Iterable[Tuple[ColumnStats, Any]]:
+        if positions is None:
+            return zip(self.columns, row)
+        return ((self.columns[pos], row[pos]) for pos in positions)
+    
+    def refresh(self, rows: Iterable[Optional[Tuple]]):
+        # Recompute stale bounds with one pass over the rows
+        stale = [(pos, col) for pos, col in enumerate(self.columns) if col.stale]
+        if not stale:
+            return
+        for _, col in stale:
+            col.min = col.max = None
+        for row in rows:
+            if row is None:
+                continue
+            for pos, col in stale:
+                value = row[pos]
+                if value is None:
+                    continue
+                if col.min is None or value < col.min:
+                    col.min = value
+                if col.max is None or value > col.max:
+                    col.max = value
+        for _, col in stale:
+            col.stale = False
+    
+    def as_dict(self, columns: List[Column], row_count: int) -> Dict[str, Any]:
+        return {
+            "rows": row_count,
+            "bytes": self.data_bytes,
+            "columns": {column.name: {"null_count": col.null_count, "min": col.min, "max": col.max}
+                        for column, col in zip(columns, self.columns)},
+        }
+
+
+@dataclass
+class Table:
+    name: str
+    columns: List[Column]
+    # Rows are tuples in schema order; dicts are only built for callers.
+    # A row's id is its slot here. Deleted rows leave a None tombstone so
+    # ids stay stable until vacuum() compacts the table.
+    rows: List[Optional[Tuple]] = field(default_factory=list)
+    indexes: Dict[str, Index] = field(default_factory=dict)
+    next_row_id: int = 1
+    primary_key_column: Optional[Column] = None
+    # LSN of the last write-ahead log record folded into this table
+    wal_lsn: int = 0
+    layout: StorageLayout = StorageLayout.ROW
+    deleted_count: int = 0
+    statistics: Optional[TableStats] = None
+    
+    def __post_init__(self):
+        for col in self.columns:
+            if col.is_primary:
+                self.primary_key_column = col
+                break
+        if self.layout == StorageLayout.COLUMNAR and not isinstance(self.rows, ColumnStore):
+            self.rows = ColumnStore(self.columns, self.rows)
+        self.column_positions: Dict[str, int] = {col.name: i for i, col in enumerate(self.columns)}
+        self._create_default_indexes()
+        if self.statistics is None:
+            self.statistics = TableStats.collect(len(self.columns), self.rows)
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.column_positions = {col.name: i for i, col in enumerate(self.columns)}
+        # Tables pickled before the tuple row format stored one dict per row
+        if self.rows and isinstance(self.rows[0], dict):
+            self.rows = [self.make_row(row) for row in self.rows]
+        if self.statistics is None:
+            self.statistics = TableStats.collect(len(self.columns), self.rows)
+    
+    def make_row(self, values: Dict[str, Any]) -> Tuple:
+        for col_name in values:
+            if col_name not in self.column_positions:
+                raise ValueError(f"Column '{col_name}' does not exist in table '{self.name}'")
+        return tuple(values.get(col.name, col.default) for col in self.columns)
+    
+    def make_rows(self, col_names: List[str], value_lists: Iterable[List[Any]]) -> List[Tuple]:
+        # make_row for a batch, resolving the column names once
+        for col_name in col_names:
+            if col_name not in self.column_positions:
+                raise ValueError(f"Column '{col_name}' does not exist in table '{self.name}'")
+        if col_names == [col.name for col in self.columns]:
+            return [tuple(values) for values in value_lists]
+        positions = [self.column_positions[col_name] for col_name in col_names]
+        defaults = [col.default for col in self.columns]
+        rows = []
+        for values in value_lists:
+            row = list(defaults)
+            for pos, value in zip(positions, values):
+                row[pos] = value
+            rows.append(tuple(row))
+        return rows
+    
+    def row_to_dict(self, row: Tuple) -> Dict[str, Any]:
+        return {col.name: value for col, value in zip(self.columns, row)}
+    
+    @property
+    def row_count(self) -> int:
+        return len(self.rows) - self.deleted_count
+    
+    def refresh_statistics(self) -> TableStats:
+        self.statistics.refresh(self.rows)
+        return self.statistics
+    
+    def live_rows(self) -> Iterator[Tuple[int, Tuple]]:
+        # (row id, row) for every row that is not a tombstone
+        return ((i, row) for i, row in enumerate(self.rows) if row is not None)
+    
+    def _index_key(self, idx: Index, row: Tuple) -> Tuple:
+        positions = self.column_positions
+        return tuple(row[positions[col]] for col in idx.column_names)
+    
+    def _create_default_indexes(self):
+        # Create index on primary key
+        if self.primary_key_column:
+            self.indexes["__primary"] = Index([self.primary_key_column.name])
+        
+        # Create indexes on unique columns
+        for col in self.columns:
+            if col.is_unique and col != self.primary_key_column:
+                self.indexes[f"__unique_{col.name}"] = Index([col.name])
+    
+    def add_index(self, name: str, column_names: List[str], index_type: IndexType = IndexType.HASH):
+        self.indexes[name] = Index(column_names, index_type=index_type)
+        self._rebuild_index(name)
+    
+    def _rebuild_index(self, index_name: str):
+        if index_name in self.indexes:
+            idx = self.indexes[index_name]
+            # A new dict: open scans keep the old entries, which match the
+            # row ids of the rows they read
+            idx.entries = {}
+            idx.sorted_keys = None
+            for i, row in self.live_rows():
+                self._index_add(idx, i, row)
+            if idx.index_type == IndexType.BTREE:
+                idx.sorted_keys = sorted(tuple(map(order_key, key)) for key in idx.entries)
+    
+    def apply_record(self, record: Tuple, lsn: int):
+        # Redo one write-ahead log record against this table
+        op = record[1]
+        if op == "insert":
+            self.insert_row(record[2])
+        elif op == "insert_rows":
+            self.insert_rows(record[2])
+        elif op == "update":
+            self.update_rows(record[2], record[3])
+        elif op == "delete":
+            self.delete_rows(record[2])
+        elif op == "create_index":
+            index_type = IndexType(record[4]) if len(record) > 4 else IndexType.HASH
+            self.add_index(record[2], record[3], index_type)
+        else:
+            raise ValueError(f"Unknown log record: {op}")
+        self.wal_lsn = lsn
+    
+    def memory_usage(self) -> int:
+        # Rough resident size in bytes, estimated from a sample of rows
+        if isinstance(self.rows, ColumnStore):
+            size = self.rows.memory_usage()
+        else:
+            sample = [row for row in self.rows[::max(1, len(self.rows) // 100)] if row is not None]
+            per_row = sum(sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row)
+                          for row in sample) / max(1, len(sample))
+            size = sys.getsizeof(self.rows) + int(per_row * self.row_count)
+        for idx in self.indexes.values():
+            size += sys.getsizeof(idx.entries) + 120 * len(idx.entries)
+            if idx.ordered:
+                size += sys.getsizeof(idx.sorted_keys) + 100 * len(idx.sorted_keys)
+        return size
+    
+    # Row mutations shared by statement execution and log replay
+    def unique_index(self, col: Column) -> Optional[Index]:
+        # The default index enforcing a PRIMARY KEY or UNIQUE column
+        name = "__primary" if col.is_primary else f"__unique_{col.name}"
+        idx = self.indexes.get(name)
+        return idx if idx is not None and idx.column_names == [col.name] else None
+    
+    def check_unique(self, rows: List[Tuple], row_ids: Optional[List[int]] = None,
+                     columns: Optional[Set[str]] = None, earlier: Optional[Dict[str, Set]] = None):
+        # Check a batch of new row versions against the unique indexes and
+        # against each other. row_ids are the rows being replaced (UPDATE),
+        # which may keep their own values; columns limits the check. earlier
+        # collects the values of batches checked before but not yet added.
+        replaced = set(row_ids or ())
+        for pos, col in enumerate(self.columns):
+            if not col.is_unique or (columns is not None and col.name not in columns):
+                continue
+            idx = self.unique_index(col)
+            seen = set() if earlier is None else earlier.setdefault(col.name, set())
+            for row in rows:
+                value = row[pos]
+                if value is None:
+                    continue
+                if value in seen:
+                    raise ValueError(f"Duplicate value for unique column '{col.name}'")
+                seen.add(value)
+                if idx is not None:
+                    existing = idx.entries.get((value,))
+                    clash = existing is not None and not replaced.issuperset(existing)
+                else:
+                    clash = any(other[pos] == value for i, other in self.live_rows() if i not in replaced)
+                if clash:
+                    raise ValueError(f"Duplicate value for unique column '{col.name}'")
+    
+    def _index_add(self, idx: Index, row_id: int, row: Tuple):
+        key = self._index_key(idx, row)
+        if key not in idx.entries:
+            idx.entries[key] = []
+            if idx.ordered:
+                insort(idx.sorted_keys, tuple(map(order_key, key)))
+        # Posting lists stay in row id order; new rows just append
+        ids = idx.entries[key]
+        if not ids or ids[-1] < row_id:
+            ids.append(row_id)
+        else:
+            insort(ids, row_id)
+    
+    def _index_remove(self, idx: Index, row_id: int, row: Tuple):
+        key = self._index_key(idx, row)
+        ids = idx.entries[key]
+        del ids[bisect_left(ids, row_id)]
+        if not ids:
+            del idx.entries[key]
+            if idx.ordered:
+                sorted_key = tuple(map(order_key, key))
+                del idx.sorted_keys[bisect_left(idx.sorted_keys, sorted_key)]
+    
+    def insert_row(self, row: Tuple) -> int:
+        self.rows.append(row)
+        row_id = len(self.rows) - 1
+        for idx in self.indexes.values():
+            self._index_add(idx, row_id, row)
+        self.statistics.add(row)
+        return row_id
+    
+    def insert_rows(self, rows: List[Tuple]) -> int:
+        # Append a batch and index it in one pass per index; new keys of an
+        # ordered index are merged into its sorted keys with a single sort.
+        # Returns the row id of the first row.
+        first = len(self.rows)
+        if isinstance(self.rows, ColumnStore):
+            for row in rows:
+                self.rows.append(row)
+        else:
+            self.rows.extend(rows)
+        for idx in self.indexes.values():
+            entries = idx.entries
+            positions = [self.column_positions[col] for col in idx.column_names]
+            if len(positions) == 1:
+                pos = positions[0]
+                keys = [(row[pos],) for row in rows]
+            else:
+                keys = list(map(operator.itemgetter(*positions), rows))
+            new_keys = []
+            for row_id, key in enumerate(keys, first):
+                ids = entries.get(key)
+                if ids is None:
+                    entries[key] = [row_id]
+                    new_keys.append(key)
+                else:
+                    ids.append(row_id)
+            if idx.ordered and new_keys:
+                idx.sorted_keys.extend(tuple(map(order_key, key)) for key in new_keys)
+                idx.sorted_keys.sort()
+        self.statistics.add_rows(rows)
+        return first
+    
+    def update_rows(self, row_ids: List[int], updates: Union[Dict[str, Any], List[Dict[str, Any]]]):
+        # updates holds the new values for all the rows, or one dict per row
+        # (SET expressions reading the row); every dict assigns the same columns
+        per_row = isinstance(updates, list)
+        if per_row and not updates:
+            return
+        columns = updates[0] if per_row else updates
+        positions = self.column_positions
+        changes = [(positions[col], value) for col, value in columns.items()]
+        assigned = [pos for pos, _ in changes]
+        # Only indexes over an assigned column can change
+        affected = [idx for idx in self.indexes.values()
+                    if any(col in columns for col in idx.column_names)]
+        for n, i in enumerate(row_ids):
+            if per_row:
+                changes = [(positions[col], value) for col, value in updates[n].items()]
+            old_row = self.rows[i]
+            row = list(old_row)
+            for pos, value in changes:
+                row[pos] = value
+            new_row = tuple(row)
+            self.rows[i] = new_row
+            self.statistics.remove(old_row, assigned)
+            self.statistics.add(new_row, assigned)
+            for idx in affected:
+                if self._index_key(idx, old_row) != self._index_key(idx, new_row):
+                    self._index_remove(idx, i, old_row)
+                    self._index_add(idx, i, new_row)
+    
+    def delete_rows(self, row_ids: List[int]):
+        # Tombstone the rows and drop just their index entries
+        for i in row_ids:
+            row = self.rows[i]
+            for idx in self.indexes.values():
+                self._index_remove(idx, i, row)
+            self.statistics.remove(row)
+            self.rows[i] = None
+            self.deleted_count += 1
+    
+    def needs_vacuum(self) -> bool:
+        return self.deleted_count > VACUUM_MIN_TOMBSTONES and self.deleted_count > VACUUM_RATIO * len(self.rows)
+    
+    def vacuum(self) -> int:
+        # Reclaim tombstones. Row ids change, so callers must snapshot the
+        # table right away: older log records no longer apply to it.
+        reclaimed = self.deleted_count
+        live = (row for row in self.rows if row is not None)
+        if isinstance(self.rows, ColumnStore):
+            self.rows = ColumnStore(self.columns, live)
+        else:
+            self.rows = list(live)
+        self.deleted_count = 0
+        for name in self.indexes:
+            self._rebuild_index(name)
+        return reclaimed
+
+
+class Durability(Enum):
+    SYNC = "sync"      # every statement is written and fsynced before it returns
+    GROUP = "group"    # concurrent commits share one write + fsync
+    ASYNC = "async"    # a background thread flushes; a crash may lose the last interval
+
+
+@dataclass
+class FlushStats:
+    flushes: int = 0
+    frames: int = 0
+    bytes_written: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+    last_batch_size: int = 0
+    max_batch_size: int = 0
+    
+    def record(self, batch_size: int, nbytes: int, latency: float):
+        self.flushes += 1
+        self.frames += batch_size
+        self.bytes_written += nbytes
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.last_batch_size = batch_size
+        self.max_batch_size = max(self.max_batch_size, batch_size)
+    
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "flushes": self.flushes,
+            "frames": self.frames,
+            "bytes_written": self.bytes_written,
+            "avg_batch_size": self.frames / self.flushes if self.flushes else 0.0,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_flush_latency_ms": 1000 * self.total_latency / self.flushes if self.flushes else 0.0,
+            "max_flush_latency_ms": 1000 * self.max_latency,
+        }
+
+
+class WriteAheadLog:
+    # Append-only log of change records. Each frame holds one statement (or
+    # one committed transaction) as <length><crc32><pickle of (lsn, records)>,
+    # so a write torn by a crash is detected and dropped on replay.
+    FRAME_HEADER = struct.Struct("<II")
+    
+    def __init__(self, path: str, durability: Durability = Durability.SYNC,
+                 group_commit_window: float = 0.0, group_commit_size: int = 256,
+                 async_flush_interval: float = 0.05):
+        self.path = path
+        self.durability = durability
+        # GROUP: how long a flush leader waits for more commits to join its batch
+        self.group_commit_window = group_commit_window
+        self.group_commit_size = group_commit_size
+        self.async_flush_interval = async_flush_interval
+        self.last_lsn = 0
+        self.durable_lsn = 0
+        self.frames_since_checkpoint = 0
+        self.stats = FlushStats()
+        self._file = None
+        self._buffer: List[bytes] = []
+        self._flushing = False
+        self._closing = False
+        self._cond = threading.Condition()
+        self._flusher: Optional[threading.Thread] = None
+        # Set when a flush failed: the frames of that batch may or may not be
+        # on disk, so nothing is reported durable until a checkpoint has put
+        # every change into the snapshots and truncated the log
+        self._failure: Optional[BaseException] = None
+    
+    def open(self) -> List[Tuple[int, List[Tuple]]]:
+        frames = []
+        valid_size = 0
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                while True:
+                    header = f.read(self.FRAME_HEADER.size)
+                    if len(header) < self.FRAME_HEADER.size:
+                        break
+                    length, checksum = self.FRAME_HEADER.unpack(header)
+                    payload = f.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != checksum:
+                        break
+                    lsn, records = pickle.loads(payload)
+                    frames.append((lsn, records))
+                    valid_size = f.tell()
+        
+        self._file = open(self.path, "ab")
+        if self._file.tell() != valid_size:
+            # Drop a torn tail left behind by an interrupted write
+            self._file.truncate(valid_size)
+        
+        if frames:
+            self.last_lsn = frames[-1][0]
+        self.durable_lsn = self.last_lsn
+        self.frames_since_checkpoint = sum(1 for _, records in frames if records)
+        self._failure = None
+        
+        self._closing = False
+        if self.durability == Durability.ASYNC:
+            self._flusher = threading.Thread(target=self._flush_loop, name="wal-flusher", daemon=True)
+            self._flusher.start()
+        return frames
+    
+    def append(self, records: List[Tuple]) -> int:
+        with self._cond:
+            self.check_failure()
+            self.last_lsn += 1
+            lsn = self.last_lsn
+            self._buffer.append(self._encode(lsn, records))
+            self.frames_since_checkpoint += 1
+            if len(self._buffer) >= self.group_commit_size:
+                self._cond.notify_all()
+        if self.durability == Durability.SYNC:
+            self.commit(lsn)
+        return lsn
+    
+    def commit(self, lsn: int):
+        # Block until the frame with this LSN is on disk (a no-op for ASYNC)
+        if self.durability == Durability.ASYNC:
+            return
+        with self._cond:
+            while self.durable_lsn < lsn:
+                self.check_failure()
+                if self._flushing:
+                    # Another committer is flushing; our frame rides the next batch
+                    self._cond.wait()
+                    continue
+                if self.durability == Durability.GROUP and self.group_commit_window > 0:
+                    deadline = time.monotonic() + self.group_commit_window
+                    while len(self._buffer) < self.group_commit_size and not self._flushing:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    if self._flushing or self.durable_lsn >= lsn:
+                        continue
+                self._flush_locked()
+    
+    def flush(self):
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            if self._buffer:
+                self.check_failure()
+                self._flush_locked()
+    
+    def check_failure(self):
+        if self._failure is not None:
+            raise ValueError(f"Write-ahead log failed to flush ({self._failure}); "
+                             f"a checkpoint or reopening the database is required")
+    
+    def _flush_locked(self):
+        # Called with the condition held; the I/O itself runs without it so
+        # that new commits can queue up behind this batch. Only the LSNs of
+        # the batch become durable, and only if all of it was written.
+        batch, self._buffer = self._buffer, []
+        target_lsn = self.last_lsn
+        self._flushing = True
+        self._cond.release()
+        try:
+            start = time.perf_counter()
+            data = b"".join(batch)
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            latency = time.perf_counter() - start
+        except BaseException as e:
+            self._failure = e
+            raise
+        finally:
+            self._cond.acquire()
+            self._flushing = False
+            self._cond.notify_all()
+        self.durable_lsn = max(self.durable_lsn, target_lsn)
+        self.stats.record(len(batch), len(data), latency)
+    
+    def _flush_loop(self):
+        with self._cond:
+            while not self._closing:
+                self._cond.wait(self.async_flush_interval)
+                if self._buffer and not self._flushing and self._failure is None:
+                    try:
+                        self._flush_locked()
+                    except Exception:
+                        # Recorded in _failure; the next commit reports it
+                        pass
+    
+    def truncate(self):
+        # Only called after the snapshots hold every appended change, so the
+        # unflushed tail can be dropped. Keep an empty frame so the LSN
+        # sequence survives the truncation.
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            self._buffer = []
+            self._file.seek(0)
+            self._file.truncate()
+            self._file.write(self._encode(self.last_lsn, []))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.durable_lsn = self.last_lsn
+            self.frames_since_checkpoint = 0
+            self._failure = None
+            self._cond.notify_all()
+    
+    def close(self):
+        if self._file is None:
+            return
+        if self._failure is None:
+            self.flush()
+        if self._flusher:
+            with self._cond:
+                self._closing = True
+                self._cond.notify_all()
+            self._flusher.join()
+            self._flusher = None
+        self._file.close()
+        self._file = None
+    
+    def _encode(self, lsn: int, records: List[Tuple]) -> bytes:
+        payload = pickle.dumps((lsn, records), protocol=pickle.HIGHEST_PROTOCOL)
+        return self.FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+@dataclass
+class TableInfo:
+    # Schema metadata kept in memory for every table, loaded or not
+    name: str
+    columns: List[Column]
+    layout: StorageLayout
+    indexes: Dict[str, List[str]]
+    row_count: int
+    wal_lsn: int
+    statistics: Optional[TableStats] = None
+    
+    @property
+    def column_positions(self) -> Dict[str, int]:
+        return {col.name: pos for pos, col in enumerate(self.columns)}
+    
+    @classmethod
+    def from_table(cls, table: "Table") -> "TableInfo":
+        return cls(table.name, table.columns, table.layout,
+                   {name: idx.column_names for name, idx in table.indexes.items()},
+                   table.row_count, table.wal_lsn, table.statistics)
+
+
+def fsync_dir(path: str):
+    # Make renames inside a directory durable (not possible on Windows)
+    if os.name == "nt":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class TableCatalog:
+    # Maps table names to tables. Only each snapshot's header (the schema) is
+    # read up front; rows and indexes are unpickled the first time a table is
+    # used, and the least recently used tables are evicted again when the
+    # loaded ones outgrow memory_budget bytes.
+    def __init__(self, data_dir: str, memory_budget: Optional[int] = None):
+        self.data_dir = data_dir
+        self.memory_budget = memory_budget
+        self.infos: Dict[str, TableInfo] = {}
+        self.loaded: "OrderedDict[str, Table]" = OrderedDict()
+        # Tables with changes not yet folded into their snapshot
+        self.dirty: Set[str] = set()
+        # Tables with uncommitted changes, which must stay in memory
+        self.pinned: Set[str] = set()
+        # Log records replayed at startup for tables that are not loaded yet
+        self._pending_log: Dict[str, List[Tuple[int, Tuple]]] = defaultdict(list)
+        self._sizes: Dict[str, int] = {}
+    
+    def open(self):
+        self.infos = {}
+        self.loaded = OrderedDict()
+        self.dirty = set()
+        self.pinned = set()
+        self._pending_log = defaultdict(list)
+        self._sizes = {}
+        for filename in os.listdir(self.data_dir):
+            if filename.endswith(".pkl"):
+                with open(os.path.join(self.data_dir, filename), "rb") as f:
+                    header = pickle.load(f)
+                if isinstance(header, Table):
+                    # Snapshots written before the catalog are a bare Table
+                    self.infos[header.name] = TableInfo.from_table(header)
+                    self.loaded[header.name] = header
+                else:
+                    self.infos[header.name] = header
+    
+    def add_log_record(self, lsn: int, record: Tuple):
+        info = self.infos.get(record[0])
+        if info is None or lsn <= info.wal_lsn:
+            return
+        if record[0] in self.loaded:
+            self.loaded[record[0]].apply_record(record, lsn)
+        else:
+            self._pending_log[record[0]].append((lsn, record))
+        self.dirty.add(record[0])
+    
+    def __contains__(self, name: str) -> bool:
+        return name in self.infos
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.infos)
+    
+    def __len__(self) -> int:
+        return len(self.infos)
+    
+    def __getitem__(self, name: str) -> Table:
+        table = self.loaded.get(name)
+        if table is not None:
+            self.loaded.move_to_end(name)
+            return table
+        if name not in self.infos:
+            raise KeyError(name)
+        return self._load(name)
+    
+    def __setitem__(self, name: str, table: Table):
+        self.infos[name] = TableInfo.from_table(table)
+        self.loaded[name] = table
+        self._pending_log.pop(name, None)
+    
+    def __delitem__(self, name: str):
+        del self.infos[name]
+        self.loaded.pop(name, None)
+        self._pending_log.pop(name, None)
+        self._sizes.pop(name, None)
+        self.dirty.discard(name)
+        self.pinned.discard(name)
+    
+    def get(self, name: str, default=None) -> Optional[Table]:
+        return self[name] if name in self.infos else default
+    
+    def schema(self, name: str) -> Union[Table, TableInfo]:
+        # The table if it is loaded, else its header; both have columns,
+        # column_positions and layout
+        table = self.loaded.get(name)
+        return table if table is not None else self.infos[name]
+    
+    def peek(self, name: str) -> Table:
+        # Like [], but a loaded table does not become the most recently used
+        table = self.loaded.get(name)
+        return table if table is not None else self[name]
+    
+    def keys(self):
+        return self.infos.keys()
+    
+    def values(self) -> Iterator[Table]:
+        return (self[name] for name in list(self.infos))
+    
+    def items(self) -> Iterator[Tuple[str, Table]]:
+        return ((name, self[name]) for name in list(self.infos))
+    
+    def is_loaded(self, name: str) -> bool:
+        return name in self.loaded
+    
+    def row_count(self, name: str) -> int:
+        if name in self.loaded or self._pending_log.get(name):
+            return self[name].row_count
+        return self.infos[name].row_count
+    
+    def statistics(self, name: str) -> TableStats:
+        # From the snapshot header unless the table is loaded anyway
+        info = self.infos[name]
+        if name in self.loaded or self._pending_log.get(name) or info.statistics is None:
+            return self[name].refresh_statistics()
+        return info.statistics
+    
+    def save(self, name: str):
+        # Write header + table; the rename keeps the old snapshot intact if
+        # we crash halfway through. Snapshots are fsynced in every durability
+        # mode: a checkpoint truncates the log right after writing them.
+        table = self.peek(name)
+        if isinstance(table.rows, ColumnStore):
+            table.rows.optimize()
+        table.refresh_statistics()
+        info = TableInfo.from_table(table)
+        path = os.path.join(self.data_dir, f"{name}.pkl")
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(info, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(table, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        fsync_dir(self.data_dir)
+        self.infos[name] = info
+        self.dirty.discard(name)
+        # Measured again on the next eviction pass
+        self._sizes.pop(name, None)
+    
+    def _load(self, name: str) -> Table:
+        with open(os.path.join(self.data_dir, f"{name}.pkl"), "rb") as f:
+            pickle.load(f)
+            table = pickle.load(f)
+        for lsn, record in self._pending_log.pop(name, []):
+            table.apply_record(record, lsn)
+        self.loaded[name] = table
+        self.evict_cold()
+        return table
+    
+    def memory_usage(self) -> int:
+        for name, table in self.loaded.items():
+            if name not in self._sizes or name in self.dirty:
+                self._sizes[name] = table.memory_usage()
+        return sum(self._sizes.get(name, 0) for name in self.loaded)
+    
+    def evict_cold(self, save_dirty: bool = False):
+        # Drop tables, least recently used first, until the loaded ones fit
+        # memory_budget. Tables with unsaved changes are only written out and
+        # dropped with save_dirty, i.e. between statements; during one, a
+        # statement may still be working on them.
+        if self.memory_budget is None:
+            return
+        usage = self.memory_usage()
+        # The most recently used table always stays, even if it alone is too big
+        for name in list(self.loaded)[:-1]:
+            if usage <= self.memory_budget:
+                break
+            if name in self.pinned:
+                continue
+            if name in self.dirty:
+                if not save_dirty:
+                    continue
+                self.save(name)
+            self.infos[name].row_count = self.loaded[name].row_count
+            self.infos[name].statistics = self.loaded[name].refresh_statistics()
+            del self.loaded[name]
+            usage -= self._sizes.pop(name, 0)
+
+
+# SQL front end: a single-pass tokenizer and a recursive-descent parser
+# producing the statement AST that SimpleRDBMS executes
+
+# Tokens are (kind, value, pos) tuples; kind is NUMBER, STRING, IDENT,
+# KEYWORD, OP, PARAM (a ? placeholder) or EOF, and keywords are upper-cased
+KEYWORDS = frozenset("""
+    AND AS ASC BEGIN BETWEEN BY COMMIT CONFLICT COPY CREATE DEFAULT DELETE DESC DISTINCT DO
+    DROP EXISTS FALSE FROM GROUP HAVING IF IN INDEX INNER INSERT INTO IS JOIN KEY LIKE
+    LIMIT NOT NOTHING NULL OFFSET ON OR ORDER PRIMARY ROLLBACK SELECT SET TABLE TO TRANSACTION TRUE UNIQUE
+    UPDATE USING VACUUM VALUES WHERE WITH
+""".split())
+# Keywords that may still name a table or column: the parser reads them as
+# keywords only where its grammar expects one
+NONRESERVED_KEYWORDS = frozenset("""
+    CONFLICT COPY DEFAULT DO IF INDEX KEY LIMIT NOTHING OFFSET TO TRANSACTION USING VACUUM WITH
+""".split())
+
+_TOKEN_RE = re.compile(r"""
+    (?P<space>\s+|--[^\n]*)
+  | (?P<number>\d+\.\d*|\.\d+|\d+)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<ident>[A-Za-z_]\w*)
+  | (?P<quoted>"(?:[^"]|"")*")
+  | (?P<op><>|!=|<=|>=|\|\||[=<>+\-*/%(),.;])
+  | (?P<param>\?)
+  | (?P<error>.)
+""", re.VERBOSE | re.DOTALL)
+
+
+def tokenize(sql: str) -> List[Tuple[str, Any, int]]:
+    tokens = []
+    append = tokens.append
+    for match in _TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        if kind == "space":
+            continue
+        text = match.group()
+        pos = match.start()
+        if kind == "ident":
+            upper = text.upper()
+            if upper in KEYWORDS:
+                append(("KEYWORD", upper, pos))
+            else:
+                append(("IDENT", text, pos))
+        elif kind == "op":
+            append(("OP", text, pos))
+        elif kind == "number":
+            append(("NUMBER", float(text) if "." in text else int(text), pos))
+        elif kind == "string":
+            append(("STRING", text[1:-1].replace("''", "'"), pos))
+        elif kind == "quoted":
+            append(("IDENT", text[1:-1].replace('""', '"'), pos))
+        elif kind == "param":
+            append(("PARAM", None, pos))
+        elif text == "'":
+            raise ValueError(f"Unterminated string literal at position {pos}")
+        else:
+            raise ValueError(f"Unexpected character {text!r} at position {pos}")
+    append(("EOF", None, len(sql)))
+    return tokens
+
+
+# Expressions
+@dataclass
+class Literal:
+    value: Any
+
+
+@dataclass
+class Param:
+    index: int  # position among the statement's ? placeholders
+
+
+@dataclass
+class ColumnRef:
+    name: str  # "col" or "table.col"
+
+
+@dataclass
+class UnaryOp:
+    op: str  # NOT or -
+    operand: Any
+
+
+@dataclass
+class BinaryOp:
+    op: str  # AND, OR, a comparison or an arithmetic operator
+    left: Any
+    right: Any
+
+
+@dataclass
+class InList:
+    operand: Any
+    values: List[Any]
+    negated: bool = False
+
+
+@dataclass
+class Between:
+    operand: Any
+    low: Any
+    high: Any
+    negated: bool = False
+
+
+@dataclass
+class Like:
+    operand: Any
+    pattern: Any
+    negated: bool = False
+
+
+@dataclass
+class IsNull:
+    operand: Any
+    negated: bool = False
+
+
+@dataclass
+class Aggregate:
+    func: str  # one of AGGREGATE_FUNCTIONS
+    arg: Any = None  # None for COUNT(*)
+    distinct: bool = False
+    fraction: Any = None  # the percentile of APPROX_PERCENTILE, a literal or parameter
+
+
+AGGREGATE_FUNCTIONS = ("COUNT", "SUM", "AVG", "MIN", "MAX", "APPROX_COUNT_DISTINCT", "APPROX_PERCENTILE")
+
+
+def expression_columns(expr: Any) -> Iterator[str]:
+    # Names of all columns an expression reads
+    if isinstance(expr, ColumnRef):
+        yield expr.name
+    elif isinstance(expr, UnaryOp):
+        yield from expression_columns(expr.operand)
+    elif isinstance(expr, BinaryOp):
+        yield from expression_columns(expr.left)
+        yield from expression_columns(expr.right)
+    elif isinstance(expr, InList):
+        yield from expression_columns(expr.operand)
+        for value in expr.values:
+            yield from expression_columns(value)
+    elif isinstance(expr, Between):
+        for part in (expr.operand, expr.low, expr.high):
+            yield from expression_columns(part)
+    elif isinstance(expr, Like):
+        yield from expression_columns(expr.operand)
+        yield from expression_columns(expr.pattern)
+    elif isinstance(expr, IsNull):
+        yield from expression_columns(expr.operand)
+    elif isinstance(expr, Aggregate):
+        yield from expression_columns(expr.arg)
+
+
+def subexpressions(expr: Any) -> List[Any]:
+    # Direct operands of an expression node
+    if isinstance(expr, (UnaryOp, IsNull)):
+        return [expr.operand]
+    if isinstance(expr, BinaryOp):
+        return [expr.left, expr.right]
+    if isinstance(expr, InList):
+        return [expr.operand] + expr.values
+    if isinstance(expr, Between):
+        return [expr.operand, expr.low, expr.high]
+    if isinstance(expr, Like):
+        return [expr.operand, expr.pattern]
+    if isinstance(expr, Aggregate) and expr.arg is not None:
+        return [expr.arg]
+    return []
+
+
+def map_subexpressions(expr: Any, fn: Callable[[Any], Any]) -> Any:
+    # Copy of an expression node with fn applied to its direct operands
+    if isinstance(expr, (UnaryOp, IsNull)):
+        return replace(expr, operand=fn(expr.operand))
+    if isinstance(expr, BinaryOp):
+        return replace(expr, left=fn(expr.left), right=fn(expr.right))
+    if isinstance(expr, InList):
+        return replace(expr, operand=fn(expr.operand), values=[fn(value) for value in expr.values])
+    if isinstance(expr, Between):
+        return replace(expr, operand=fn(expr.operand), low=fn(expr.low), high=fn(expr.high))
+    if isinstance(expr, Like):
+        return replace(expr, operand=fn(expr.operand), pattern=fn(expr.pattern))
+    if isinstance(expr, Aggregate) and expr.arg is not None:
+        return replace(expr, arg=fn(expr.arg))
+    return expr
+
+
+def has_aggregate(expr: Any) -> bool:
+    return isinstance(expr, Aggregate) or any(has_aggregate(part) for part in subexpressions(expr))
+
+
+def conjuncts(expr: Any) -> List[Any]:
+    # Flatten a tree of ANDs into its operands
+    if isinstance(expr, BinaryOp) and expr.op == "AND":
+        return conjuncts(expr.left) + conjuncts(expr.right)
+    return [expr] if expr is not None else []
+
+
+def conjoin(parts: List[Any]) -> Any:
+    if not parts:
+        return None
+    expr = parts[0]
+    for part in parts[1:]:
+        expr = BinaryOp("AND", expr, part)
+    return expr
+
+
+@lru_cache(maxsize=256)
+def like_regex(pattern: str) -> "re.Pattern":
+    # % matches any run of characters, _ exactly one
+    return re.compile("".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern),
+                      re.DOTALL)
+
+
+OPERATORS = {"=": operator.eq, "!=": operator.ne, "<": operator.lt, ">": operator.gt,
+             "<=": operator.le, ">=": operator.ge, "+": operator.add, "-": operator.sub,
+             "*": operator.mul}
+
+
+def _divide(left: Any, right: Any) -> Any:
+    if isinstance(left, int) and isinstance(right, int):
+        # Integer division truncates toward zero
+        quotient = abs(left) // abs(right)
+        return quotient if (left < 0) == (right < 0) else -quotient
+    return left / right
+
+
+def _modulo(left: Any, right: Any) -> Any:
+    # The remainder of the truncating division above: it takes the sign of
+    # the dividend, so (a / b) * b + a % b == a
+    if right == 0:
+        raise ZeroDivisionError
+    if isinstance(left, int) and isinstance(right, int):
+        remainder = abs(left) % abs(right)
+        return remainder if left >= 0 else -remainder
+    return math.fmod(left, right)
+
+
+def _concat(left: Any, right: Any) -> str:
+    return f"{left}{right}"
+
+
+Compiled = Callable[[Tuple, Tuple], Any]
+
+
+def compile_expr(expr: Any, positions: Dict[str, int]) -> Compiled:
+    # Turn an expression into a closure over (row, params). Column slots,
+    # operators, literal IN lists and LIKE patterns are resolved here once,
+    # so evaluating a row is only calls between closures. Anything compared
+    # with NULL is None, which filters treat as false.
+    if isinstance(expr, ColumnRef):
+        pos = positions[expr.name]
+        return lambda row, params: row[pos]
+    if isinstance(expr, Literal):
+        value = expr.value
+        return lambda row, params: value
+    if isinstance(expr, Param):
+        index = expr.index
+        return lambda row, params: params[index]
+    if isinstance(expr, BinaryOp):
+        return _compile_binary(expr, positions)
+    if isinstance(expr, UnaryOp):
+        operand = compile_expr(expr.operand, positions)
+        if expr.op == "NOT":
+            def negate(row, params):
+                value = operand(row, params)
+                return None if value is None else not value
+            return negate
+        
+        def minus(row, params):
+            value = operand(row, params)
+            return None if value is None else -value
+        return minus
+    if isinstance(expr, IsNull):
+        operand, negated = compile_expr(expr.operand, positions), expr.negated
+        return lambda row, params: (operand(row, params) is None) != negated
+    if isinstance(expr, InList):
+        return _compile_in(expr, positions)
+    if isinstance(expr, Between):
+        operand, low, high = (compile_expr(part, positions) for part in (expr.operand, expr.low, expr.high))
+        negated = expr.negated
+        
+        def between(row, params):
+            value, lower, upper = operand(row, params), low(row, params), high(row, params)
+            if value is None or lower is None or upper is None:
+                return None
+            try:
+                return (lower <= value <= upper) != negated
+            except TypeError:
+                raise ValueError(f"Cannot compare {type(value).__name__} with {type(lower).__name__}")
+        return between
+    if isinstance(expr, Like):
+        return _compile_like(expr, positions)
+    if isinstance(expr, Aggregate):
+        raise ValueError(f"Aggregate function {expr.func} is not allowed here")
+    raise ValueError(f"Unsupported expression: {expr}")
+
+
+def compile_key(exprs: List[Any], positions: Dict[str, int]) -> Compiled:
+    # Closure returning the value of one expression, or a tuple of several;
+    # plain columns are fetched by a single itemgetter
+    if all(isinstance(expr, ColumnRef) for expr in exprs):
+        getter = operator.itemgetter(*(positions[expr.name] for expr in exprs))
+        return lambda row, params: getter(row)
+    parts = [compile_expr(expr, positions) for expr in exprs]
+    if len(parts) == 1:
+        return parts[0]
+    return lambda row, params: tuple([part(row, params) for part in parts])
+
+
+def _compile_binary(expr: BinaryOp, positions: Dict[str, int]) -> Compiled:
+    op = expr.op
+    left, right = compile_expr(expr.left, positions), compile_expr(expr.right, positions)
+    if op == "AND":
+        def conjunction(row, params):
+            lhs = left(row, params)
+            if lhs is not None and not lhs:
+                return False
+            rhs = right(row, params)
+            if rhs is not None and not rhs:
+                return False
+            return None if lhs is None or rhs is None else True
+        return conjunction
+    if op == "OR":
+        def disjunction(row, params):
+            lhs = left(row, params)
+            if lhs:
+                return True
+            rhs = right(row, params)
+            if rhs:
+                return True
+            return None if lhs is None or rhs is None else False
+        return disjunction
+    
+    func = _divide if op == "/" else _modulo if op == "%" else _concat if op == "||" else OPERATORS[op]
+    
+    def fail(lhs, rhs, error):
+        if isinstance(error, ZeroDivisionError):
+            return ValueError("Division by zero")
+        return ValueError(f"Cannot apply '{op}' to {type(lhs).__name__} and {type(rhs).__name__}")
+    
+    if isinstance(expr.left, ColumnRef) and isinstance(expr.right, Literal):
+        # column <op> literal, the shape of most filters
+        pos, value = positions[expr.left.name], expr.right.value
+        if value is None:
+            return lambda row, params: None
+        
+        def column_literal(row, params):
+            lhs = row[pos]
+            if lhs is None:
+                return None
+            try:
+                return func(lhs, value)
+            except (TypeError, ZeroDivisionError) as e:
+                raise fail(lhs, value, e)
+        return column_literal
+    
+    def binary(row, params):
+        lhs, rhs = left(row, params), right(row, params)
+        if lhs is None or rhs is None:
+            return None
+        try:
+            return func(lhs, rhs)
+        except (TypeError, ZeroDivisionError) as e:
+            raise fail(lhs, rhs, e)
+    return binary
+
+
+def _compile_in(expr: InList, positions: Dict[str, int]) -> Compiled:
+    # x IN (a, b) is x = a OR x = b: without a match, a NULL in the list
+    # makes the result NULL, so x NOT IN (1, NULL) holds for no row
+    operand, negated = compile_expr(expr.operand, positions), expr.negated
+    if all(isinstance(value, Literal) for value in expr.values):
+        # A literal list becomes a set probe
+        members = frozenset(value.value for value in expr.values if value.value is not None)
+        has_null = any(value.value is None for value in expr.values)
+        
+        def in_set(row, params):
+            value = operand(row, params)
+            if value is None:
+                return None
+            if value in members:
+                return not negated
+            return None if has_null else negated
+        return in_set
+    values = [compile_expr(value, positions) for value in expr.values]
+    
+    def in_list(row, params):
+        value = operand(row, params)
+        if value is None:
+            return None
+        candidates = [v(row, params) for v in values]
+        if value in candidates:
+            return not negated
+        return None if None in candidates else negated
+    return in_list
+
+
+def _compile_like(expr: Like, positions: Dict[str, int]) -> Compiled:
+    operand, negated = compile_expr(expr.operand, positions), expr.negated
+    if isinstance(expr.pattern, Literal):
+        if expr.pattern.value is None:
+            return lambda row, params: None
+        match = like_regex(str(expr.pattern.value)).fullmatch
+        
+        def like_literal(row, params):
+            value = operand(row, params)
+            return None if value is None else bool(match(str(value))) != negated
+        return like_literal
+    pattern = compile_expr(expr.pattern, positions)
+    
+    def like(row, params):
+        value, text = operand(row, params), pattern(row, params)
+        if value is None or text is None:
+            return None
+        return bool(like_regex(str(text)).fullmatch(str(value))) != negated
+    return like
+
+
+# Statements
+@dataclass
+class CreateTable:
+    name: str
+    columns: List[Column]
+    layout: StorageLayout = StorageLayout.ROW
+    if_not_exists: bool = False
+
+
+@dataclass
+class CreateIndex:
+    name: str
+    table: str
+    columns: List[str]
+    index_type: IndexType = IndexType.HASH
+
+
+@dataclass
+class DropTable:
+    name: str
+    if_exists: bool = False
+
+
+@dataclass
+class OnConflict:
+    columns: Optional[List[str]]  # the conflict target
+    assignments: Optional[List[Tuple[str, Any]]] = None  # None for DO NOTHING
+    where: Any = None
+
+
+@dataclass
+class Insert:
+    table: str
+    columns: Optional[List[str]]
+    rows: List[List[Any]]  # the value expressions of each VALUES tuple
+    on_conflict: Optional[OnConflict] = None
+
+
+@dataclass
+class SelectItem:
+    expr: Any
+    name: str  # the alias, or the expression as written
+
+
+@dataclass
+class TableRef:
+    name: str
+    alias: Optional[str] = None
+
+
+@dataclass
+class Join:
+    table: TableRef
+    condition: Any = None
+
+
+@dataclass
+class Select:
+    items: Optional[List[SelectItem]]  # None for SELECT *
+    table: TableRef
+    joins: List[Join] = field(default_factory=list)
+    where: Any = None
+    order_by: List[Tuple[Any, bool]] = field(default_factory=list)  # (expression, descending)
+    limit: Any = None
+    offset: Any = None
+    group_by: List[Any] = field(default_factory=list)
+    having: Any = None
+
+
+@dataclass
+class Update:
+    table: str
+    assignments: List[Tuple[str, Any]]
+    where: Any = None
+
+
+@dataclass
+class Delete:
+    table: str
+    where: Any = None
+
+
+@dataclass
+class Vacuum:
+    table: Optional[str] = None
+
+
+@dataclass
+class Copy:
+    table: str
+    columns: Optional[List[str]]
+    direction: str  # FROM (import) or TO (export)
+    path: str
+    options: Dict[str, Any] = field(default_factory=dict)  # FORMAT, HEADER, WORKERS
+
+
+@dataclass
+class TransactionControl:
+    action: str  # BEGIN, COMMIT or ROLLBACK
+
+
+class Parser:
+    # Binding strength of binary operators; 4 covers comparisons and the
+    # IS / IN / BETWEEN / LIKE predicates (NOT here means NOT IN etc.)
+    PRECEDENCE = {"OR": 1, "AND": 2, "=": 4, "!=": 4, "<>": 4, "<": 4, ">": 4, "<=": 4, ">=": 4,
+                  "IS": 4, "IN": 4, "BETWEEN": 4, "LIKE": 4, "NOT": 4,
+                  "+": 5, "-": 5, "||": 5, "*": 6, "/": 6, "%": 6}
+    
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.tokens = tokenize(sql)
+        self.pos = 0
+        self.param_count = 0
+    
+    # Token helpers
+    def peek(self) -> Tuple[str, Any, int]:
+        return self.tokens[self.pos]
+    
+    def advance(self) -> Tuple[str, Any, int]:
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+    
+    def accept(self, keyword: str) -> bool:
+        kind, value, _ = self.tokens[self.pos]
+        if kind == "KEYWORD" and value == keyword:
+            self.pos += 1
+            return True
+        return False
+    
+    def accept_op(self, op: str) -> bool:
+        kind, value, _ = self.tokens[self.pos]
+        if kind == "OP" and value == op:
+            self.pos += 1
+            return True
+        return False
+    
+    def expect(self, keyword: str):
+        if not self.accept(keyword):
+            raise self.error(keyword)
+    
+    def expect_op(self, op: str):
+        if not self.accept_op(op):
+            raise self.error(f"'{op}'")
+    
+    def accept_pair(self, first: str, second: str) -> bool:
+        # Two keywords in a row, as in IF NOT EXISTS; a lone first one may be a name
+        # (the token after a keyword is at worst EOF)
+        if self.peek()[:2] == ("KEYWORD", first) and self.tokens[self.pos + 1][:2] == ("KEYWORD", second):
+            self.pos += 2
+            return True
+        return False
+    
+    def at_ident(self) -> bool:
+        kind, value, _ = self.tokens[self.pos]
+        return kind == "IDENT" or (kind == "KEYWORD" and value in NONRESERVED_KEYWORDS)
+    
+    def expect_ident(self) -> str:
+        kind, value, pos = self.tokens[self.pos]
+        if not self.at_ident():
+            raise self.error("a name")
+        self.pos += 1
+        # A non-reserved keyword names things as spelled
+        return value if kind == "IDENT" else self.sql[pos:pos + len(value)]
+    
+    def error(self, expected: str) -> ValueError:
+        kind, _, pos = self.tokens[self.pos]
+        found = "end of input" if kind == "EOF" else repr(self.sql[pos:self.tokens[self.pos + 1][2]].strip())
+        return ValueError(f"Syntax error at position {pos}: expected {expected}, found {found}")
+    
+    # Statements
+    def parse_statement(self) -> Any:
+        kind, keyword, _ = self.peek()
+        if kind != "KEYWORD":
+            raise ValueError(f"Unsupported SQL command: {self.sql.strip()}")
+        if keyword == "SELECT":
+            stmt = self.parse_select()
+        elif keyword == "INSERT":
+            stmt = self.parse_insert()
+        elif keyword == "UPDATE":
+            stmt = self.parse_update()
+        elif keyword == "DELETE":
+            stmt = self.parse_delete()
+        elif keyword == "CREATE":
+            stmt = self.parse_create()
+        elif keyword == "DROP":
+            stmt = self.parse_drop()
+        elif keyword == "COPY":
+            stmt = self.parse_copy()
+        elif keyword == "VACUUM":
+            self.advance()
+            stmt = Vacuum(self.expect_ident() if self.at_ident() else None)
+        elif keyword in ("BEGIN", "COMMIT", "ROLLBACK"):
+            self.advance()
+            self.accept("TRANSACTION")
+            stmt = TransactionControl(keyword)
+        else:
+            raise ValueError(f"Unsupported SQL command: {self.sql.strip()}")
+        self.accept_op(";")
+        if self.peek()[0] != "EOF":
+            raise self.error("end of statement")
+        return stmt
+    
+    def parse_select(self) -> Select:
+        self.expect("SELECT")
+        items = None
+        if not self.accept_op("*"):
+            items = [self.parse_select_item()]
+            while self.accept_op(","):
+                items.append(self.parse_select_item())
+        self.expect("FROM")
+        table = self.parse_table_ref()
+        joins = []
+        while True:
+            if self.accept("INNER"):
+                self.expect("JOIN")
+            elif not self.accept("JOIN"):
+                break
+            join_table = self.parse_table_ref()
+            joins.append(Join(join_table, self.parse_expr() if self.accept("ON") else None))
+        where = self.parse_expr() if self.accept("WHERE") else None
+        group_by = []
+        if self.accept("GROUP"):
+            self.expect("BY")
+            group_by.append(self.parse_expr())
+            while self.accept_op(","):
+                group_by.append(self.parse_expr())
+        having = self.parse_expr() if self.accept("HAVING") else None
+        order_by = []
+        if self.accept("ORDER"):
+            self.expect("BY")
+            order_by.append(self.parse_order_term())
+            while self.accept_op(","):
+                order_by.append(self.parse_order_term())
+        limit = offset = None
+        if self.accept("LIMIT"):
+            limit = self.parse_expr()
+        if self.accept("OFFSET"):
+            offset = self.parse_expr()
+        return Select(items, table, joins, where, order_by, limit, offset, group_by, having)
+    
+    def parse_select_item(self) -> SelectItem:
+        start = self.peek()[2]
+        expr = self.parse_expr()
+        # Columns are named without their quotes, expressions as written
+        name = expr.name if isinstance(expr, ColumnRef) else self.sql[start:self.peek()[2]].strip()
+        if self.accept("AS") or self.peek()[0] == "IDENT":
+            name = self.expect_ident()
+        return SelectItem(expr, name)
+    
+    def parse_table_ref(self) -> TableRef:
+        name = self.expect_ident()
+        if self.accept("AS") or self.peek()[0] == "IDENT":
+            return TableRef(name, self.expect_ident())
+        return TableRef(name)
+    
+    def parse_order_term(self) -> Tuple[Any, bool]:
+        expr = self.parse_expr()
+        if self.accept("DESC"):
+            return expr, True
+        self.accept("ASC")
+        return expr, False
+    
+    def parse_insert(self) -> Insert:
+        self.expect("INSERT")
+        self.expect("INTO")
+        table = self.expect_ident()
+        columns = None
+        if self.accept_op("("):
+            columns = self.parse_name_list()
+        self.expect("VALUES")
+        rows = [self.parse_values()]
+        while self.accept_op(","):
+            rows.append(self.parse_values())
+        on_conflict = None
+        if self.accept("ON"):
+            on_conflict = self.parse_on_conflict()
+        return Insert(table, columns, rows, on_conflict)
+    
+    def parse_on_conflict(self) -> OnConflict:
+        # ON CONFLICT [(col)] DO NOTHING | DO UPDATE SET col = expr, ... [WHERE cond]
+        self.expect("CONFLICT")
+        columns = self.parse_name_list() if self.accept_op("(") else None
+        self.expect("DO")
+        if self.accept("NOTHING"):
+            return OnConflict(columns)
+        self.expect("UPDATE")
+        self.expect("SET")
+        assignments = self.parse_assignments()
+        where = self.parse_expr() if self.accept("WHERE") else None
+        return OnConflict(columns, assignments, where)
+    
+    def parse_values(self) -> List[Any]:
+        self.expect_op("(")
+        values = [self.parse_expr()]
+        while self.accept_op(","):
+            values.append(self.parse_expr())
+        self.expect_op(")")
+        return values
+    
+    def parse_update(self) -> Update:
+        self.expect("UPDATE")
+        table = self.expect_ident()
+        self.expect("SET")
+        assignments = self.parse_assignments()
+        where = self.parse_expr() if self.accept("WHERE") else None
+        return Update(table, assignments, where)
+    
+    def parse_assignments(self) -> List[Tuple[str, Any]]:
+        assignments = []
+        while True:
+            column = self.expect_ident()
+            self.expect_op("=")
+            assignments.append((column, self.parse_expr()))
+            if not self.accept_op(","):
+                break
+        return assignments
+    
+    def parse_delete(self) -> Delete:
+        self.expect("DELETE")
+        self.expect("FROM")
+        table = self.expect_ident()
+        return Delete(table, self.parse_expr() if self.accept("WHERE") else None)
+    
+    def parse_create(self) -> Any:
+        self.expect("CREATE")
+        if self.accept("INDEX"):
+            name = self.expect_ident()
+            self.expect("ON")
+            table = self.expect_ident()
+            index_type = self.parse_using(IndexType, None)
+            self.expect_op("(")
+            columns = self.parse_name_list()
+            index_type = self.parse_using(IndexType, index_type) or IndexType.HASH
+            return CreateIndex(name, table, columns, index_type)
+        
+        self.expect("TABLE")
+        if_not_exists = self.accept_pair("IF", "NOT")
+        if if_not_exists:
+            self.expect("EXISTS")
+        name = self.expect_ident()
+        self.expect_op("(")
+        columns = [self.parse_column_def()]
+        while self.accept_op(","):
+            columns.append(self.parse_column_def())
+        self.expect_op(")")
+        layout = self.parse_using(StorageLayout, None) or StorageLayout.ROW
+        return CreateTable(name, columns, layout, if_not_exists)
+    
+    def parse_using(self, kind: type, default: Any) -> Any:
+        # Optional "USING <name>" naming a member of the given enum
+        if not self.accept("USING"):
+            return default
+        name = self.expect_ident()
+        if name.upper() not in kind.__members__:
+            label = "storage layout" if kind is StorageLayout else "index type"
+            raise ValueError(f"Unknown {label} '{name}'")
+        return kind[name.upper()]
+    
+    def parse_column_def(self) -> Column:
+        name = self.expect_ident()
+        type_name = self.expect_ident()
+        if type_name.upper() not in DataType.__members__:
+            raise ValueError(f"Unknown data type '{type_name}' for column '{name}'")
+        column = Column(name, DataType[type_name.upper()])
+        while True:
+            if self.accept("PRIMARY"):
+                self.expect("KEY")
+                column.is_primary = column.is_unique = True
+            elif self.accept("UNIQUE"):
+                column.is_unique = True
+            elif self.accept("NOT"):
+                self.expect("NULL")
+                column.is_nullable = False
+            elif self.accept("NULL"):
+                column.is_nullable = True
+            elif self.accept("DEFAULT"):
+                default = self.parse_unary()
+                if not isinstance(default, Literal):
+                    raise ValueError(f"DEFAULT for column '{name}' must be a constant")
+                column.default = default.value
+            else:
+                return column
+    
+    def parse_drop(self) -> DropTable:
+        self.expect("DROP")
+        self.expect("TABLE")
+        if_exists = self.accept_pair("IF", "EXISTS")
+        return DropTable(self.expect_ident(), if_exists)
+    
+    def parse_copy(self) -> Copy:
+        # COPY table [(col, ...)] FROM|TO 'path' [WITH]
+        #     [(FORMAT csv|jsonl, HEADER [bool], NULL 'marker', WORKERS n)]
+        self.expect("COPY")
+        table = self.expect_ident()
+        columns = self.parse_name_list() if self.accept_op("(") else None
+        if self.accept("FROM"):
+            direction = "FROM"
+        else:
+            self.expect("TO")
+            direction = "TO"
+        kind, path, _ = self.advance()
+        if kind != "STRING":
+            self.pos -= 1
+            raise self.error("a file name string")
+        options = {}
+        self.accept("WITH")
+        if self.accept_op("("):
+            while True:
+                name = "NULL" if self.accept("NULL") else self.expect_ident().upper()
+                if name == "NULL":
+                    kind, marker, _ = self.advance()
+                    if kind != "STRING":
+                        self.pos -= 1
+                        raise self.error("a NULL marker string")
+                    options[name] = marker
+                elif name == "FORMAT":
+                    options[name] = self.expect_ident().lower()
+                elif name == "HEADER":
+                    options[name] = not self.accept("FALSE")
+                    self.accept("TRUE")
+                elif name == "WORKERS":
+                    kind, value, _ = self.advance()
+                    if kind != "NUMBER" or not isinstance(value, int):
+                        self.pos -= 1
+                        raise self.error("a number of workers")
+                    options[name] = value
+                else:
+                    raise ValueError(f"Unknown COPY option: {name}")
+                if not self.accept_op(","):
+                    break
+            self.expect_op(")")
+        return Copy(table, columns, direction, path, options)
+    
+    def parse_name_list(self) -> List[str]:
+        # Names up to and including the closing parenthesis
+        names = [self.expect_ident()]
+        while self.accept_op(","):
+            names.append(self.expect_ident())
+        self.expect_op(")")
+        return names
+    
+    # Expressions, by precedence climbing
+    def parse_expr(self, min_precedence: int = 1) -> Any:
+        if self.accept("NOT"):
+            # Prefix NOT binds looser than comparisons, tighter than AND
+            left = UnaryOp("NOT", self.parse_expr(3))
+        else:
+            left = self.parse_unary()
+        tokens = self.tokens
+        while True:
+            kind, op, _ = tokens[self.pos]
+            if kind != "OP" and kind != "KEYWORD":
+                return left
+            precedence = self.PRECEDENCE.get(op)
+            if precedence is None or precedence < min_precedence:
+                return left
+            self.pos += 1
+            if kind == "KEYWORD" and precedence == 4:
+                left = self.parse_predicate(left, op)
+            else:
+                right = self.parse_expr(precedence + 1)
+                left = BinaryOp("!=" if op == "<>" else op, left, right)
+    
+    def parse_predicate(self, left: Any, keyword: str) -> Any:
+        # The rest of "left IS [NOT] NULL", "left [NOT] IN (...)",
+        # "left [NOT] BETWEEN a AND b" or "left [NOT] LIKE pattern"
+        if keyword == "IS":
+            negated = self.accept("NOT")
+            self.expect("NULL")
+            return IsNull(left, negated)
+        negated = keyword == "NOT"
+        if negated:
+            keyword = self.advance()[1]
+        if keyword == "IN":
+            self.expect_op("(")
+            values = [self.parse_expr()]
+            while self.accept_op(","):
+                values.append(self.parse_expr())
+            self.expect_op(")")
+            return InList(left, values, negated)
+        if keyword == "BETWEEN":
+            low = self.parse_expr(5)
+            self.expect("AND")
+            return Between(left, low, self.parse_expr(5), negated)
+        if keyword == "LIKE":
+            return Like(left, self.parse_expr(5), negated)
+        self.pos -= 1
+        raise self.error("IN, BETWEEN or LIKE")
+    
+    def parse_unary(self) -> Any:
+        if self.accept_op("-"):
+            operand = self.parse_unary()
+            if isinstance(operand, Literal) and isinstance(operand.value, (int, float)):
+                return Literal(-operand.value)
+            return UnaryOp("-", operand)
+        self.accept_op("+")
+        return self.parse_primary()
+    
+    def parse_primary(self) -> Any:
+        kind, value, _ = self.tokens[self.pos]
+        if kind == "NUMBER" or kind == "STRING":
+            self.pos += 1
+            return Literal(value)
+        if self.at_ident():
+            value = self.expect_ident()
+            if kind == "IDENT" and self.peek()[:2] == ("OP", "("):
+                return self.parse_aggregate(value.upper())
+            if self.accept_op("."):
+                return ColumnRef(f"{value}.{self.expect_ident()}")
+            return ColumnRef(value)
+        if kind == "KEYWORD" and value in ("TRUE", "FALSE", "NULL"):
+            self.pos += 1
+            return Literal({"TRUE": True, "FALSE": False, "NULL": None}[value])
+        if kind == "PARAM":
+            self.pos += 1
+            self.param_count += 1
+            return Param(self.param_count - 1)
+        if self.accept_op("("):
+            expr = self.parse_expr()
+            self.expect_op(")")
+            return expr
+        raise self.error("an expression")
+    
+    def parse_aggregate(self, func: str) -> Aggregate:
+        if func not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Unknown function: {func}")
+        self.expect_op("(")
+        if func == "COUNT" and self.accept_op("*"):
+            self.expect_op(")")
+            return Aggregate(func)
+        distinct = self.accept("DISTINCT")
+        arg = self.parse_expr()
+        fraction = None
+        if func == "APPROX_PERCENTILE":
+            self.expect_op(",")
+            fraction = self.parse_expr()
+        self.expect_op(")")
+        return Aggregate(func, arg, distinct, fraction)
+
+
+def parse_sql(sql: str) -> Any:
+    return Parser(sql).parse_statement()
+
+
+@dataclass
+class AccessPath:
+    # How a single-table statement reaches its rows: a full "scan", a
+    # "lookup" of index keys matched on every column, a "prefix" of an
+    # ordered composite key, or a "range" scan of an ordered index (without
+    # bounds, a whole index read for its ORDER BY order). Keys and bounds
+    # are literal or parameter expressions, bound on each execution.
+    kind: str = "scan"
+    index: Optional[str] = None
+    keys: List[List[Any]] = field(default_factory=list)
+    lower: Optional[Tuple[Any, bool]] = None  # (expression, inclusive)
+    upper: Optional[Tuple[Any, bool]] = None
+    reverse: bool = False
+    residual: Any = None
+    presorted: bool = False
+
+
+@dataclass
+class Plan:
+    # What a SELECT, UPDATE or DELETE resolved against the schema
+    positions: Dict[str, int]
+    access: Optional[AccessPath] = None
+    items: List[SelectItem] = field(default_factory=list)
+    order_by: List[Tuple[Any, bool]] = field(default_factory=list)
+    projection: Optional[List[Tuple[str, int]]] = None  # when every item is a plain column
+    needed: Optional[List[int]] = None  # columns a columnar scan reads
+    columnar_filters: List[Tuple[int, List[Any]]] = field(default_factory=list)
+    # Expressions compiled against positions
+    where: Optional[Compiled] = None
+    residual: Optional[Compiled] = None
+    joins: List["JoinStep"] = field(default_factory=list)  # in join order, starting with the first table
+    row_counts: Dict[str, int] = field(default_factory=dict)  # cardinalities the join order assumed
+    sort_keys: List[Tuple[Compiled, bool]] = field(default_factory=list)
+    columns: List[Tuple[str, Compiled]] = field(default_factory=list)
+    aggregation: Optional["Aggregation"] = None  # sort keys and columns then read the aggregated rows
+
+
+class JoinMethod(Enum):
+    SCAN = "scan"          # the first table of the join order
+    HASH = "hash"
+    INDEX = "index"        # probe an index of the table for each outer row
+    MERGE = "merge"        # merge two tables read in the order of their BTREE indexes
+    NESTED_LOOP = "nested_loop"
+
+
+@dataclass
+class JoinStep:
+    # One table of a join, in join order. The outer key reads the rows
+    # built so far and the inner key (as well as filter, the conjuncts
+    # reading only this table) the table's own rows; both are a tuple when
+    # key_width > 1. condition holds the remaining conjuncts over the joined
+    # row. index is the probed index for INDEX, and the ordered index each
+    # side is read through for MERGE.
+    table: str
+    method: JoinMethod = JoinMethod.SCAN
+    outer_key: Optional[Compiled] = None
+    inner_key: Optional[Compiled] = None
+    key_width: int = 0
+    filter: Optional[Compiled] = None
+    condition: Optional[Compiled] = None
+    index: Optional[str] = None
+    build_inner: bool = False  # HASH: hash this table and stream the outer rows past it
+
+
+@dataclass
+class JoinStats:
+    hash_joins: int = 0
+    index_joins: int = 0
+    merge_joins: int = 0
+    nested_loop_joins: int = 0
+    spilled_joins: int = 0
+    partitions_spilled: int = 0
+    rows_spilled: int = 0
+    bytes_spilled: int = 0
+    max_build_rows: int = 0
+    
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "hash_joins": self.hash_joins,
+            "index_joins": self.index_joins,
+            "merge_joins": self.merge_joins,
+            "nested_loop_joins": self.nested_loop_joins,
+            "spilled_joins": self.spilled_joins,
+            "partitions_spilled": self.partitions_spilled,
+            "rows_spilled": self.rows_spilled,
+            "bytes_spilled": self.bytes_spilled,
+            "max_build_rows": self.max_build_rows,
+        }
+
+
+class HashJoin:
+    # Equi-join of the rows built so far with one table's rows. The input
+    # the planner expects to be smaller is hashed on its key as it is read
+    # and the other streams past it; NULL keys never match. Once the hash
+    # table would outgrow work_mem bytes, the build rows read so far, the
+    # rest of them and then the probe rows are split by key hash into
+    # temporary files (grace hash join) and joined one partition pair at a
+    # time, re-splitting a partition that is still too big with a
+    # different hash.
+    MAX_DEPTH = 3
+    MAX_PARTITIONS = 64
+    SPILL_BATCH = 1024
+    SAMPLE_ROWS = 100
+    
+    def __init__(self, step: JoinStep, params: Tuple, work_mem: int, spill_dir: str, stats: JoinStats):
+        self.step = step
+        self.params = params
+        self.work_mem = work_mem
+        self.spill_dir = spill_dir
+        self.stats = stats
+        self.spilled = False
+    
+    def run(self, outer: Iterable[Tuple], inner: Iterable[Tuple]) -> Iterator[Tuple]:
+        self.stats.hash_joins += 1
+        left, right = self._keyed(outer, self.step.outer_key), self._keyed(inner, self.step.inner_key)
+        build_left = not self.step.build_inner
+        return self._stream(*((left, right) if build_left else (right, left)), build_left)
+    
+    def _stream(self, build: Iterator[Tuple[Any, Tuple]], probe: Iterator[Tuple[Any, Tuple]],
+                build_left: bool) -> Iterator[Tuple]:
+        rows = []
+        # Row count at which the size estimate is next checked
+        limit = self.SAMPLE_ROWS
+        for item in build:
+            rows.append(item)
+            if len(rows) < limit:
+                continue
+            size = self._estimate_size(rows)
+            if size > self.work_mem:
+                yield from self._spill(rows, build, probe, build_left, size)
+                return
+            limit = max(len(rows) * self.work_mem // size, len(rows) + len(rows) // 8 + 1)
+        if rows:
+            yield from self._probe(self._build(rows), probe, build_left)
+    
+    def _spill(self, rows: List[Tuple[Any, Tuple]], build: Iterator[Tuple[Any, Tuple]],
+               probe: Iterator[Tuple[Any, Tuple]], build_left: bool, size: int) -> Iterator[Tuple]:
+        # The rest of the build side is still unread, so partitions that turn
+        # out too big are split again when they are joined
+        count = min(self.MAX_PARTITIONS, max(2, 2 * -(-size // self.work_mem)))
+        self.spilled = True
+        self.stats.spilled_joins += 1
+        build_parts = self._partition(chain(rows, build), count, 0)
+        del rows
+        probe_parts = self._partition(probe, count, 0)
+        for build_file, probe_file in zip(build_parts, probe_parts):
+            build_rows, probe_rows = self._read(build_file), self._read(probe_file)
+            if build_left:
+                yield from self._join(build_rows, probe_rows, 1)
+            else:
+                yield from self._join(probe_rows, build_rows, 1)
+    
+    def _keyed(self, rows: Iterable[Tuple], key: Compiled) -> Iterator[Tuple[Any, Tuple]]:
+        params = self.params
+        if self.step.key_width == 1:
+            return ((value, row) for row in rows if (value := key(row, params)) is not None)
+        return ((value, row) for row in rows if None not in (value := key(row, params)))
+    
+    def _join(self, left: List[Tuple[Any, Tuple]], right: List[Tuple[Any, Tuple]],
+              depth: int) -> Iterator[Tuple]:
+        build_left = len(left) <= len(right)
+        build, probe = (left, right) if build_left else (right, left)
+        if not build:
+            return
+        size = self._estimate_size(build)
+        if size > self.work_mem and depth < self.MAX_DEPTH:
+            count = min(self.MAX_PARTITIONS, max(2, 2 * -(-size // self.work_mem)))
+            if not self.spilled:
+                self.spilled = True
+                self.stats.spilled_joins += 1
+            left_parts = self._partition(left, count, depth)
+            right_parts = self._partition(right, count, depth)
+            del left, right, build, probe
+            for left_file, right_file in zip(left_parts, right_parts):
+                yield from self._join(self._read(left_file), self._read(right_file), depth + 1)
+            return
+        yield from self._probe(self._build(build), probe, build_left)
+    
+    def _build(self, keyed: List[Tuple[Any, Tuple]]) -> Dict[Any, List[Tuple]]:
+        self.stats.max_build_rows = max(self.stats.max_build_rows, len(keyed))
+        table = defaultdict(list)
+        for key, row in keyed:
+            table[key].append(row)
+        return table
+    
+    def _probe(self, table: Dict[Any, List[Tuple]], probe: Iterable[Tuple[Any, Tuple]],
+               build_left: bool) -> Iterator[Tuple]:
+        condition, params = self.step.condition, self.params
+        for key, row in probe:
+            matches = table.get(key)
+            if matches is None:
+                continue
+            for match in matches:
+                joined = match + row if build_left else row + match
+                if condition is None or condition(joined, params):
+                    yield joined
+    
+    def _estimate_size(self, keyed: List[Tuple[Any, Tuple]]) -> int:
+        # Bytes of the hash table, from a sample of entries
+        sample = keyed[::max(1, len(keyed) // 100)]
+        per_entry = sum(sys.getsizeof(key) + sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row)
+                        for key, row in sample) / len(sample)
+        return int((per_entry + 100) * len(keyed))
+    
+    def _partition(self, keyed: Iterable[Tuple[Any, Tuple]], count: int, depth: int) -> List[Any]:
+        files = [tempfile.TemporaryFile(dir=self.spill_dir) for _ in range(count)]
+        buffers = [[] for _ in range(count)]
+        rows = 0
+        for rows, item in enumerate(keyed, 1):
+            part = hash((depth, item[0])) % count
+            buffer = buffers[part]
+            buffer.append(item)
+            if len(buffer) >= self.SPILL_BATCH:
+                pickle.dump(buffer, files[part], pickle.HIGHEST_PROTOCOL)
+                buffer.clear()
+        for f, buffer in zip(files, buffers):
+            if buffer:
+                pickle.dump(buffer, f, pickle.HIGHEST_PROTOCOL)
+            self.stats.bytes_spilled += f.tell()
+            f.seek(0)
+        self.stats.partitions_spilled += count
+        self.stats.rows_spilled += rows
+        return files
+    
+    def _read(self, f) -> List[Tuple[Any, Tuple]]:
+        keyed = []
+        with f:
+            while True:
+                try:
+                    keyed.extend(pickle.load(f))
+                except EOFError:
+                    return keyed
+
+
+def sort_key(sort_keys: List[Tuple[Compiled, bool]], params: Tuple) -> Callable[[Tuple], Tuple]:
+    # One composite key for ORDER BY, descending parts wrapped in Descending
+    return lambda row: tuple(Descending(order_key(key(row, params))) if descending
+                             else order_key(key(row, params)) for key, descending in sort_keys)
+
+
+@dataclass
+class SortStats:
+    sorts: int = 0
+    external_sorts: int = 0
+    runs_written: int = 0
+    merge_passes: int = 0
+    rows_spilled: int = 0
+    bytes_spilled: int = 0
+    
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "sorts": self.sorts,
+            "external_sorts": self.external_sorts,
+            "runs_written": self.runs_written,
+            "merge_passes": self.merge_passes,
+            "rows_spilled": self.rows_spilled,
+            "bytes_spilled": self.bytes_spilled,
+        }
+
+
+class ExternalSort:
+    # ORDER BY within work_mem bytes. Rows are sorted in memory until the
+    # buffer outgrows the budget; from then on each full buffer is sorted
+    # and written to a temporary file as a run, and the runs are k-way
+    # merged while the output streams. More than MAX_FAN_IN runs are first
+    # merged in groups into longer runs. Stable, like list.sort().
+    MAX_FAN_IN = 64
+    SPILL_BATCH = 1024
+    SAMPLE_ROWS = 100
+    
+    def __init__(self, sort_keys: List[Tuple[Compiled, bool]], params: Tuple, work_mem: int,
+                 spill_dir: str, stats: SortStats):
+        self.sort_keys = sort_keys
+        self.params = params
+        self.key = sort_key(sort_keys, params)
+        self.work_mem = work_mem
+        self.spill_dir = spill_dir
+        self.stats = stats
+        self.batch_size = self.SPILL_BATCH
+    
+    def run(self, rows: Iterable[Tuple]) -> Iterator[Tuple]:
+        self.stats.sorts += 1
+        runs = []
+        buffer = []
+        capacity = None
+        for row in rows:
+            buffer.append(row)
+            if capacity is None and len(buffer) == self.SAMPLE_ROWS:
+                capacity = self._capacity(buffer)
+                # Runs are read back a batch at a time; a full merge holds
+                # about one buffer's worth of rows
+                self.batch_size = max(1, min(self.SPILL_BATCH, capacity // self.MAX_FAN_IN))
+            if capacity is not None and len(buffer) >= capacity:
+                runs.append(self._write_run(buffer))
+                buffer = []
+        if not runs:
+            self._sort_in_memory(buffer)
+            return iter(buffer)
+        
+        self.stats.external_sorts += 1
+        if buffer:
+            runs.append(self._write_run(buffer))
+            del buffer
+        while len(runs) > self.MAX_FAN_IN:
+            self.stats.merge_passes += 1
+            runs = [self._write_run(heapq.merge(*(self._read_run(f) for f in runs[i:i + self.MAX_FAN_IN]),
+                                                key=self.key), presorted=True)
+                    for i in range(0, len(runs), self.MAX_FAN_IN)]
+        self.stats.merge_passes += 1
+        return heapq.merge(*(self._read_run(f) for f in runs), key=self.key)
+    
+    def _capacity(self, sample: List[Tuple]) -> int:
+        # Rows per run that fit in work_mem, from the size of the first rows
+        per_row = sum(sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row) for row in sample) / len(sample)
+        return max(self.SAMPLE_ROWS, int(self.work_mem / (per_row + 50)))
+    
+    def _sort_in_memory(self, rows: List[Tuple]):
+        # Stable sorts from the last key to the first avoid building
+        # composite keys
+        params = self.params
+        for key, descending in reversed(self.sort_keys):
+            rows.sort(key=lambda row: order_key(key(row, params)), reverse=descending)
+    
+    def _write_run(self, rows: Iterable[Tuple], presorted: bool = False) -> Any:
+        if not presorted:
+            self._sort_in_memory(rows)
+        f = tempfile.TemporaryFile(dir=self.spill_dir)
+        batch = []
+        count = 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+                count += len(batch)
+                batch = []
+        if batch:
+            pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+            count += len(batch)
+        self.stats.runs_written += 1
+        self.stats.rows_spilled += count
+        self.stats.bytes_spilled += f.tell()
+        f.seek(0)
+        return f
+    
+    def _read_run(self, f) -> Iterator[Tuple]:
+        with f:
+            while True:
+                try:
+                    batch = pickle.load(f)
+                except EOFError:
+                    return
+                yield from batch
+
+
+def _numeric(func: str, value: Any) -> Any:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{func} requires numeric values, got {type(value).__name__}")
+    return value
+
+
+def _sum_step(total: Any, value: Any) -> Any:
+    value = _numeric("SUM", value)
+    return value if total is None else total + value
+
+
+def _avg_step(state: Any, value: Any) -> Any:
+    value = _numeric("AVG", value)
+    return (value, 1) if state is None else (state[0] + value, state[1] + 1)
+
+
+def _min_step(least: Any, value: Any) -> Any:
+    try:
+        return value if least is None or value < least else least
+    except TypeError:
+        raise ValueError(f"Cannot compare {type(value).__name__} with {type(least).__name__}")
+
+
+def _max_step(greatest: Any, value: Any) -> Any:
+    try:
+        return value if greatest is None or value > greatest else greatest
+    except TypeError:
+        raise ValueError(f"Cannot compare {type(value).__name__} with {type(greatest).__name__}")
+
+
+class HyperLogLog:
+    # Sketch of the number of distinct values in 2**precision registers,
+    # each holding the longest run of leading zero bits seen among the
+    # hashes routed to it (standard error about 1.04 / sqrt(registers):
+    # 0.8% at the default precision, in 16 KiB). Until a sketch has seen a
+    # few distinct hashes the registers stay sparse in a dict, so small
+    # groups cost little. Values hash with blake2b of their repr, so
+    # sketches built in other processes merge by register-wise maximum.
+    def __init__(self, precision: int = 14):
+        if not 4 <= precision <= 18:
+            raise ValueError("HyperLogLog precision must be between 4 and 18")
+        self.precision = precision
+        self.sparse: Optional[Dict[int, int]] = {}
+        self.registers: Optional[bytearray] = None
+    
+    def add(self, value: Any):
+        digest = int.from_bytes(blake2b(repr(value).encode(), digest_size=8).digest(), "big")
+        bits = 64 - self.precision
+        slot = digest >> bits
+        rank = bits - (digest & ((1 << bits) - 1)).bit_length() + 1
+        if self.registers is not None:
+            if rank > self.registers[slot]:
+                self.registers[slot] = rank
+        elif rank > self.sparse.get(slot, 0):
+            self.sparse[slot] = rank
+            if len(self.sparse) > (1 << self.precision) // 128:
+                self._densify()
+    
+    def _densify(self):
+        self.registers = bytearray(1 << self.precision)
+        for slot, rank in self.sparse.items():
+            self.registers[slot] = rank
+        self.sparse = None
+    
+    def merge(self, other: "HyperLogLog"):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        if other.registers is None:
+            for slot, rank in other.sparse.items():
+                if self.registers is not None:
+                    self.registers[slot] = max(self.registers[slot], rank)
+                elif rank > self.sparse.get(slot, 0):
+                    self.sparse[slot] = rank
+            if self.registers is None and len(self.sparse) > (1 << self.precision) // 128:
+                self._densify()
+            return
+        if self.registers is None:
+            self._densify()
+        self.registers = bytearray(map(max, self.registers, other.registers))
+    
+    def estimate(self) -> int:
+        m = 1 << self.precision
+        if self.registers is None:
+            zeros = m - len(self.sparse)
+            harmonic = zeros + sum(2.0 ** -rank for rank in self.sparse.values())
+        else:
+            zeros = self.registers.count(0)
+            harmonic = sum(2.0 ** -rank for rank in self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / harmonic
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate while registers are empty
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+class TDigest:
+    # Sketch of a distribution for percentiles: (mean, weight) centroids
+    # sorted by mean. Centroids may only grow large in the middle of the
+    # distribution (the k1 scale function), so there are at most about
+    # compression of them and the tails stay accurate. Values are buffered
+    # and merged in a batch at a time; digests merge by merging their
+    # centroids the same way.
+    def __init__(self, compression: int = 100):
+        self.compression = compression
+        self.centroids: List[Tuple[float, float]] = []
+        self.buffer: List[Tuple[float, float]] = []
+        self.count = 0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+    
+    def add(self, value: float, weight: float = 1):
+        self.buffer.append((value, weight))
+        self.count += weight
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if len(self.buffer) >= 5 * self.compression:
+            self._compress()
+    
+    def merge(self, other: "TDigest"):
+        if not other.count:
+            return
+        self.buffer.extend(other.centroids)
+        self.buffer.extend(other.buffer)
+        self.count += other.count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self._compress()
+    
+    def _compress(self):
+        if not self.buffer:
+            return
+        points = sorted(self.centroids + self.buffer)
+        self.buffer = []
+        total = self.count
+        scale = self.compression / (2 * math.pi)
+        
+        def limit(q: float) -> float:
+            # The quantile a centroid starting at q may extend to
+            k = scale * math.asin(2 * q - 1) + 1
+            return 1.0 if k >= scale * math.pi / 2 else (math.sin(k / scale) + 1) / 2
+        
+        centroids = []
+        mean, weight = points[0]
+        done = 0.0
+        q_limit = limit(0.0)
+        for value, w in points[1:]:
+            if (done + weight + w) / total <= q_limit:
+                weight += w
+                mean += (value - mean) * w / weight
+            else:
+                centroids.append((mean, weight))
+                done += weight
+                q_limit = limit(done / total)
+                mean, weight = value, w
+        centroids.append((mean, weight))
+        self.centroids = centroids
+    
+    def quantile(self, fraction: float) -> Optional[float]:
+        # Interpolates between the centers of neighbouring centroids
+        self._compress()
+        if not self.count:
+            return None
+        target = fraction * self.count
+        centroids = self.centroids
+        previous_mean, previous_center = self.min, 0.0
+        done = 0.0
+        for mean, weight in centroids:
+            center = done + weight / 2
+            if target < center:
+                if center == previous_center:
+                    return mean
+                return previous_mean + (mean - previous_mean) * (target - previous_center) / (center - previous_center)
+            previous_mean, previous_center = mean, center
+            done += weight
+        if self.count == previous_center:
+            return self.max
+        return previous_mean + (self.max - previous_mean) * (target - previous_center) / (self.count - previous_center)
+
+
+def _hll_step(sketch: Optional[HyperLogLog], value: Any) -> HyperLogLog:
+    if sketch is None:
+        sketch = HyperLogLog()
+    sketch.add(value)
+    return sketch
+
+
+def _tdigest_step(digest: Optional[TDigest], value: Any) -> TDigest:
+    value = _numeric("APPROX_PERCENTILE", value)
+    if digest is None:
+        digest = TDigest()
+    digest.add(value)
+    return digest
+
+
+def _distinct_step(values: Optional[Set], value: Any) -> Set:
+    if values is None:
+        return {value}
+    values.add(value)
+    return values
+
+
+# (initial state, step, final) of each aggregate function; NULL arguments
+# never reach step. States are immutable or created by step, so the
+# initial state can be shared by every group.
+ACCUMULATORS: Dict[str, Tuple[Any, Callable[[Any, Any], Any], Callable[[Any], Any]]] = {
+    "COUNT": (0, lambda count, value: count + 1, lambda count: count),
+    "SUM": (None, _sum_step, lambda total: total),
+    "AVG": (None, _avg_step, lambda state: None if state is None else state[0] / state[1]),
+    "MIN": (None, _min_step, lambda least: least),
+    "MAX": (None, _max_step, lambda greatest: greatest),
+    # Bounded-memory sketches; APPROX_PERCENTILE's final reads the fraction
+    "APPROX_COUNT_DISTINCT": (None, _hll_step, lambda sketch: 0 if sketch is None else sketch.estimate()),
+    "APPROX_PERCENTILE": (None, _tdigest_step, lambda digest, fraction: None if digest is None
+                          else digest.quantile(fraction)),
+}
+
+
+@dataclass
+class Aggregation:
+    # GROUP BY and the aggregate functions of a SELECT. key reads the input
+    # rows (a tuple when key_width > 1, None without GROUP BY: one group of
+    # all rows). Output rows hold the group values and then each aggregate's
+    # result; HAVING, ORDER BY and the select list are compiled against them.
+    key: Optional[Compiled]
+    key_width: int
+    # (function, argument or None for *, distinct, fraction of APPROX_PERCENTILE)
+    aggregates: List[Tuple[str, Optional[Compiled], bool, Optional[Compiled]]]
+    having: Optional[Compiled] = None
+    streaming: bool = False  # the input arrives ordered by the group key
+    columns: List[Optional[int]] = field(default_factory=list)  # slot of each argument that is a plain column
+    from_statistics: bool = False  # answered by the table statistics without reading rows
+
+
+@dataclass
+class AggregateStats:
+    hash_aggregations: int = 0
+    streaming_aggregations: int = 0
+    statistics_answers: int = 0  # aggregates read off the table statistics
+    groups: int = 0
+    max_groups: int = 0  # largest hash table of groups
+    
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "hash_aggregations": self.hash_aggregations,
+            "streaming_aggregations": self.streaming_aggregations,
+            "statistics_answers": self.statistics_answers,
+            "groups": self.groups,
+            "max_groups": self.max_groups,
+        }
+
+
+class GroupAggregate:
+    # Folds each input row into one accumulator per aggregate of its group.
+    # Hash aggregation keeps the accumulators of every group in a dict;
+    # when the input is ordered by the group key, each group is emitted as
+    # soon as the key changes and only one group is held at a time. Rows
+    # are never materialized either way.
+    def __init__(self, aggregation: Aggregation, params: Tuple, stats: AggregateStats):
+        self.aggregation = aggregation
+        self.params = params
+        self.stats = stats
+        self.initial = []
+        self.steps = []
+        self.finals = []
+        for func, arg, distinct, fraction in aggregation.aggregates:
+            initial, step, final = ACCUMULATORS[func]
+            if fraction is not None:
+                final = self._percentile_final(final, fraction(None, params))
+            if arg is None:
+                arg = lambda row, params: True
+            if distinct:
+                initial, step, final = None, _distinct_step, self._distinct_final(initial, step, final)
+            self.initial.append(initial)
+            self.steps.append((arg, step))
+            self.finals.append(final)
+    
+    @staticmethod
+    def _percentile_final(final: Callable[[Any, float], Any], fraction: Any) -> Callable[[Any], Any]:
+        if isinstance(fraction, bool) or not isinstance(fraction, (int, float)) or not 0 <= fraction <= 1:
+            raise ValueError("APPROX_PERCENTILE fraction must be a number between 0 and 1")
+        return lambda digest: final(digest, fraction)
+    
+    @staticmethod
+    def _distinct_final(initial: Any, step: Callable[[Any, Any], Any],
+                        final: Callable[[Any], Any]) -> Callable[[Optional[Set]], Any]:
+        def fold(values):
+            state = initial
+            for value in values or ():
+                state = step(state, value)
+            return final(state)
+        return fold
+    
+    def run(self, rows: Iterable[Tuple]) -> Iterator[Tuple]:
+        if self.aggregation.streaming:
+            self.stats.streaming_aggregations += 1
+            return self._streaming(rows)
+        self.stats.hash_aggregations += 1
+        return self._hash(rows)
+    
+    def _hash(self, rows: Iterable[Tuple]) -> Iterator[Tuple]:
+        key, params, steps = self.aggregation.key, self.params, list(enumerate(self.steps))
+        if key is None:
+            key = lambda row, params: ()
+        groups: Dict[Any, List[Any]] = {}
+        for row in rows:
+            group = key(row, params)
+            states = groups.get(group)
+            if states is None:
+                states = groups[group] = list(self.initial)
+            for j, (arg, step) in steps:
+                value = arg(row, params)
+                if value is not None:
+                    states[j] = step(states[j], value)
+        if self.aggregation.key is None and not groups:
+            # Without GROUP BY even no rows make one group
+            groups[()] = list(self.initial)
+        self.stats.groups += len(groups)
+        self.stats.max_groups = max(self.stats.max_groups, len(groups))
+        single = self.aggregation.key_width == 1
+        for group, states in groups.items():
+            yield self._output((group,) if single else group, states)
+    
+    def _streaming(self, rows: Iterable[Tuple]) -> Iterator[Tuple]:
+        key, params, steps = self.aggregation.key, self.params, list(enumerate(self.steps))
+        single = self.aggregation.key_width == 1
+        current, states = None, None
+        for row in rows:
+            group = key(row, params)
+            if states is None or group != current:
+                if states is not None:
+                    self.stats.groups += 1
+                    yield self._output((current,) if single else current, states)
+                current, states = group, list(self.initial)
+            for j, (arg, step) in steps:
+                value = arg(row, params)
+                if value is not None:
+                    states[j] = step(states[j], value)
+        if states is not None:
+            self.stats.groups += 1
+            yield self._output((current,) if single else current, states)
+    
+    def _output(self, group: Tuple, states: List[Any]) -> Tuple:
+        return group + tuple([final(state) for final, state in zip(self.finals, states)])
 
 
-@dataclass
-class Table:
-    name: str
-    columns: List[Column]
-    rows: List[Dict[str, Any]] = field(default_factory=list)
-    indexes: Dict[str, Index] = field(default_factory=dict)
-    next_row_id: int = 1
-    primary_key_column: Optional[Column] = None
+class JoinEstimator:
+    # Greedy join ordering: from each starting table, repeatedly join the
+    # table whose cheapest method costs least, and keep the cheapest order.
+    # Costs count rows read, hashed, probed and produced. Equality uses
+    # distinct-value counts; other predicates the usual fixed guesses.
+    RANGE_SELECTIVITY = 1 / 3
+    DEFAULT_SELECTIVITY = 1 / 2
+    NUMERIC = {DataType.INTEGER, DataType.REAL}
     
-    def __post_init__(self):
-        for col in self.columns:
-            if col.is_primary:
-                self.primary_key_column = col
-                break
-        self._create_default_indexes()
+    def __init__(self, tables: List[Table], own_positions: List[Dict[str, int]], owner: Dict[int, int],
+                 positions: Dict[str, int], local: List[List[Any]], joining: List[Tuple[Set[int], Any]]):
+        self.tables = tables
+        self.own_positions = own_positions
+        self.owner = owner
+        self.positions = positions
+        self.joining = joining
+        self._distinct: Dict[Tuple[int, str], int] = {}
+        # Estimated rows of each table after its own filters
+        self.cards = [max(1.0, table.row_count * self.selectivity(n, parts))
+                      for n, (table, parts) in enumerate(zip(tables, local))]
     
-    def _create_default_indexes(self):
-        # Create index on primary key
-        if self.primary_key_column:
-            self.indexes["__primary"] = Index([self.primary_key_column.name])
+    def best_order(self) -> Tuple[List[int], List[JoinMethod], List[bool]]:
+        # Join order, each table's join method, and whether the table is
+        # expected to be smaller than the rows joined before it
+        best = None
+        for start in range(len(self.tables)):
+            order, methods, smaller = [start], [JoinMethod.SCAN], [False]
+            cost, rows = self.tables[start].row_count, self.cards[start]
+            while len(order) < len(self.tables):
+                step_cost, produced, method, n = min((self.estimate(order, rows, n) + (n,)
+                                                      for n in range(len(self.tables)) if n not in order),
+                                                     key=lambda candidate: candidate[0])
+                cost += step_cost
+                order.append(n)
+                methods.append(method)
+                smaller.append(self.cards[n] <= rows)
+                rows = produced
+            if best is None or cost < best[0]:
+                best = (cost, order, methods, smaller)
+        return best[1], best[2], best[3]
+    
+    def estimate(self, order: List[int], rows: float, n: int) -> Tuple[float, float, JoinMethod]:
+        # (cost, output rows, method) of joining table n to the tables in order
+        outer = set(order)
+        pairs = []
+        selectivity = 1.0
+        for readers, part in self.joining:
+            if n in readers and readers <= outer | {n}:
+                sides = self.equi_join_sides(part, outer, n)
+                if sides is None:
+                    selectivity *= self.DEFAULT_SELECTIVITY
+                else:
+                    pairs.append(sides)
+                    selectivity /= max(self.side_distinct(sides[0], rows), self.side_distinct(sides[1], self.cards[n]))
+        card, scanned = self.cards[n], self.tables[n].row_count
+        produced = max(1.0, rows * card * selectivity)
+        if not pairs:
+            return scanned + rows * card + produced, produced, JoinMethod.NESTED_LOOP
         
-        # Create indexes on unique columns
-        for col in self.columns:
-            if col.is_unique and col != self.primary_key_column:
-                self.indexes[f"__unique_{col.name}"] = Index([col.name])
+        candidates = [(scanned + rows + 2 * min(rows, card) + produced, JoinMethod.HASH)]
+        found = self.index_for(n, pairs)
+        if found is not None:
+            per_probe = scanned / max(1, len(self.tables[n].indexes[found[0]].entries))
+            candidates.append((rows * (1 + per_probe) + produced, JoinMethod.INDEX))
+        if len(order) == 1 and self.mergeable(order[0], n, pairs[0]):
+            candidates.append((scanned + rows + produced, JoinMethod.MERGE))
+        cost, method = min(candidates, key=lambda candidate: candidate[0])
+        return cost, produced, method
     
-    def add_index(self, name: str, column_names: List[str]):
-        self.indexes[name] = Index(column_names)
-        self._rebuild_index(name)
+    def selectivity(self, n: int, parts: List[Any]) -> float:
+        result = 1.0
+        for part in parts:
+            result *= self.part_selectivity(n, part)
+        return result
     
-    def _rebuild_index(self, index_name: str):
-        if index_name in self.indexes:
-            idx = self.indexes[index_name]
-            idx.entries.clear()
-            for i, row in enumerate(self.rows):
-                key = tuple(row[col] for col in idx.column_names)
-                if key not in idx.entries:
-                    idx.entries[key] = []
-                idx.entries[key].append(i)
+    def part_selectivity(self, n: int, part: Any) -> float:
+        if isinstance(part, BinaryOp):
+            if part.op == "AND":
+                return self.part_selectivity(n, part.left) * self.part_selectivity(n, part.right)
+            if part.op == "OR":
+                left, right = self.part_selectivity(n, part.left), self.part_selectivity(n, part.right)
+                return left + right - left * right
+            if part.op == "=":
+                for column, other in ((part.left, part.right), (part.right, part.left)):
+                    if isinstance(column, ColumnRef) and not any(expression_columns(other)):
+                        return 1 / self.distinct(n, column)
+            if part.op in ("<", ">", "<=", ">="):
+                return self.RANGE_SELECTIVITY
+        if isinstance(part, Between) and not part.negated:
+            return self.RANGE_SELECTIVITY
+        if isinstance(part, InList) and isinstance(part.operand, ColumnRef) and not part.negated:
+            return min(1.0, len(part.values) / self.distinct(n, part.operand))
+        return self.DEFAULT_SELECTIVITY
+    
+    def distinct(self, n: int, column: ColumnRef) -> int:
+        # Distinct values of a column: exact from a single-column index,
+        # otherwise estimated from a sample of rows (GEE estimator)
+        table = self.tables[n]
+        name = table.columns[self.own_positions[n][column.name]].name
+        if (n, name) in self._distinct:
+            return self._distinct[n, name]
+        for idx in table.indexes.values():
+            if idx.column_names == [name]:
+                self._distinct[n, name] = max(1, len(idx.entries))
+                return self._distinct[n, name]
+        pos = table.column_positions[name]
+        rows = table.rows
+        step = max(1, len(rows) // 1000)
+        sample = [row[pos] for row in (rows[i] for i in range(0, len(rows), step)) if row is not None]
+        counts = defaultdict(int)
+        for value in sample:
+            counts[value] += 1
+        distinct = len(counts)
+        if sample and len(sample) < table.row_count:
+            singletons = sum(1 for count in counts.values() if count == 1)
+            distinct = min(table.row_count, int(distinct + ((table.row_count / len(sample)) ** 0.5 - 1) * singletons))
+        self._distinct[n, name] = max(1, distinct)
+        return self._distinct[n, name]
+    
+    def side_distinct(self, expr: Any, rows: float) -> float:
+        if isinstance(expr, ColumnRef):
+            return min(self.distinct(self.owner[self.positions[expr.name]], expr), rows)
+        return rows
+    
+    def equi_join_sides(self, part: Any, outer: Set[int], n: int) -> Optional[Tuple[Any, Any]]:
+        # (outer, inner) operands of an = between the tables in outer and table n
+        if not (isinstance(part, BinaryOp) and part.op == "="):
+            return None
+        left = {self.owner[self.positions[name]] for name in expression_columns(part.left)}
+        right = {self.owner[self.positions[name]] for name in expression_columns(part.right)}
+        if left and left <= outer and right == {n}:
+            return part.left, part.right
+        if right and right <= outer and left == {n}:
+            return part.right, part.left
+        return None
+    
+    def column(self, n: int, expr: Any) -> Optional[Column]:
+        if isinstance(expr, ColumnRef) and expr.name in self.own_positions[n]:
+            return self.tables[n].columns[self.own_positions[n][expr.name]]
+        return None
+    
+    def index_for(self, n: int, pairs: List[Tuple[Any, Any]]) -> Optional[Tuple[str, List, List]]:
+        # The index of table n covering the most inner key columns, with
+        # the pairs it covers in its column order and the pairs it does not
+        by_column = {}
+        for outer, inner in pairs:
+            col = self.column(n, inner)
+            if col is not None:
+                by_column.setdefault(col.name, (outer, inner))
+        best = None
+        for name, idx in self.tables[n].indexes.items():
+            if all(col in by_column for col in idx.column_names):
+                if best is None or len(idx.column_names) > len(self.tables[n].indexes[best].column_names):
+                    best = name
+        if best is None:
+            return None
+        covered = [by_column[col] for col in self.tables[n].indexes[best].column_names]
+        return best, covered, [pair for pair in pairs if pair not in covered]
+    
+    def ordered_index(self, n: int, expr: Any) -> Optional[str]:
+        col = self.column(n, expr)
+        if col is None:
+            return None
+        for name, idx in self.tables[n].indexes.items():
+            if idx.ordered and idx.column_names == [col.name]:
+                return name
+        return None
+    
+    def mergeable(self, first: int, n: int, pair: Tuple[Any, Any]) -> bool:
+        # Both keys are columns with ordered indexes and comparable types
+        outer, inner = self.column(first, pair[0]), self.column(n, pair[1])
+        if outer is None or inner is None:
+            return False
+        if self.ordered_index(first, pair[0]) is None or self.ordered_index(n, pair[1]) is None:
+            return False
+        return outer.data_type == inner.data_type or {outer.data_type, inner.data_type} <= self.NUMERIC
+
+
+# COPY: files are read and parsed a chunk of rows at a time
+COPY_CHUNK_ROWS = 10000
+COPY_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "jsonl"}
+BOOLEAN_TEXT = {"true": True, "t": True, "yes": True, "1": True,
+                "false": False, "f": False, "no": False, "0": False}
+# How CSV files spell NULL, so that it differs from an empty string
+COPY_NULL = "\\N"
+
+
+def copy_format(path: str, options: Dict[str, Any]) -> str:
+    fmt = options.get("FORMAT") or COPY_FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValueError(f"Cannot tell the format of '{path}'; use FORMAT csv or jsonl")
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError(f"Unsupported COPY format: {fmt}")
+    return fmt
+
+
+def _parse_boolean(text: str) -> bool:
+    try:
+        return BOOLEAN_TEXT[text.lower()]
+    except KeyError:
+        raise ValueError(f"invalid BOOLEAN value {text!r}")
+
+
+# CSV fields are text; TEXT and DATE (ISO strings) columns keep them as is
+CSV_PARSERS: Dict[str, Callable[[str], Any]] = {"INTEGER": int, "REAL": float, "BOOLEAN": _parse_boolean}
+
+
+def parse_copy_chunk(fmt: str, names: List[str], types: List[str], defaults: List[Any], null: str,
+                     chunk: Tuple[int, List[Any]]) -> List[List[Any]]:
+    # Values of the named columns for one chunk of CSV records or JSONL
+    # lines, numbered from first. A CSV field equal to the null marker is
+    # NULL, and so is an empty one except in a TEXT column, where it is the
+    # empty string. A key missing from a JSON object takes the column
+    # default. Only takes plain arguments, so it can run in a worker process.
+    first, records = chunk
+    rows = []
+    if fmt == "csv":
+        parsers = [CSV_PARSERS.get(data_type) for data_type in types]
+        # Empty fields of non-TEXT columns read as the null marker
+        empties = [null if data_type != "TEXT" else "" for data_type in types]
+        for n, fields in enumerate(records, first):
+            if len(fields) != len(names):
+                raise ValueError(f"Row {n}: expected {len(names)} fields, got {len(fields)}")
+            try:
+                rows.append([None if text == null or (text == "" and empty == null)
+                             else text if parse is None else parse(text)
+                             for parse, empty, text in zip(parsers, empties, fields)])
+            except ValueError as e:
+                raise ValueError(f"Row {n}: {e}")
+        return rows
+    wanted = set(names)
+    for n, line in enumerate(records, first):
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Row {n}: {e}")
+        if not isinstance(obj, dict):
+            raise ValueError(f"Row {n}: expected a JSON object")
+        for key in obj:
+            if key not in wanted:
+                raise ValueError(f"Row {n}: unknown column '{key}'")
+        rows.append([obj.get(name, default) for name, default in zip(names, defaults)])
+    return rows
+
+
+def _map_chunks(fn: Callable[[Any], Any], chunks: Iterable[Any], workers: int) -> Iterator[Any]:
+    # fn over chunks, in order. With workers > 1 the chunks are processed in
+    # a process pool, at most two per worker in flight.
+    if workers <= 1:
+        yield from map(fn, chunks)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(fn, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _csv_text(value: Any, null: str) -> str:
+    if value is None:
+        return null
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+class PreparedStatement:
+    # A parsed statement and its plan. execute() only binds the values of
+    # the ? placeholders, in order.
+    def __init__(self, db: "SimpleRDBMS", sql: str, stmt: Any, param_count: int):
+        self.db = db
+        self.sql = sql
+        self.stmt = stmt
+        self.param_count = param_count
+        self.plan: Optional[Plan] = None
+        self.schema_version = -1
+    
+    def execute(self, params: Iterable[Any] = ()) -> List[Dict[str, Any]]:
+        return self.db._execute_prepared(self, tuple(params))
+    
+    def iterate(self, params: Iterable[Any] = ()) -> Iterator[Dict[str, Any]]:
+        return self.db._iterate_prepared(self, tuple(params))
+    
+    def executemany(self, param_rows: Iterable[Iterable[Any]]) -> List[Dict[str, Any]]:
+        return self.db._execute_many(self, [tuple(params) for params in param_rows])
 
 
 class SimpleRDBMS:
-    def __init__(self, data_dir: str = "data"):
+    def __init__(self, data_dir: str = "data", checkpoint_interval: int = 1000,
+                 durability: Durability = Durability.SYNC, group_commit_window: float = 0.0,
+                 group_commit_size: int = 256, async_flush_interval: float = 0.05,
+                 memory_budget: Optional[int] = None, plan_cache_size: int = 256,
+                 work_mem: int = 64 * 1024 * 1024):
         self.data_dir = data_dir
-        self.tables: Dict[str, Table] = {}
+        # Loads tables on first use and evicts cold ones beyond memory_budget bytes
+        self.tables = TableCatalog(data_dir, memory_budget)
         self.transaction_log: List[str] = []
         self._in_transaction = False
+        # Log records of the open transaction, written to the WAL on COMMIT
+        self._pending_records: List[Tuple] = []
+        # Number of WAL frames after which the log is folded into the snapshots
+        self.checkpoint_interval = checkpoint_interval
+        # Statements execute one at a time; waiting for the log flush happens
+        # outside the lock so concurrent commits can share a flush
+        self._lock = threading.RLock()
+        # Parsed statements by SQL text, least recently used first; their
+        # plans are rebuilt whenever schema_version moves on
+        self._statement_cache: "OrderedDict[str, PreparedStatement]" = OrderedDict()
+        self.plan_cache_size = plan_cache_size
+        self.plan_cache_hits = 0
+        self.plan_cache_misses = 0
+        self.schema_version = 0
+        # Bytes a hash join's hash table or a sort's buffer may hold before
+        # spilling to temporary files under data_dir
+        self.work_mem = work_mem
+        self.join_statistics = JoinStats()
+        self.sort_statistics = SortStats()
+        self.aggregate_statistics = AggregateStats()
         
         if not os.path.exists(data_dir):
             os.makedirs(data_dir)
         
+        self.wal = WriteAheadLog(os.path.join(data_dir, "wal.log"), Durability(durability),
+                                 group_commit_window, group_commit_size, async_flush_interval)
         self._load_tables()
     
     def _save_table(self, table_name: str):
-        table = self.tables[table_name]
-        with open(os.path.join(self.data_dir, f"{table_name}.pkl"), "wb") as f:
-            pickle.dump(table, f)
+        self.tables.save(table_name)
     
     def _load_tables(self):
-        for filename in os.listdir(self.data_dir):
-            if filename.endswith(".pkl"):
-                table_name = filename[:-4]
-                with open(os.path.join(self.data_dir, filename), "rb") as f:
-                    self.tables[table_name] = pickle.load(f)
-    
-    def execute_sql(self, sql: str) -> List[Dict[str, Any]]:
-        sql = sql.strip().replace("\n", " ").replace("\t", " ")
-        
-        if self._in_transaction:
-            self.transaction_log.append(sql)
-        
-        # Parse SQL
-        sql_upper = sql.upper()
-        
-        # CREATE TABLE
-        if sql_upper.startswith("CREATE TABLE"):
-            return self._execute_create_table(sql)
+        # Read the schema of every table; row data is loaded on first use
+        self.tables.open()
         
-        # INSERT
-        elif sql_upper.startswith("INSERT"):
-            return self._execute_insert(sql)
+        # Queue the log tail for replay on top of the last checkpoint
+        self.wal.close()
+        for lsn, records in self.wal.open():
+            for record in records:
+                self.tables.add_log_record(lsn, record)
         
-        # SELECT
-        elif sql_upper.startswith("SELECT"):
-            return self._execute_select(sql)
-        
-        # UPDATE
-        elif sql_upper.startswith("UPDATE"):
-            return self._execute_update(sql)
-        
-        # DELETE
-        elif sql_upper.startswith("DELETE"):
-            return self._execute_delete(sql)
-        
-        # DROP TABLE
-        elif sql_upper.startswith("DROP TABLE"):
-            return self._execute_drop_table(sql)
+        for info in self.tables.infos.values():
+            self.wal.last_lsn = max(self.wal.last_lsn, info.wal_lsn)
+        self.wal.durable_lsn = self.wal.last_lsn
+        # Cached plans may refer to tables or indexes that are gone now
+        self.schema_version += 1
+    
+    def _log_change(self, table_name: str, *record):
+        self._log_changes(table_name, [record])
+    
+    def _log_changes(self, table_name: str, records: List[Tuple]):
+        # The records of one statement go to the log as a single frame. Any
+        # checkpoint waits until the statement is done (_after_statement),
+        # since a vacuum renumbers the row ids it is still working with.
+        records = [(table_name,) + record for record in records]
+        if self._in_transaction:
+            self._pending_records.extend(records)
+            self.tables.pinned.add(table_name)
+            return
+        lsn = self.wal.append(records)
+        self.tables[table_name].wal_lsn = lsn
+        self.tables.dirty.add(table_name)
+    
+    def _after_statement(self, lsn_before: int):
+        # Called once a statement has finished. Tables it loaded, created or
+        # filled may push the loaded ones past memory_budget; cold tables
+        # with unsaved changes are saved on their own as they are evicted
+        # (tables changed by an open transaction are pinned). The log is
+        # only truncated by a checkpoint every checkpoint_interval frames.
+        self.tables.evict_cold(save_dirty=True)
+        if (not self._in_transaction and self.wal.last_lsn != lsn_before and
+                self.wal.frames_since_checkpoint >= self.checkpoint_interval):
+            self.checkpoint()
+    
+    def checkpoint(self):
+        # Fold the log into the table snapshots, then start a fresh log.
+        # Tables with many tombstones are vacuumed on the way. Takes the
+        # statement lock, so it can be called from any thread.
+        with self._lock:
+            if self._in_transaction:
+                raise ValueError("Cannot checkpoint inside a transaction")
+            for table_name in list(self.tables.dirty):
+                if table_name in self.tables:
+                    table = self.tables.peek(table_name)
+                    if table.needs_vacuum():
+                        table.vacuum()
+                    self._save_table(table_name)
+            self.tables.dirty = set()
+            self.wal.truncate()
+            self.tables.evict_cold()
+    
+    def close(self):
+        with self._lock:
+            if self._in_transaction:
+                self._rollback_transaction()
+            self.checkpoint()
+            self.wal.close()
+    
+    def flush_stats(self) -> Dict[str, Any]:
+        # Flush latency and batch sizes, for tuning the group commit window
+        stats = self.wal.stats.as_dict()
+        stats["durability"] = self.wal.durability.value
+        stats["pending_frames"] = self.wal.last_lsn - self.wal.durable_lsn
+        return stats
+    
+    def sort_stats(self) -> Dict[str, Any]:
+        stats = self.sort_statistics.as_dict()
+        stats["work_mem"] = self.work_mem
+        return stats
+    
+    def table_stats(self, name: str) -> Dict[str, Any]:
+        # Row count, bytes and per-column null counts and bounds, kept up
+        # to date on every write
+        if name not in self.tables:
+            raise ValueError(f"Table '{name}' does not exist")
+        return self.tables.statistics(name).as_dict(self.tables.infos[name].columns, self.tables.row_count(name))
+    
+    def aggregate_stats(self) -> Dict[str, Any]:
+        return self.aggregate_statistics.as_dict()
+    
+    def join_stats(self) -> Dict[str, Any]:
+        stats = self.join_statistics.as_dict()
+        stats["work_mem"] = self.work_mem
+        return stats
+    
+    def execute_sql(self, sql: str, params: Iterable[Any] = ()) -> List[Dict[str, Any]]:
+        # Statements are parsed once and kept in the plan cache by their text
+        return self._execute_prepared(self._cached_statement(sql), tuple(params))
+    
+    def prepare(self, sql: str) -> "PreparedStatement":
+        parser = Parser(sql)
+        stmt = parser.parse_statement()
+        return PreparedStatement(self, sql, stmt, parser.param_count)
+    
+    def _cached_statement(self, sql: str) -> "PreparedStatement":
+        key = sql.strip()
+        with self._lock:
+            prepared = self._statement_cache.get(key)
+            if prepared is not None:
+                self._statement_cache.move_to_end(key)
+                self.plan_cache_hits += 1
+                return prepared
+            self.plan_cache_misses += 1
+        prepared = self.prepare(key)
+        with self._lock:
+            self._statement_cache[key] = prepared
+            if len(self._statement_cache) > self.plan_cache_size:
+                self._statement_cache.popitem(last=False)
+        return prepared
+    
+    def plan_cache_stats(self) -> Dict[str, Any]:
+        return {"size": len(self._statement_cache), "capacity": self.plan_cache_size,
+                "hits": self.plan_cache_hits, "misses": self.plan_cache_misses,
+                "schema_version": self.schema_version}
+    
+    def iterate_sql(self, sql: str, params: Iterable[Any] = ()) -> Iterator[Dict[str, Any]]:
+        # Like execute_sql, but a SELECT yields its rows as the caller pulls
+        # them. Other statements may run between rows; whether the rest of
+        # the result sees their changes is undefined.
+        return self._iterate_prepared(self._cached_statement(sql), tuple(params))
+    
+    def _iterate_prepared(self, prepared: "PreparedStatement", params: Tuple) -> Iterator[Dict[str, Any]]:
+        if not isinstance(prepared.stmt, Select):
+            return iter(self._execute_prepared(prepared, params))
+        if len(params) != prepared.param_count:
+            raise ValueError(f"Statement expects {prepared.param_count} parameter(s), got {len(params)}")
+        with self._lock:
+            rows = self._select_rows(prepared.stmt, params, self._plan(prepared))
+        return self._locked(rows)
+    
+    def _locked(self, rows: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        # Each row is produced under the statement lock
+        while True:
+            with self._lock:
+                row = next(rows, None)
+            if row is None:
+                return
+            yield row
+    
+    def _execute_prepared(self, prepared: "PreparedStatement", params: Tuple) -> List[Dict[str, Any]]:
+        if len(params) != prepared.param_count:
+            raise ValueError(f"Statement expects {prepared.param_count} parameter(s), got {len(params)}")
+        with self._lock:
+            lsn_before = self.wal.last_lsn
+            if not isinstance(prepared.stmt, Select):
+                # A write must not change the tables once the log cannot take it
+                self.wal.check_failure()
+            result = self._execute_statement(prepared, params)
+            self._after_statement(lsn_before)
+            lsn_after = self.wal.last_lsn
+        if lsn_after != lsn_before:
+            self.wal.commit(lsn_after)
+        return result
+    
+    def copy_from(self, table_name: str, path: str, columns: Optional[List[str]] = None,
+                  format: Optional[str] = None, header: bool = True, workers: int = 0,
+                  null: str = COPY_NULL) -> int:
+        # Python form of COPY ... FROM; returns the number of rows loaded.
+        # Unlike the statement, any path the process can open is allowed.
+        options = {"FORMAT": format, "HEADER": header, "WORKERS": workers, "NULL": null}
+        with self._lock:
+            rows = self._copy_from(Copy(table_name, columns, "FROM", path, options))[0]["rows"]
+            self._after_statement(self.wal.last_lsn)
+            return rows
+    
+    def copy_to(self, table_name: str, path: str, columns: Optional[List[str]] = None,
+                format: Optional[str] = None, header: bool = True, null: str = COPY_NULL) -> int:
+        options = {"FORMAT": format, "HEADER": header, "NULL": null}
+        with self._lock:
+            return self._copy_to(Copy(table_name, columns, "TO", path, options))[0]["rows"]
+    
+    def executemany(self, sql: str, param_rows: Iterable[Iterable[Any]]) -> List[Dict[str, Any]]:
+        # Run a statement once per parameter tuple. An INSERT becomes one
+        # batch: all rows are validated before any is added, indexed in
+        # bulk and written to the log as a single record.
+        return self._execute_many(self._cached_statement(sql), [tuple(params) for params in param_rows])
+    
+    def _execute_many(self, prepared: "PreparedStatement", param_rows: List[Tuple]) -> List[Dict[str, Any]]:
+        for params in param_rows:
+            if len(params) != prepared.param_count:
+                raise ValueError(f"Statement expects {prepared.param_count} parameter(s), got {len(params)}")
+        with self._lock:
+            lsn_before = self.wal.last_lsn
+            if not isinstance(prepared.stmt, Select):
+                self.wal.check_failure()
+            if isinstance(prepared.stmt, Insert):
+                if self._in_transaction:
+                    self.transaction_log.append(prepared.sql)
+                result = self._execute_insert(prepared.stmt, param_rows)
+            else:
+                result = [row for params in param_rows for row in self._execute_statement(prepared, params)]
+            self._after_statement(lsn_before)
+            lsn_after = self.wal.last_lsn
+        if lsn_after != lsn_before:
+            self.wal.commit(lsn_after)
+        return result
+    
+    def _execute_statement(self, prepared: "PreparedStatement", params: Tuple) -> List[Dict[str, Any]]:
+        if self._in_transaction:
+            self.transaction_log.append(prepared.sql)
         
-        # CREATE INDEX
-        elif sql_upper.startswith("CREATE INDEX"):
-            return self._execute_create_index(sql)
+        stmt = prepared.stmt
         
-        # BEGIN TRANSACTION
-        elif sql_upper.startswith("BEGIN TRANSACTION") or sql_upper.startswith("BEGIN"):
+        if isinstance(stmt, Select):
+            return self._execute_select(stmt, params, self._plan(prepared))
+        elif isinstance(stmt, Insert):
+            return self._execute_insert(stmt, [params])
+        elif isinstance(stmt, Update):
+            return self._execute_update(stmt, params, self._plan(prepared))
+        elif isinstance(stmt, Delete):
+            return self._execute_delete(stmt, params, self._plan(prepared))
+        elif isinstance(stmt, CreateTable):
+            return self._execute_create_table(stmt)
+        elif isinstance(stmt, CreateIndex):
+            return self._execute_create_index(stmt)
+        elif isinstance(stmt, DropTable):
+            return self._execute_drop_table(stmt)
+        elif isinstance(stmt, Vacuum):
+            return self._execute_vacuum(stmt)
+        elif isinstance(stmt, Copy):
+            stmt = replace(stmt, path=self._copy_path(stmt.path))
+            return self._copy_from(stmt) if stmt.direction == "FROM" else self._copy_to(stmt)
+        elif stmt.action == "BEGIN":
             self._begin_transaction()
             return [{"status": "Transaction started"}]
-        
-        # COMMIT
-        elif sql_upper.startswith("COMMIT"):
+        elif stmt.action == "COMMIT":
             result = self._commit_transaction()
             return [{"status": "Transaction committed", "operations": len(result)}]
-        
-        # ROLLBACK
-        elif sql_upper.startswith("ROLLBACK"):
+        else:
             self._rollback_transaction()
             return [{"status": "Transaction rolled back"}]
-        
-        else:
-            raise ValueError(f"Unsupported SQL command: {sql}")
     
-    def _execute_create_table(self, sql: str) -> List[Dict[str, Any]]:
-        pattern = r"CREATE TABLE (\w+)\s*\((.*)\)"
-        match = re.match(pattern, sql, re.IGNORECASE | re.DOTALL)
-        if not match:
-            raise ValueError("Invalid CREATE TABLE syntax")
-        
-        table_name = match.group(1)
-        columns_sql = match.group(2).strip()
-        
+    def _plan(self, prepared: "PreparedStatement") -> Plan:
+        # Plans stay valid until a table or index is created or dropped,
+        # or a joined table grew or shrank a lot
+        if (prepared.plan is None or prepared.schema_version != self.schema_version
+                or self._join_order_stale(prepared.plan)):
+            if isinstance(prepared.stmt, Select):
+                prepared.plan = self._plan_select(prepared.stmt)
+            else:
+                prepared.plan = self._plan_modify(prepared.stmt.table, prepared.stmt.where)
+            prepared.schema_version = self.schema_version
+        return prepared.plan
+    
+    def _join_order_stale(self, plan: Plan) -> bool:
+        for name, count in plan.row_counts.items():
+            if name not in self.tables:
+                return True
+            current = self.tables.row_count(name)
+            if current > 2 * count + 100 or count > 2 * current + 100:
+                return True
+        return False
+    
+    def _execute_create_table(self, stmt: CreateTable) -> List[Dict[str, Any]]:
+        table_name = stmt.name
         if table_name in self.tables:
+            if stmt.if_not_exists:
+                return [{"status": f"Table '{table_name}' already exists, skipped"}]
             raise ValueError(f"Table '{table_name}' already exists")
         
-        columns = []
-        for col_def in columns_sql.split(","):
-            col_def = col_def.strip()
-            if not col_def:
-                continue
-            
-            # Parse column definition
-            parts = col_def.split()
-            col_name = parts[0]
-            data_type_str = parts[1].upper()
-            
-            data_type = DataType(data_type_str)
-            
-            is_primary = "PRIMARY KEY" in col_def.upper()
-            is_unique = "UNIQUE" in col_def.upper() or is_primary
-            is_nullable = "NOT NULL" not in col_def.upper()
-            
-            columns.append(Column(col_name, data_type, is_primary, is_unique, is_nullable))
+        names = [col.name for col in stmt.columns]
+        for name in names:
+            if names.count(name) > 1:
+                raise ValueError(f"Duplicate column '{name}' in table '{table_name}'")
         
-        table = Table(table_name, columns)
+        table = Table(table_name, stmt.columns, layout=stmt.layout)
+        # Log records written before this point belong to earlier incarnations
+        table.wal_lsn = self.wal.last_lsn
         self.tables[table_name] = table
         self._save_table(table_name)
+        self.schema_version += 1
         
-        return [{"status": f"Table '{table_name}' created successfully", "columns": len(columns)}]
+        return [{"status": f"Table '{table_name}' created successfully", "columns": len(stmt.columns)}]
     
-    def _execute_insert(self, sql: str) -> List[Dict[str, Any]]:
-        pattern = r"INSERT INTO (\w+)\s*(?:\(([^)]+)\))?\s*VALUES\s*\(([^)]+)\)"
-        match = re.match(pattern, sql, re.IGNORECASE)
-        if not match:
-            raise ValueError("Invalid INSERT syntax")
-        
-        table_name = match.group(1)
-        columns_str = match.group(2)
-        values_str = match.group(3)
-        
+    def _execute_insert(self, stmt: Insert, param_rows: List[Tuple]) -> List[Dict[str, Any]]:
+        # Every VALUES tuple for every parameter tuple, inserted as a batch
+        table_name = stmt.table
         if table_name not in self.tables:
             raise ValueError(f"Table '{table_name}' does not exist")
         
         table = self.tables[table_name]
         
-        # Parse columns
-        if columns_str:
-            col_names = [c.strip() for c in columns_str.split(",")]
-        else:
-            col_names = [col.name for col in table.columns]
+        col_names = stmt.columns or [col.name for col in table.columns]
+        for exprs in stmt.rows:
+            if len(col_names) != len(exprs):
+                raise ValueError("Column count doesn't match value count")
         
-        # Parse values
-        values = []
-        for v in values_str.split(","):
-            v = v.strip().strip("'")
-            
-            # Try to infer type
-            if v.isdigit():
-                values.append(int(v))
-            elif v.replace('.', '', 1).isdigit():
-                values.append(float(v))
-            elif v.upper() in ('TRUE', 'FALSE'):
-                values.append(v.upper() == 'TRUE')
-            elif v == 'NULL':
-                values.append(None)
-            else:
-                values.append(v)
+        # Create rows; a VALUES tuple of just the ? placeholders in order
+        # takes each parameter tuple as it is
+        constant = self._constant
+        if len(stmt.rows) == 1 and all(isinstance(expr, Param) and expr.index == n
+                                       for n, expr in enumerate(stmt.rows[0])):
+            value_lists = param_rows
+        else:
+            value_lists = ([constant(expr, "VALUES", params) for expr in exprs]
+                           for params in param_rows for exprs in stmt.rows)
+        rows = table.make_rows(col_names, value_lists)
+        if stmt.on_conflict is not None:
+            return self._execute_upsert(table, stmt, rows, param_rows)
         
-        if len(col_names) != len(values):
-            raise ValueError("Column count doesn't match value count")
+        # Validate all rows before adding any
+        self._validate_rows(table, rows)
         
-        # Create row
-        row = {}
-        for col_name, value in zip(col_names, values):
-            row[col_name] = value
+        # Add rows and update indexes
+        if len(rows) == 1:
+            row_id = table.insert_row(rows[0])
+            self._log_change(table_name, "insert", rows[0])
+            return [{"status": "Row inserted successfully", "row_id": row_id}]
+        if rows:
+            table.insert_rows(rows)
+            self._log_change(table_name, "insert_rows", rows)
+        return [{"status": f"{len(rows)} rows inserted successfully", "rows": len(rows)}]
+    
+    def _execute_upsert(self, table: Table, stmt: Insert, rows: List[Tuple],
+                        param_rows: List[Tuple]) -> List[Dict[str, Any]]:
+        # INSERT ... ON CONFLICT: each row is looked up by its conflict
+        # target through the primary/unique index. The existing row is
+        # skipped (DO NOTHING) or updated with SET expressions that read its
+        # columns and the proposed row as excluded.col. Inserts and updates
+        # are validated together before anything changes.
+        on_conflict = stmt.on_conflict
+        targets = on_conflict.columns
+        if targets is None:
+            if on_conflict.assignments is not None:
+                raise ValueError("ON CONFLICT DO UPDATE requires a conflict target")
+            targets = [col.name for col in table.columns if col.is_unique]
+        elif len(targets) != 1:
+            raise ValueError("ON CONFLICT target must be a single PRIMARY KEY or UNIQUE column")
+        lookups = []
+        for name in targets:
+            if name not in table.column_positions:
+                raise ValueError(f"Column '{name}' does not exist")
+            pos = table.column_positions[name]
+            col = table.columns[pos]
+            if not col.is_unique:
+                raise ValueError(f"ON CONFLICT column '{name}' is not a PRIMARY KEY or UNIQUE column")
+            lookups.append((pos, table.unique_index(col)))
         
-        # Validate row
-        self._validate_row(table, row)
+        updates = where = None
+        if on_conflict.assignments is not None:
+            # Existing columns come first, the proposed row after them
+            positions = self._scope([TableRef(stmt.table), TableRef(stmt.table, "excluded")], [table, table])
+            updates = []
+            for col, expr in on_conflict.assignments:
+                if col not in table.column_positions:
+                    raise ValueError(f"Column '{col}' does not exist")
+                self._check_columns(expr, positions)
+                updates.append((col, compile_expr(expr, positions)))
+            self._check_columns(on_conflict.where, positions)
+            where = compile_expr(on_conflict.where, positions) if on_conflict.where is not None else None
         
-        # Add row
-        table.rows.append(row)
+        inserts = []
+        updated_ids = []
+        new_rows = []
+        changes = []
+        touched = set()
+        claimed = {}  # conflict key -> the row of this statement holding it
+        per_params = len(stmt.rows)
+        for n, row in enumerate(rows):
+            row_id = None
+            for pos, idx in lookups:
+                value = row[pos]
+                if value is None:
+                    continue
+                if (pos, value) in claimed:
+                    row_id = claimed[pos, value]
+                    break
+                if idx is not None:
+                    existing = idx.entries.get((value,))
+                    if existing:
+                        row_id = existing[0]
+                        break
+                else:
+                    row_id = next((i for i, other in table.live_rows() if other[pos] == value), None)
+                    if row_id is not None:
+                        break
+            if row_id is None:
+                for pos, _ in lookups:
+                    if row[pos] is not None:
+                        claimed[pos, row[pos]] = -1
+                inserts.append(row)
+                continue
+            if updates is None:
+                continue
+            if row_id < 0 or row_id in touched:
+                raise ValueError("ON CONFLICT DO UPDATE cannot affect a row twice in one statement")
+            touched.add(row_id)
+            params = param_rows[n // per_params]
+            existing = table.rows[row_id]
+            combined = existing + row
+            if where is not None and not where(combined, params):
+                continue
+            values = {col: fn(combined, params) for col, fn in updates}
+            new_row = list(existing)
+            for col, value in values.items():
+                new_row[table.column_positions[col]] = value
+            updated_ids.append(row_id)
+            new_rows.append(tuple(new_row))
+            changes.append(values)
         
-        # Update indexes
-        for idx in table.indexes.values():
-            key = tuple(row[col] for col in idx.column_names if col in row)
-            if key not in idx.entries:
-                idx.entries[key] = []
-            idx.entries[key].append(len(table.rows) - 1)
+        # Validate the updated and inserted rows before changing anything
+        seen = {}
+        if updated_ids:
+            self._validate_rows(table, new_rows, updated_ids, {col for col, _ in updates}, seen)
+        self._validate_rows(table, inserts, seen=seen)
         
-        self._save_table(table_name)
+        records = []
+        if updated_ids:
+            table.update_rows(updated_ids, changes)
+            records.append(("update", updated_ids, changes))
+        if len(inserts) == 1:
+            inserted_ids = [table.insert_row(inserts[0])]
+            records.append(("insert", inserts[0]))
+        elif inserts:
+            first = table.insert_rows(inserts)
+            inserted_ids = list(range(first, first + len(inserts)))
+            records.append(("insert_rows", inserts))
+        else:
+            inserted_ids = []
+        if records:
+            self._log_changes(stmt.table, records)
         
-        return [{"status": "Row inserted successfully", "row_id": len(table.rows)}]
+        result = {"status": f"{len(inserts)} row(s) inserted, {len(updated_ids)} row(s) updated",
+                  "inserted": len(inserts), "updated": len(updated_ids)}
+        if len(rows) == 1 and (inserted_ids or updated_ids):
+            result["row_id"] = (inserted_ids or updated_ids)[0]
+        return [result]
     
-    def _validate_row(self, table: Table, row: Dict[str, Any]):
-        for col in table.columns:
-            if col.name not in row:
-                if not col.is_nullable:
-                    raise ValueError(f"Column '{col.name}' cannot be NULL")
-                continue
-            
-            value = row[col.name]
-            
-            # Type checking
-            if value is not None:
-                if col.data_type == DataType.INTEGER and not isinstance(value, int):
-                    raise ValueError(f"Column '{col.name}' expects INTEGER")
-                elif col.data_type == DataType.REAL and not isinstance(value, (int, float)):
-                    raise ValueError(f"Column '{col.name}' expects REAL")
-                elif col.data_type == DataType.BOOLEAN and not isinstance(value, bool):
-                    raise ValueError(f"Column '{col.name}' expects BOOLEAN")
-            
-            # Unique constraint
-            if col.is_unique and value is not None:
-                for existing_row in table.rows:
-                    if existing_row.get(col.name) == value:
-                        raise ValueError(f"Duplicate value for unique column '{col.name}'")
-    
-    def _execute_select(self, sql: str) -> List[Dict[str, Any]]:
-        # Simple SELECT parsing (no subqueries, limited joins)
-        pattern = r"SELECT (.+?) FROM (.+?)(?: WHERE (.+?))?(?: ORDER BY (.+?))?$"
-        match = re.match(pattern, sql, re.IGNORECASE)
-        if not match:
-            raise ValueError("Invalid SELECT syntax")
-        
-        select_clause = match.group(1).strip()
-        from_clause = match.group(2).strip()
-        where_clause = match.group(3)
-        order_clause = match.group(4)
-        
-        # Parse tables (simple join support)
-        tables = []
-        join_info = []
-        
-        if " JOIN " in from_clause.upper():
-            # Simple join parsing
-            parts = re.split(r'\s+JOIN\s+', from_clause, flags=re.IGNORECASE)
-            for part in parts:
-                if " ON " in part.upper():
-                    table_part, condition = part.split(" ON ", 1)
-                    tables.append(table_part.strip())
-                    join_info.append(condition.strip())
-                else:
-                    tables.append(part.strip())
-        else:
-            tables.append(from_clause)
+    def _validate_rows(self, table: Table, rows: List[Tuple], row_ids: Optional[List[int]] = None,
+                       columns: Optional[Set[str]] = None, seen: Optional[Dict[str, Set]] = None):
+        # NOT NULL and type checks run a column at a time over the batch
+        type_checks = {
+            DataType.INTEGER: lambda value: isinstance(value, int),
+            DataType.REAL: lambda value: isinstance(value, (int, float)),
+            DataType.BOOLEAN: lambda value: isinstance(value, bool),
+            DataType.DATE: self._is_date,
+        }
+        for pos, col in enumerate(table.columns):
+            values = [row[pos] for row in rows]
+            if not col.is_nullable and any(value is None for value in values):
+                raise ValueError(f"Column '{col.name}' cannot be NULL")
+            check = type_checks.get(col.data_type)
+            if check is not None and not all(check(value) for value in values if value is not None):
+                raise ValueError(f"Column '{col.name}' expects {col.data_type.value}")
+        # Unique constraints go through the primary/unique indexes in one pass
+        table.check_unique(rows, row_ids, columns, seen)
+    
+    def _is_date(self, value: Any) -> bool:
+        if isinstance(value, date):
+            return True
+        try:
+            date.fromisoformat(value)
+            return True
+        except (TypeError, ValueError):
+            return False
+    
+    def _plan_select(self, stmt: Select) -> Plan:
+        refs = [stmt.table] + [join.table for join in stmt.joins]
+        for ref in refs:
+            if ref.name not in self.tables:
+                raise ValueError(f"Table '{ref.name}' does not exist")
+        # Names resolve against the schema; a table is only loaded once the
+        # plan needs its rows, indexes or cardinality
+        table_objs = [self.tables.schema(ref.name) for ref in refs]
         
-        # Get table objects
-        table_objs = []
-        for table_name in tables:
-            if table_name not in self.tables:
-                raise ValueError(f"Table '{table_name}' does not exist")
-            table_objs.append(self.tables[table_name])
+        # Rows stay tuples until projection; positions maps plain and
+        # qualified column names to slots of the (joined) row
+        positions = self._scope(refs, table_objs)
+        items = stmt.items
+        if items is None:
+            items = [SelectItem(ColumnRef(col.name), col.name) for col in table_objs[0].columns]
+        for item in items:
+            self._check_columns(item.expr, positions)
+        self._check_columns(stmt.where, positions)
+        for n, join in enumerate(stmt.joins, 2):
+            self._check_columns(join.condition, self._scope(refs[:n], table_objs[:n]))
+        
+        # ORDER BY may name a select list alias
+        aliases = {item.name: item.expr for item in items}
+        order_by = []
+        for expr, descending in stmt.order_by:
+            if isinstance(expr, ColumnRef) and expr.name not in positions and expr.name in aliases:
+                expr = aliases[expr.name]
+            self._check_columns(expr, positions)
+            order_by.append((expr, descending))
+        for clause, expr in (("LIMIT", stmt.limit), ("OFFSET", stmt.offset)):
+            for name in expression_columns(expr):
+                raise ValueError(f"Column '{name}' cannot be used in {clause}")
         
-        # Parse columns
-        if select_clause == "*":
-            columns = [col.name for col in table_objs[0].columns]
+        for clause, expr in [("WHERE", stmt.where)] + [("ON", join.condition) for join in stmt.joins]:
+            if has_aggregate(expr):
+                raise ValueError(f"Aggregate functions are not allowed in {clause}")
+        # GROUP BY may name a select list alias as well
+        group_by = []
+        for expr in stmt.group_by:
+            if isinstance(expr, ColumnRef) and expr.name not in positions and expr.name in aliases:
+                expr = aliases[expr.name]
+            if has_aggregate(expr):
+                raise ValueError("Aggregate functions are not allowed in GROUP BY")
+            self._check_columns(expr, positions)
+            group_by.append(expr)
+        self._check_columns(stmt.having, positions)
+        aggregated = bool(group_by) or stmt.having is not None or any(
+            has_aggregate(expr) for expr in [item.expr for item in items] + [expr for expr, _ in order_by])
+        
+        plan = Plan(positions, items=items, order_by=order_by)
+        if stmt.joins:
+            # Joined rows are laid out in join order, not FROM order
+            table_objs = [self.tables[ref.name] for ref in refs]
+            self._plan_joins(plan, stmt, refs, table_objs)
+            positions = plan.positions
+        output = positions
+        if aggregated:
+            plan.aggregation, items, order_by, output = self._plan_aggregation(
+                group_by, items, stmt.having, order_by, positions)
+        if all(isinstance(item.expr, ColumnRef) for item in items):
+            plan.projection = [(item.name, output[item.expr.name]) for item in items]
+        else:
+            plan.columns = [(item.name, compile_expr(item.expr, output)) for item in items]
+        plan.sort_keys = [(compile_expr(expr, output), descending) for expr, descending in order_by]
+        if stmt.joins:
+            return plan
+        if stmt.where is not None:
+            plan.where = compile_expr(stmt.where, positions)
+        
+        # Single table query. When aggregating, an ordered index that
+        # returns each group's rows together allows streaming aggregation.
+        if aggregated and not group_by and stmt.where is None:
+            # COUNT, MIN and MAX of whole columns come from the statistics
+            plan.aggregation.from_statistics = all(
+                func == "COUNT" and not distinct and (arg is None or col is not None)
+                or func in ("MIN", "MAX") and col is not None
+                for (func, arg, distinct, _), col in zip(plan.aggregation.aggregates, plan.aggregation.columns))
+            if plan.aggregation.from_statistics:
+                return plan
+        table = self.tables[stmt.table.name]
+        if not aggregated:
+            plan.access = self._access_path(table, stmt.where, order_by)
+        elif group_by and all(isinstance(expr, ColumnRef) for expr in group_by):
+            plan.access = self._access_path(table, stmt.where, self._group_order(table, group_by))
+            plan.aggregation.streaming = plan.access.presorted
         else:
-            columns = [col.strip() for col in select_clause.split(",")]
+            plan.access = self._access_path(table, stmt.where)
+        if plan.access.residual is not None:
+            plan.residual = compile_expr(plan.access.residual, positions)
+        if table.layout == StorageLayout.COLUMNAR:
+            # Only read the buffers of columns the query mentions
+            if stmt.items is None:
+                plan.needed = list(range(len(table.columns)))
+            else:
+                mentioned = [name for item in plan.items for name in expression_columns(item.expr)]
+                mentioned += expression_columns(stmt.where)
+                mentioned += [name for expr, _ in plan.order_by for name in expression_columns(expr)]
+                mentioned += [name for expr in group_by for name in expression_columns(expr)]
+                mentioned += expression_columns(stmt.having)
+                plan.needed = sorted({positions[name] for name in mentioned})
+            _, equalities, _ = self._sargable(table, stmt.where)
+            plan.columnar_filters = [(table.column_positions[col], values)
+                                     for col, (_, values) in equalities.items()]
+        return plan
+    
+    def _plan_aggregation(self, group_by: List[Any], items: List[SelectItem], having: Any,
+                          order_by: List[Tuple[Any, bool]], positions: Dict[str, int]
+                          ) -> Tuple[Aggregation, List[SelectItem], List[Tuple[Any, bool]], Dict[str, int]]:
+        # Rewrite the select list, HAVING and ORDER BY to read the aggregated
+        # rows: group expressions become columns "#g<i>" and each distinct
+        # aggregate call a column "#a<j>". Any other column reference is an
+        # error, as its value would differ between the rows of a group.
+        aggregates: List[Aggregate] = []
+        slots = [positions[expr.name] if isinstance(expr, ColumnRef) else None for expr in group_by]
+        
+        def rewrite(expr: Any) -> Any:
+            if isinstance(expr, ColumnRef):
+                if positions[expr.name] not in slots:
+                    raise ValueError(f"Column '{expr.name}' must appear in the GROUP BY clause "
+                                     f"or be used in an aggregate function")
+                return ColumnRef(f"#g{slots.index(positions[expr.name])}")
+            if expr in group_by:
+                return ColumnRef(f"#g{group_by.index(expr)}")
+            if isinstance(expr, Aggregate):
+                if has_aggregate(expr.arg):
+                    raise ValueError("Aggregate function calls cannot be nested")
+                if expr.fraction is not None and not isinstance(expr.fraction, (Literal, Param)):
+                    raise ValueError(f"{expr.func} fraction must be a constant")
+                if expr not in aggregates:
+                    aggregates.append(expr)
+                return ColumnRef(f"#a{aggregates.index(expr)}")
+            return map_subexpressions(expr, rewrite)
+        
+        items = [SelectItem(rewrite(item.expr), item.name) for item in items]
+        order_by = [(rewrite(expr), descending) for expr, descending in order_by]
+        having = rewrite(having) if having is not None else None
+        output = {f"#g{i}": i for i in range(len(group_by))}
+        output.update({f"#a{j}": len(group_by) + j for j in range(len(aggregates))})
+        aggregation = Aggregation(
+            compile_key(group_by, positions) if group_by else None, len(group_by),
+            [(agg.func, None if agg.arg is None else compile_expr(agg.arg, positions), agg.distinct,
+              None if agg.fraction is None else compile_expr(agg.fraction, positions))
+             for agg in aggregates])
+        aggregation.columns = [positions[agg.arg.name] if isinstance(agg.arg, ColumnRef) else None
+                               for agg in aggregates]
+        if having is not None:
+            aggregation.having = compile_expr(having, output)
+        return aggregation, items, order_by, output
+    
+    def _group_order(self, table: Table, group_by: List[ColumnRef]) -> List[Tuple[Any, bool]]:
+        # GROUP BY columns in the order of an ordered index starting with
+        # all of them, if any: scanning it yields each group's rows together
+        names = [expr.name.rpartition(".")[2] for expr in group_by]
+        for idx in table.indexes.values():
+            if idx.ordered and sorted(idx.column_names[:len(names)]) == sorted(names):
+                names = idx.column_names[:len(names)]
+                break
+        return [(ColumnRef(name), False) for name in names]
+    
+    def _plan_joins(self, plan: Plan, stmt: Select, refs: List[TableRef], tables: List[Table]):
+        # Pick the join order and each join's method from cardinalities and
+        # distinct-value estimates, then compile every conjunct against the
+        # row layout of that order. Conjuncts reading one table filter its
+        # rows before the join; those reading several are checked as soon
+        # as their tables are joined (only inner joins exist).
+        positions = plan.positions
+        ends = list(accumulate(len(table.columns) for table in tables))
+        starts = [0] + ends[:-1]
+        owner = {slot: bisect_right(ends, slot) for slot in range(ends[-1])}
+        local = [[] for _ in tables]
+        joining = []
+        residual = []
+        parts = [part for join in stmt.joins for part in conjuncts(join.condition)] + conjuncts(stmt.where)
+        for part in parts:
+            readers = {owner[positions[name]] for name in expression_columns(part)}
+            if not readers:
+                residual.append(part)
+            elif len(readers) == 1:
+                local[readers.pop()].append(part)
+            else:
+                joining.append((readers, part))
+        if residual:
+            plan.residual = compile_expr(conjoin(residual), positions)
+        own_positions = [{name: slot - starts[owner[slot]] for name, slot in positions.items()
+                          if owner[slot] == n} for n in range(len(tables))]
         
-        # Get rows from first table
-        results = []
-        if len(table_objs) == 1:
+        estimator = JoinEstimator(tables, own_positions, owner, positions, local, joining)
+        order, methods, smaller = estimator.best_order()
+        
+        # Slots of the joined row in join order
+        offsets = {}
+        offset = 0
+        for n in order:
+            offsets[n] = offset
+            offset += len(tables[n].columns)
+        plan.positions = positions = {name: offsets[owner[slot]] + slot - starts[owner[slot]]
+                                      for name, slot in positions.items()}
+        
+        used = set()
+        for k, n in enumerate(order):
+            step = JoinStep(refs[n].name, methods[k], build_inner=smaller[k])
+            if local[n]:
+                step.filter = compile_expr(conjoin(local[n]), own_positions[n])
+            joined = set(order[:k + 1])
+            rest = []
+            pairs = []
+            for m, (readers, part) in enumerate(joining):
+                if m in used or n not in readers or not readers <= joined:
+                    continue
+                used.add(m)
+                sides = estimator.equi_join_sides(part, set(order[:k]), n)
+                if sides is None:
+                    rest.append(part)
+                else:
+                    pairs.append(sides)
+            if step.method == JoinMethod.INDEX:
+                # Keys in the column order of the probed index
+                step.index, pairs, extra = estimator.index_for(n, pairs)
+                rest += [BinaryOp("=", outer, inner) for outer, inner in extra]
+            elif step.method == JoinMethod.MERGE:
+                # Both tables are read through their ordered indexes
+                plan.joins[0].index = estimator.ordered_index(order[0], pairs[0][0])
+                step.index = estimator.ordered_index(n, pairs[0][1])
+                rest += [BinaryOp("=", outer, inner) for outer, inner in pairs[1:]]
+                pairs = pairs[:1]
+            if pairs:
+                step.outer_key = compile_key([outer for outer, _ in pairs], positions)
+                step.inner_key = compile_key([inner for _, inner in pairs], own_positions[n])
+                step.key_width = len(pairs)
+            if rest:
+                step.condition = compile_expr(conjoin(rest), positions)
+            plan.joins.append(step)
+        plan.row_counts = {ref.name: table.row_count for ref, table in zip(refs, tables)}
+    
+    def _execute_select(self, stmt: Select, params: Tuple, plan: Plan) -> List[Dict[str, Any]]:
+        return list(self._select_rows(stmt, params, plan))
+    
+    def _select_rows(self, stmt: Select, params: Tuple, plan: Plan) -> Iterator[Dict[str, Any]]:
+        # Pull-based pipeline of generators: scan or join -> filter ->
+        # aggregate -> sort -> project. Rows pass one at a time except
+        # through ORDER BY, hash aggregation and the build side of a hash
+        # join. Index lookups and sorting happen here; everything else as
+        # the caller pulls rows.
+        where = plan.residual
+        presorted = False
+        if plan.aggregation is not None and plan.aggregation.from_statistics:
+            # No rows are read, so a table that is not loaded stays that way
+            results = iter(())
+        elif not stmt.joins:
             # Single table query
-            for row in table_objs[0].rows:
-                results.append(row.copy())
+            table = self.tables[stmt.table.name]
+            results = table.rows
+            access = plan.access
+            candidates = self._candidates(table, access, params)
+            presorted = access.presorted
+            if candidates is not None and plan.sort_keys and not presorted:
+                # Row id order, so ties of the sort below keep the order of
+                # a full scan rather than the index's
+                candidates = sorted(candidates)
+            if isinstance(results, ColumnStore):
+                if candidates is None and plan.columnar_filters:
+                    candidates = self._columnar_candidates(table, plan.columnar_filters, params)
+                    where = plan.where
+                if candidates is not None:
+                    results = results.gather(candidates, plan.needed)
+                else:
+                    results = results.scan(plan.needed)
+            elif candidates is not None:
+                rows = results
+                results = (rows[i] for i in candidates)
+            results = (row for row in results if row is not None)
         else:
-            # Join tables (simple nested loop join)
-            for row1 in table_objs[0].rows:
-                for row2 in table_objs[1].rows:
-                    joined_row = {**row1, **{f"{tables[1]}.{k}": v for k, v in row2.items()}}
-                    results.append(joined_row)
+            results = self._join_rows(plan.joins, params)
         
         # Apply WHERE clause
-        if where_clause:
-            filtered_results = []
-            for row in results:
-                if self._evaluate_where(row, where_clause):
-                    filtered_results.append(row)
-            results = filtered_results
-        
-        # Apply ORDER BY
-        if order_clause:
-            order_cols = [col.strip() for col in order_clause.split(",")]
-            results.sort(key=lambda x: tuple(x.get(col, "") for col in order_cols))
+        if where is not None:
+            results = (row for row in results if where(row, params))
         
-        # Select only requested columns
-        final_results = []
-        for row in results:
-            final_row = {}
-            for col in columns:
-                if col in row:
-                    final_row[col] = row[col]
-                elif "." in col:
-                    # Handle table.column format
-                    final_row[col] = row.get(col, None)
-            final_results.append(final_row)
-        
-        return final_results
-    
-    def _evaluate_where(self, row: Dict[str, Any], condition: str) -> bool:
-        # Simple WHERE evaluation
-        condition = condition.strip()
-        
-        # Handle AND/OR
-        if " AND " in condition.upper():
-            parts = re.split(r'\s+AND\s+', condition, flags=re.IGNORECASE)
-            return all(self._evaluate_where(row, part) for part in parts)
-        elif " OR " in condition.upper():
-            parts = re.split(r'\s+OR\s+', condition, flags=re.IGNORECASE)
-            return any(self._evaluate_where(row, part) for part in parts)
-        
-        # Handle comparisons
-        operators = ["=", "!=", "<", ">", "<=", ">=", "LIKE", "IS NULL", "IS NOT NULL"]
-        
-        for op in operators:
-            if f" {op} " in condition.upper():
-                left, right = condition.split(f" {op} ", 1)
-                left = left.strip()
-                right = right.strip().strip("'")
-                
-                left_val = row.get(left, None)
-                
-                if op.upper() == "IS NULL":
-                    return left_val is None
-                elif op.upper() == "IS NOT NULL":
-                    return left_val is not None
-                elif op.upper() == "LIKE":
-                    # Simple LIKE with % wildcard
-                    pattern = right.replace("%", ".*")
-                    return bool(re.match(pattern, str(left_val or "")))
-                else:
-                    # Convert right value
-                    if right.isdigit():
-                        right_val = int(right)
-                    elif right.replace('.', '', 1).isdigit():
-                        right_val = float(right)
-                    elif right.upper() in ("TRUE", "FALSE"):
-                        right_val = right.upper() == "TRUE"
-                    elif right == "NULL":
-                        right_val = None
-                    else:
-                        right_val = right
-                    
-                    # Compare
-                    if op == "=":
-                        return left_val == right_val
-                    elif op == "!=":
-                        return left_val != right_val
-                    elif op == "<":
-                        return left_val < right_val
-                    elif op == ">":
-                        return left_val > right_val
-                    elif op == "<=":
-                        return left_val <= right_val
-                    elif op == ">=":
-                        return left_val >= right_val
+        # Apply GROUP BY and HAVING
+        aggregation = plan.aggregation
+        if aggregation is not None:
+            if aggregation.from_statistics:
+                self.aggregate_statistics.statistics_answers += 1
+                results = iter([self._statistics_row(stmt.table.name, aggregation)])
+            else:
+                results = GroupAggregate(aggregation, params, self.aggregate_statistics).run(results)
+            if aggregation.having is not None:
+                having = aggregation.having
+                results = (row for row in results if having(row, params))
+            presorted = False
         
-        return False
-    
-    def _execute_update(self, sql: str) -> List[Dict[str, Any]]:
-        pattern = r"UPDATE (\w+) SET (.+?)(?: WHERE (.+))?$"
-        match = re.match(pattern, sql, re.IGNORECASE)
-        if not match:
-            raise ValueError("Invalid UPDATE syntax")
+        # Apply ORDER BY, unless the rows came out of an index in that order
+        limit = self._row_limit(stmt.limit, "LIMIT", params)
+        offset = self._row_limit(stmt.offset, "OFFSET", params) or 0
+        if plan.sort_keys and not presorted:
+            if limit is not None:
+                results = self._top_rows(results, plan.sort_keys, params, offset + limit)
+            else:
+                results = ExternalSort(plan.sort_keys, params, self.work_mem, self.data_dir,
+                                       self.sort_statistics).run(results)
         
-        table_name = match.group(1)
-        set_clause = match.group(2).strip()
-        where_clause = match.group(3)
+        # Apply LIMIT and OFFSET; the scan stops once enough rows are out
+        if limit is not None or offset:
+            results = islice(results, offset, None if limit is None else offset + limit)
+        
+        # Select only requested columns
+        if plan.projection is not None:
+            return ({name: row[pos] for name, pos in plan.projection} for row in results)
+        return ({name: value(row, params) for name, value in plan.columns} for row in results)
+    
+    def _statistics_row(self, table_name: str, aggregation: Aggregation) -> Tuple:
+        # The catalog answers from the snapshot header while the table is
+        # not loaded
+        stats = self.tables.statistics(table_name)
+        row_count = self.tables.row_count(table_name)
+        values = []
+        for (func, _, _, _), pos in zip(aggregation.aggregates, aggregation.columns):
+            if pos is None:
+                values.append(row_count)
+            elif func == "COUNT":
+                values.append(row_count - stats.columns[pos].null_count)
+            else:
+                values.append(stats.columns[pos].min if func == "MIN" else stats.columns[pos].max)
+        return tuple(values)
+    
+    def _row_limit(self, expr: Any, clause: str, params: Tuple) -> Optional[int]:
+        # A LIMIT or OFFSET count; NULL means no limit
+        if expr is None:
+            return None
+        value = self._constant(expr, clause, params)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+            raise ValueError(f"{clause} must be a non-negative integer")
+        return value
+    
+    def _top_rows(self, rows: Iterable[Tuple], sort_keys: List[Tuple[Compiled, bool]], params: Tuple,
+                  count: int) -> List[Tuple]:
+        # ORDER BY with LIMIT: the first count rows, kept in a bounded heap
+        # (stable like sort(), so ties keep their scan order)
+        if all(descending for _, descending in sort_keys):
+            keys = [key for key, _ in sort_keys]
+            return heapq.nlargest(count, rows, key=lambda row: tuple(order_key(key(row, params)) for key in keys))
+        return heapq.nsmallest(count, rows, key=sort_key(sort_keys, params))
+    
+    def _join_rows(self, steps: List[JoinStep], params: Tuple) -> Iterator[Tuple]:
+        # Join tables in the planned order. Outer rows stream through each
+        # join; inner tables are read into memory where the method needs it.
+        stats = self.join_statistics
+        if len(steps) > 1 and steps[1].method == JoinMethod.MERGE:
+            stats.merge_joins += 1
+            results = self._merge_join(steps[0], steps[1], params)
+            steps = steps[2:]
+        else:
+            results = self._filtered_rows(steps[0], params)
+            steps = steps[1:]
+        for step in steps:
+            if step.method == JoinMethod.HASH:
+                results = HashJoin(step, params, self.work_mem, self.data_dir,
+                                   stats).run(results, self._filtered_rows(step, params))
+            elif step.method == JoinMethod.INDEX:
+                stats.index_joins += 1
+                results = self._index_join(results, step, params)
+            else:
+                stats.nested_loop_joins += 1
+                results = self._nested_loop_join(results, step, params)
+        return results
+    
+    def _filtered_rows(self, step: JoinStep, params: Tuple) -> Iterator[Tuple]:
+        rows, condition = self.tables[step.table].rows, step.filter
+        if condition is None:
+            return (row for row in rows if row is not None)
+        return (row for row in rows if row is not None and condition(row, params))
+    
+    def _nested_loop_join(self, outer_rows: Iterable[Tuple], step: JoinStep, params: Tuple) -> Iterator[Tuple]:
+        inner, condition = list(self._filtered_rows(step, params)), step.condition
+        return (outer + row for outer in outer_rows for row in inner
+                if condition is None or condition(outer + row, params))
+    
+    def _index_join(self, outer_rows: Iterable[Tuple], step: JoinStep, params: Tuple) -> Iterator[Tuple]:
+        # Look up each outer row's key in an index of the joined table
+        table = self.tables[step.table]
+        entries, rows = table.indexes[step.index].entries, table.rows
+        outer_key, inner_filter, condition = step.outer_key, step.filter, step.condition
+        single = step.key_width == 1
+        for outer in outer_rows:
+            key = outer_key(outer, params)
+            if single:
+                key = (key,)
+            if None in key:
+                continue
+            # A copy, as writers may change the list while a cursor waits
+            for i in tuple(entries.get(key, ())):
+                row = rows[i]
+                if row is None or (inner_filter is not None and not inner_filter(row, params)):
+                    continue
+                joined = outer + row
+                if condition is None or condition(joined, params):
+                    yield joined
+    
+    def _merge_join(self, first: JoinStep, step: JoinStep, params: Tuple) -> Iterator[Tuple]:
+        # Read both tables in the order of their indexes on the join key
+        # and pair up runs of equal keys, holding one run of the inner side
+        def ordered(side: JoinStep, key: Compiled) -> Iterator[Tuple[Any, Tuple]]:
+            table = self.tables[side.table]
+            rows = table.rows
+            for i in table.indexes[side.index].scan():
+                row = rows[i]
+                if row is not None and (side.filter is None or side.filter(row, params)):
+                    value = key(row, params)
+                    if value is not None:
+                        yield value, row
         
+        left, right = ordered(first, step.outer_key), ordered(step, step.inner_key)
+        condition = step.condition
+        left_item, right_item = next(left, None), next(right, None)
+        while left_item is not None and right_item is not None:
+            key = left_item[0]
+            if key < right_item[0]:
+                left_item = next(left, None)
+            elif key > right_item[0]:
+                right_item = next(right, None)
+            else:
+                run = []
+                while right_item is not None and right_item[0] == key:
+                    run.append(right_item[1])
+                    right_item = next(right, None)
+                while left_item is not None and left_item[0] == key:
+                    outer = left_item[1]
+                    for row in run:
+                        joined = outer + row
+                        if condition is None or condition(joined, params):
+                            yield joined
+                    left_item = next(left, None)
+    
+    def _plan_modify(self, table_name: str, where: Any) -> Plan:
+        # Plan for the row lookup of an UPDATE or DELETE
         if table_name not in self.tables:
             raise ValueError(f"Table '{table_name}' does not exist")
+        table = self.tables[table_name]
+        positions = self._scope([TableRef(table_name)], [table])
+        self._check_columns(where, positions)
+        plan = Plan(positions, access=self._access_path(table, where))
+        if plan.access.residual is not None:
+            plan.residual = compile_expr(plan.access.residual, positions)
+        return plan
+    
+    def _scope(self, refs: List[TableRef], tables: List[Table]) -> Dict[str, int]:
+        # Slots of the columns of tables joined in this order, by plain name
+        # (the first table having it wins) and qualified by alias or table name
+        positions = {}
+        offset = 0
+        for ref, table in zip(refs, tables):
+            qualifier = ref.alias or ref.name
+            for col, pos in table.column_positions.items():
+                positions[f"{qualifier}.{col}"] = offset + pos
+                positions.setdefault(col, offset + pos)
+            offset += len(table.columns)
+        return positions
+    
+    def _check_columns(self, expr: Any, positions: Dict[str, int]):
+        for name in expression_columns(expr):
+            if name not in positions:
+                raise ValueError(f"Column '{name}' does not exist")
+    
+    def _constant(self, expr: Any, clause: str, params: Tuple = ()) -> Any:
+        # Value of an expression that must not read any column
+        if isinstance(expr, Literal):
+            return expr.value
+        if isinstance(expr, Param):
+            return params[expr.index]
+        for name in expression_columns(expr):
+            raise ValueError(f"Column '{name}' cannot be used in {clause}")
+        return compile_expr(expr, {})((), params)
+    
+    MIRRORED = {"=": "=", "<": ">", ">": "<", "<=": ">=", ">=": "<="}
+    
+    def _sargable(self, table: Table, where: Any) -> Tuple[List[Any], Dict, Dict]:
+        # Split WHERE into conjuncts and pick out those an index can answer:
+        # equality/IN value expressions per column, and lower/upper range
+        # bounds per column as (expression, inclusive). Each entry records
+        # the conjunct it came from, or None when that conjunct must stay
+        # in the residual.
+        parts = conjuncts(where)
+        equalities = {}
+        ranges = {}
+        for n, part in enumerate(parts):
+            if isinstance(part, BinaryOp) and part.op in self.MIRRORED:
+                left, right, op = part.left, part.right, part.op
+                if isinstance(left, (Literal, Param)):
+                    left, right, op = right, left, self.MIRRORED[op]
+                col = self._index_column(table, left, right)
+                if col is None:
+                    continue
+                if op == "=":
+                    equalities.setdefault(col, (n, [right]))
+                else:
+                    side = "lower" if op[0] == ">" else "upper"
+                    ranges.setdefault(col, {}).setdefault(side, (n, (right, op.endswith("="))))
+            elif isinstance(part, InList) and not part.negated:
+                col = self._index_column(table, part.operand, *part.values)
+                if col is not None:
+                    equalities.setdefault(col, (n, part.values))
+            elif isinstance(part, Between) and not part.negated:
+                col = self._index_column(table, part.operand, part.low, part.high)
+                if col is not None and col not in ranges:
+                    ranges[col] = {"lower": (n, (part.low, True)), "upper": (n, (part.high, True))}
+            elif isinstance(part, Like) and not part.negated and isinstance(part.pattern, Literal):
+                col = self._index_column(table, part.operand, part.pattern)
+                if (col is None or not isinstance(part.pattern.value, str)
+                        or table.columns[table.column_positions[col]].data_type != DataType.TEXT):
+                    continue
+                # A prefix pattern narrows to a key range; the LIKE stays in the residual
+                prefix = re.match(r"[^%_]*", part.pattern.value).group()
+                if prefix and prefix != part.pattern.value:
+                    bounds = ranges.setdefault(col, {})
+                    bounds.setdefault("lower", (None, (Literal(prefix), True)))
+                    bounds.setdefault("upper", (None, (Literal(prefix[:-1] + chr(ord(prefix[-1]) + 1)), False)))
+        return parts, equalities, ranges
+    
+    def _index_column(self, table: Table, operand: Any, *values: Any) -> Optional[str]:
+        # The column operand refers to, if it is compared with literals or parameters
+        if not isinstance(operand, ColumnRef):
+            return None
+        col = operand.name.rpartition(".")[2]
+        if col not in table.column_positions:
+            return None
+        if not all(isinstance(value, (Literal, Param)) for value in values):
+            return None
+        return col
+    
+    def _access_path(self, table: Table, where: Any,
+                     order_by: Optional[List[Tuple[Any, bool]]] = None) -> AccessPath:
+        # Choose an index for the WHERE clause: equality and IN conjuncts
+        # use any index, range conjuncts (<, <=, >, >=, BETWEEN, prefix
+        # LIKE) an ordered one. Without a usable predicate an ordered index
+        # matching ORDER BY still saves the sort.
+        parts, equalities, ranges = self._sargable(table, where)
+        order = [(expr.name.rpartition(".")[2] if isinstance(expr, ColumnRef) else None, descending)
+                 for expr, descending in order_by or []]
+        
+        def residual_without(used: Set[int]) -> Any:
+            return conjoin([part for n, part in enumerate(parts) if n not in used])
+        
+        def scan_direction(idx: Index) -> Optional[bool]:
+            # Whether scanning idx yields the ORDER BY order: None if not,
+            # else True for a reverse scan. ORDER BY must name every index
+            # column, or ties would come out ordered by the columns left over.
+            if not order or not idx.ordered or len({descending for _, descending in order}) > 1:
+                return None
+            if [col for col, _ in order] != idx.column_names:
+                return None
+            return order[0][1]
+        
+        # Prefer indexes matched on all their columns by equalities, then
+        # range scans, then the longest matched prefix of an ordered
+        # composite index (a hash index can only look up whole keys)
+        best, best_score = None, (False, 0)
+        for name, idx in table.indexes.items():
+            prefix = 0
+            while prefix < len(idx.column_names) and idx.column_names[prefix] in equalities:
+                prefix += 1
+            score = (prefix == len(idx.column_names), prefix)
+            if prefix and (score[0] or idx.ordered) and score > best_score:
+                best, best_score = name, score
+        
+        if best is not None and best_score[0]:
+            matched = table.indexes[best].column_names
+            return AccessPath("lookup", best, keys=[equalities[col][1] for col in matched],
+                              residual=residual_without({equalities[col][0] for col in matched}))
+        
+        range_indexes = [name for name, idx in table.indexes.items()
+                         if idx.ordered and idx.column_names[0] in ranges]
+        if range_indexes:
+            name = max(range_indexes, key=lambda name: scan_direction(table.indexes[name]) is not None)
+            bounds = ranges[table.indexes[name].column_names[0]]
+            lower, upper = bounds.get("lower", (None, None)), bounds.get("upper", (None, None))
+            direction = scan_direction(table.indexes[name])
+            return AccessPath("range", name, lower=lower[1], upper=upper[1], reverse=bool(direction),
+                              residual=residual_without({lower[0], upper[0]}), presorted=direction is not None)
+        
+        if best is not None:
+            matched = table.indexes[best].column_names[:best_score[1]]
+            return AccessPath("prefix", best, keys=[equalities[col][1] for col in matched],
+                              residual=residual_without({equalities[col][0] for col in matched}))
+        
+        for name, idx in table.indexes.items():
+            direction = scan_direction(idx)
+            if direction is not None:
+                return AccessPath("range", name, reverse=direction, residual=where, presorted=True)
+        return AccessPath(residual=where)
+    
+    def _candidates(self, table: Table, access: AccessPath, params: Tuple) -> Optional[Iterable[int]]:
+        # Row ids the access path yields with these parameter values (lazily
+        # for a range scan), or None for a full scan. NULL never matches an
+        # equality or a bound.
+        if access.kind == "scan":
+            return None
+        idx = table.indexes[access.index]
+        if access.kind in ("lookup", "prefix"):
+            keys = set(product(*([value for value in (self._constant(expr, "WHERE", params) for expr in exprs)
+                                  if value is not None] for exprs in access.keys)))
+            if access.kind == "lookup":
+                candidates = [i for key in keys for i in idx.entries.get(key, ())]
+            else:
+                try:
+                    candidates = [i for key in keys for i in idx.prefix_scan(key)]
+                except TypeError:
+                    # A value of another type than the column's; compare by equality
+                    prefix = len(access.keys)
+                    candidates = [i for key, ids in idx.entries.items() if key[:prefix] in keys for i in ids]
+            return sorted(set(candidates))
         
+        bounds = []
+        for bound in (access.lower, access.upper):
+            if bound is not None:
+                value = self._constant(bound[0], "WHERE", params)
+                if value is None:
+                    return []
+                bound = (value, bound[1])
+            bounds.append(bound)
+        try:
+            return idx.scan(bounds[0], bounds[1], reverse=access.reverse)
+        except TypeError:
+            raise ValueError(f"Cannot compare column '{idx.column_names[0]}' with "
+                             f"{type((bounds[0] or bounds[1])[0]).__name__}")
+    
+    def _matching_rows(self, table: Table, plan: Plan, params: Tuple) -> Iterator[Tuple[int, Tuple]]:
+        # (row_id, row) pairs satisfying the WHERE clause, via an index when possible
+        candidates = self._candidates(table, plan.access, params)
+        if candidates is None:
+            rows = table.live_rows()
+        else:
+            rows = ((i, table.rows[i]) for i in candidates)
+        residual = plan.residual
+        for i, row in rows:
+            if row is not None and (residual is None or residual(row, params)):
+                yield i, row
+    
+    def _columnar_candidates(self, table: Table, filters: List[Tuple[int, List[Any]]],
+                             params: Tuple) -> List[int]:
+        # Narrow a columnar scan with the equality and IN conjuncts of the
+        # WHERE clause, reading one column buffer each (dictionary-encoded
+        # TEXT compares codes). The full WHERE still runs on the survivors.
+        candidates = None
+        for pos, exprs in filters:
+            values = [self._constant(expr, "WHERE", params) for expr in exprs]
+            matched = table.rows.match(pos, [value for value in values if value is not None])
+            candidates = set(matched) if candidates is None else candidates.intersection(matched)
+        return sorted(candidates)
+    
+    def _execute_update(self, stmt: Update, params: Tuple, plan: Plan) -> List[Dict[str, Any]]:
+        table_name = stmt.table
         table = self.tables[table_name]
         
-        # Parse SET clause
+        positions = table.column_positions
         updates = {}
-        for assignment in set_clause.split(","):
-            col, value = assignment.split("=", 1)
-            col = col.strip()
-            value = value.strip().strip("'")
-            
-            # Parse value
-            if value.isdigit():
-                updates[col] = int(value)
-            elif value.replace('.', '', 1).isdigit():
-                updates[col] = float(value)
-            elif value.upper() in ("TRUE", "FALSE"):
-                updates[col] = value.upper() == "TRUE"
-            elif value == "NULL":
-                updates[col] = None
+        computed = {}  # SET expressions reading the row, e.g. n = n + 1
+        for col, expr in stmt.assignments:
+            if col not in positions:
+                raise ValueError(f"Column '{col}' does not exist")
+            if any(True for _ in expression_columns(expr)):
+                self._check_columns(expr, positions)
+                computed[col] = compile_expr(expr, positions)
             else:
-                updates[col] = value
-        
-        # Apply updates
-        updated_count = 0
-        for i, row in enumerate(table.rows):
-            if not where_clause or self._evaluate_where(row, where_clause):
-                # Validate updates
-                for col, value in updates.items():
-                    # Find column
-                    col_obj = next((c for c in table.columns if c.name == col), None)
-                    if not col_obj:
-                        raise ValueError(f"Column '{col}' does not exist")
-                    
-                    if col_obj.is_unique and value is not None:
-                        # Check for duplicates
-                        for j, other_row in enumerate(table.rows):
-                            if j != i and other_row.get(col) == value:
-                                raise ValueError(f"Duplicate value for unique column '{col}'")
-                
-                # Apply updates
-                row.update(updates)
-                updated_count += 1
-        
-        if updated_count > 0:
-            # Rebuild indexes
-            for idx in table.indexes.values():
-                self._rebuild_index(table_name, idx)
-            self._save_table(table_name)
+                updates[col] = self._constant(expr, "SET", params)
         
-        return [{"status": f"{updated_count} row(s) updated"}]
-    
-    def _execute_delete(self, sql: str) -> List[Dict[str, Any]]:
-        pattern = r"DELETE FROM (\w+)(?: WHERE (.+))?$"
-        match = re.match(pattern, sql, re.IGNORECASE)
-        if not match:
-            raise ValueError("Invalid DELETE syntax")
+        # Find rows to update
+        updated_positions = []
+        new_rows = []
+        row_updates = []
+        changes = [(positions[col], value) for col, value in updates.items()]
+        for i, row in self._matching_rows(table, plan, params):
+            updated_positions.append(i)
+            new_row = list(row)
+            for pos, value in changes:
+                new_row[pos] = value
+            if computed:
+                values = dict(updates)
+                for col, fn in computed.items():
+                    values[col] = new_row[positions[col]] = fn(row, params)
+                row_updates.append(values)
+            new_rows.append(tuple(new_row))
         
-        table_name = match.group(1)
-        where_clause = match.group(2)
+        # Validate the new row versions before changing anything
+        self._validate_rows(table, new_rows, updated_positions, set(updates) | set(computed))
         
-        if table_name not in self.tables:
-            raise ValueError(f"Table '{table_name}' does not exist")
+        if updated_positions:
+            # Computed SETs carry one dict of values per row
+            values = row_updates if computed else updates
+            table.update_rows(updated_positions, values)
+            self._log_change(table_name, "update", updated_positions, values)
         
+        return [{"status": f"{len(updated_positions)} row(s) updated"}]
+    
+    def _execute_delete(self, stmt: Delete, params: Tuple, plan: Plan) -> List[Dict[str, Any]]:
+        table_name = stmt.table
         table = self.tables[table_name]
         
         # Find rows to delete
-        rows_to_delete = []
-        for i, row in enumerate(table.rows):
-            if not where_clause or self._evaluate_where(row, where_clause):
-                rows_to_delete.append(i)
+        rows_to_delete = [i for i, _ in self._matching_rows(table, plan, params)]
         
-        # Delete rows (from end to beginning to preserve indices)
-        deleted_count = 0
-        for i in sorted(rows_to_delete, reverse=True):
-            table.rows.pop(i)
-            deleted_count += 1
+        if rows_to_delete:
+            table.delete_rows(rows_to_delete)
+            self._log_change(table_name, "delete", rows_to_delete)
         
-        if deleted_count > 0:
-            # Rebuild all indexes
-            for idx in table.indexes.values():
-                self._rebuild_index(table_name, idx)
-            self._save_table(table_name)
-        
-        return [{"status": f"{deleted_count} row(s) deleted"}]
+        return [{"status": f"{len(rows_to_delete)} row(s) deleted"}]
     
-    def _execute_drop_table(self, sql: str) -> List[Dict[str, Any]]:
-        pattern = r"DROP TABLE (\w+)"
-        match = re.match(pattern, sql, re.IGNORECASE)
-        if not match:
-            raise ValueError("Invalid DROP TABLE syntax")
-        
-        table_name = match.group(1)
+    def _execute_drop_table(self, stmt: DropTable) -> List[Dict[str, Any]]:
+        table_name = stmt.name
         
         if table_name not in self.tables:
+            if stmt.if_exists:
+                return [{"status": f"Table '{table_name}' does not exist, skipped"}]
             raise ValueError(f"Table '{table_name}' does not exist")
         
         del self.tables[table_name]
+        self.schema_version += 1
         
         # Remove data file
         data_file = os.path.join(self.data_dir, f"{table_name}.pkl")
@@ -535,54 +4529,157 @@ class SimpleRDBMS:
         
         return [{"status": f"Table '{table_name}' dropped successfully"}]
     
-    def _execute_create_index(self, sql: str) -> List[Dict[str, Any]]:
-        pattern = r"CREATE INDEX (\w+) ON (\w+) \((.+?)\)"
-        match = re.match(pattern, sql, re.IGNORECASE)
-        if not match:
-            raise ValueError("Invalid CREATE INDEX syntax")
-        
-        index_name = match.group(1)
-        table_name = match.group(2)
-        columns_str = match.group(3)
+    def _execute_create_index(self, stmt: CreateIndex) -> List[Dict[str, Any]]:
+        index_name = stmt.name
+        table_name = stmt.table
         
         if table_name not in self.tables:
             raise ValueError(f"Table '{table_name}' does not exist")
         
         table = self.tables[table_name]
-        column_names = [col.strip() for col in columns_str.split(",")]
+        column_names = stmt.columns
         
         # Validate columns
         for col_name in column_names:
             if not any(col.name == col_name for col in table.columns):
                 raise ValueError(f"Column '{col_name}' does not exist in table '{table_name}'")
         
-        table.add_index(index_name, column_names)
-        self._save_table(table_name)
+        table.add_index(index_name, column_names, stmt.index_type)
+        self.schema_version += 1
+        self._log_change(table_name, "create_index", index_name, column_names, stmt.index_type.value)
         
         return [{"status": f"Index '{index_name}' created on '{table_name}'"}]
     
-    def _rebuild_index(self, table_name: str, index: Index):
-        table = self.tables[table_name]
-        index.entries.clear()
-        for i, row in enumerate(table.rows):
-            key = tuple(row[col] for col in index.column_names if col in row)
-            if key not in index.entries:
-                index.entries[key] = []
-            index.entries[key].append(i)
+    def _copy_path(self, path: str) -> str:
+        # COPY statements can arrive through the web API, so their files are
+        # resolved under data_dir and must carry a COPY file extension, which
+        # keeps the table snapshots and the log out of reach
+        root = os.path.realpath(self.data_dir)
+        full = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, full]) != root or os.path.splitext(full)[1].lower() not in COPY_FORMATS:
+            raise ValueError(f"COPY file '{path}' must be a {'/'.join(COPY_FORMATS)} file inside the data directory")
+        return full
+    
+    def _copy_columns(self, stmt: Copy) -> Tuple[Table, List[str]]:
+        if stmt.table not in self.tables:
+            raise ValueError(f"Table '{stmt.table}' does not exist")
+        table = self.tables[stmt.table]
+        for name in stmt.columns or ():
+            if name not in table.column_positions:
+                raise ValueError(f"Column '{name}' does not exist in table '{stmt.table}'")
+        return table, stmt.columns or [col.name for col in table.columns]
+    
+    def _copy_from(self, stmt: Copy) -> List[Dict[str, Any]]:
+        # Bulk import. Chunks are parsed (in worker processes if asked to),
+        # then validated and indexed in one pass each as they arrive, so only
+        # a chunk is held at a time. If any chunk fails, the rows added so far
+        # are deleted again. Either way the table snapshot is written instead
+        # of logging every row, as VACUUM does.
+        if self._in_transaction:
+            raise ValueError("COPY FROM cannot run inside a transaction")
+        table, names = self._copy_columns(stmt)
+        fmt = copy_format(stmt.path, stmt.options)
+        header = stmt.options.get("HEADER", True)
+        first = len(table.rows)
+        with open(stmt.path, newline="" if fmt == "csv" else None, encoding="utf-8") as f:
+            if fmt == "csv":
+                records = csv.reader(f)
+                first_line = next(records, None) if header else None
+                if first_line is not None and stmt.columns is None:
+                    names = [name.strip() for name in first_line]
+                    for name in names:
+                        if name not in table.column_positions:
+                            raise ValueError(f"Column '{name}' does not exist in table '{stmt.table}'")
+            else:
+                records = f
+            chunks = ((n * COPY_CHUNK_ROWS + 1, chunk) for n, chunk in
+                      enumerate(iter(lambda: list(islice(records, COPY_CHUNK_ROWS)), [])))
+            columns = [table.columns[table.column_positions[name]] for name in names]
+            parse = partial(parse_copy_chunk, fmt, names, [col.data_type.value for col in columns],
+                            [col.default for col in columns], stmt.options.get("NULL", COPY_NULL))
+            try:
+                for values in _map_chunks(parse, chunks, stmt.options.get("WORKERS") or 0):
+                    chunk_rows = table.make_rows(names, values)
+                    self._validate_rows(table, chunk_rows)
+                    if chunk_rows:
+                        table.insert_rows(chunk_rows)
+            except Exception:
+                if len(table.rows) > first:
+                    # The snapshot keeps the tombstones, so row ids on disk
+                    # match the ones later log records refer to
+                    table.delete_rows(range(first, len(table.rows)))
+                    self._save_table(stmt.table)
+                raise
+        count = len(table.rows) - first
+        if count:
+            self._save_table(stmt.table)
+        return [{"status": f"{count} rows copied into '{stmt.table}'", "rows": count}]
+    
+    def _copy_to(self, stmt: Copy) -> List[Dict[str, Any]]:
+        # Bulk export, one row at a time straight from the table; the file
+        # only replaces path once it is complete
+        table, names = self._copy_columns(stmt)
+        fmt = copy_format(stmt.path, stmt.options)
+        positions = [table.column_positions[name] for name in names]
+        null = stmt.options.get("NULL", COPY_NULL)
+        count = 0
+        with open(stmt.path + ".tmp", "w", newline="" if fmt == "csv" else None, encoding="utf-8") as f:
+            if fmt == "csv":
+                writer = csv.writer(f)
+                if stmt.options.get("HEADER", True):
+                    writer.writerow(names)
+                for _, row in table.live_rows():
+                    writer.writerow([_csv_text(row[pos], null) for pos in positions])
+                    count += 1
+            else:
+                for _, row in table.live_rows():
+                    f.write(json.dumps({name: row[pos] for name, pos in zip(names, positions)}, default=str))
+                    f.write("\n")
+                    count += 1
+        os.replace(stmt.path + ".tmp", stmt.path)
+        return [{"status": f"{count} rows copied from '{stmt.table}'", "rows": count}]
+    
+    def _execute_vacuum(self, stmt: Vacuum) -> List[Dict[str, Any]]:
+        if self._in_transaction:
+            raise ValueError("VACUUM cannot run inside a transaction")
+        
+        table_names = [stmt.table] if stmt.table else list(self.tables)
+        reclaimed = 0
+        for table_name in table_names:
+            if table_name not in self.tables:
+                raise ValueError(f"Table '{table_name}' does not exist")
+            if self.tables[table_name].deleted_count:
+                reclaimed += self.tables[table_name].vacuum()
+                # Row ids moved, so the old log records must not be replayed
+                self._save_table(table_name)
+        
+        return [{"status": f"Vacuum reclaimed {reclaimed} deleted row(s)"}]
     
     def _begin_transaction(self):
         self._in_transaction = True
         self.transaction_log = []
+        self._pending_records = []
     
     def _commit_transaction(self) -> List[str]:
         result = self.transaction_log.copy()
         self._in_transaction = False
         self.transaction_log = []
+        
+        # The whole transaction goes to the log as a single frame
+        records, self._pending_records = self._pending_records, []
+        if records:
+            lsn = self.wal.append(records)
+            for record in records:
+                if record[0] in self.tables:
+                    self.tables[record[0]].wal_lsn = lsn
+                    self.tables.dirty.add(record[0])
+            self.tables.pinned = set()
         return result
     
     def _rollback_transaction(self):
         self._in_transaction = False
         self.transaction_log = []
+        self._pending_records = []
         # Reload tables from disk to undo changes
         self._load_tables()
 
@@ -634,19 +4731,29 @@ class SQLREPL:
     def _show_help(self):
         help_text = """
         Available SQL Commands:
-        - CREATE TABLE table_name (col1 TYPE, col2 TYPE, ...)
-        - INSERT INTO table_name VALUES (val1, val2, ...)
-        - SELECT * FROM table_name [WHERE condition]
-        - UPDATE table_name SET col=val [WHERE condition]
+        - CREATE TABLE [IF NOT EXISTS] table_name (col1 TYPE, col2 TYPE, ...) [USING COLUMNAR]
+        - INSERT INTO table_name [(col1, ...)] VALUES (val1, val2, ...)[, (...), ...]
+          [ON CONFLICT [(col)] DO NOTHING | DO UPDATE SET col=expr, ... [WHERE condition]]
+        - SELECT * FROM table_name [JOIN other ON condition] [WHERE condition] [GROUP BY expr, ...]
+          [HAVING condition] [ORDER BY col [ASC|DESC], ...] [LIMIT n] [OFFSET m]
+        - UPDATE table_name SET col=expr [WHERE condition]
         - DELETE FROM table_name [WHERE condition]
-        - DROP TABLE table_name
-        - CREATE INDEX idx_name ON table_name (col1, col2)
+        - DROP TABLE [IF EXISTS] table_name
+        - VACUUM [table_name]
+        - COPY table_name [(col1, ...)] FROM|TO 'file.csv' | 'file.jsonl'
+          [WITH (FORMAT csv|jsonl, HEADER [true|false], NULL 'marker', WORKERS n)]
+          (files are relative to the data directory; CSV NULL is \\N by default)
+        - CREATE INDEX idx_name ON table_name (col1, col2) [USING BTREE]
         - BEGIN TRANSACTION
         - COMMIT
         - ROLLBACK
         
-        Data Types: INTEGER, TEXT, REAL, BOOLEAN
-        Constraints: PRIMARY KEY, UNIQUE, NOT NULL
+        Data Types: INTEGER, TEXT, REAL, BOOLEAN, DATE
+        Constraints: PRIMARY KEY, UNIQUE, NOT NULL, DEFAULT value
+        Conditions: =, !=, <, >, <=, >=, AND, OR, NOT, IN, BETWEEN, LIKE, IS [NOT] NULL
+        Aggregates: COUNT(*), COUNT/SUM/AVG/MIN/MAX([DISTINCT] expr), APPROX_COUNT_DISTINCT(expr),
+          APPROX_PERCENTILE(expr, fraction)
+        Parameters: ? placeholders, bound via execute_sql(sql, params) or prepare(sql).execute(params)
         
         REPL Commands:
         - TABLES: List all tables
@@ -661,8 +4768,11 @@ class SQLREPL:
             return
         
         print("\nTables in database:")
-        for table_name, table in self.db.tables.items():
-            print(f"\n{table_name}:")
+        for table_name in self.db.tables:
+            # Schema comes from the catalog, so this doesn't load row data
+            table = self.db.tables.infos[table_name]
+            stats = self.db.table_stats(table_name)
+            print(f"\n{table_name} ({stats['rows']} rows, {stats['bytes']} bytes):")
             for col in table.columns:
                 constraints = []
                 if col.is_primary:
@@ -674,8 +4784,10 @@ class SQLREPL:
                 
                 constraint_str = f" [{', '.join(constraints)}]" if constraints else ""
                 print(f"  - {col.name}: {col.data_type.value}{constraint_str}")
-            print(f"  Rows: {len(table.rows)}")
+            print(f"  Rows: {self.db.tables.row_count(table_name)}")
             print(f"  Indexes: {len(table.indexes)}")
+            print(f"  Layout: {table.layout.value}")
+            print(f"  Loaded: {'yes' if self.db.tables.is_loaded(table_name) else 'no'}")
 
 
 # Web Application using our RDBMS
@@ -683,42 +4795,66 @@ from http.server import HTTPServer, BaseHTTPRequestHandler
 import urllib.parse
 
 class WebRDBMS:
+    PAGE_SIZE = 100
+    
     def __init__(self, db: SimpleRDBMS):
         self.db = db
     
     def handle_request(self, path: str, method: str, data: Dict) -> Tuple[int, Dict]:
         if path == "/api/tables" and method == "GET":
             tables = []
-            for name, table in self.db.tables.items():
+            for name, info in self.db.tables.infos.items():
                 tables.append({
                     "name": name,
-                    "columns": len(table.columns),
-                    "rows": len(table.rows)
+                    "columns": len(info.columns),
+                    "rows": self.db.tables.row_count(name),
+                    "bytes": self.db.tables.statistics(name).data_bytes
                 })
             return 200, {"tables": tables}
         
+        elif path == "/api/stats" and method == "GET":
+            return 200, {"flush": self.db.flush_stats(), "plan_cache": self.db.plan_cache_stats(),
+                         "joins": self.db.join_stats(), "sorts": self.db.sort_stats(),
+                         "aggregates": self.db.aggregate_stats()}
+        
         elif path == "/api/query" and method == "POST":
             sql = data.get("sql", "")
             if not sql:
                 return 400, {"error": "SQL query required"}
             
             try:
-                results = self.db.execute_sql(sql)
+                results = self.db.execute_sql(sql, data.get("params", []))
                 return 200, {"results": results}
             except Exception as e:
                 return 400, {"error": str(e)}
         
+        elif path.startswith("/api/table/") and path.endswith("/stats") and method == "GET":
+            table_name = path.split("/")[-2]
+            if table_name not in self.db.tables:
+                return 404, {"error": f"Table '{table_name}' not found"}
+            return 200, {"table": table_name, **self.db.table_stats(table_name)}
+        
         elif path.startswith("/api/table/") and method == "GET":
             table_name = path.split("/")[-1]
             if table_name not in self.db.tables:
                 return 404, {"error": f"Table '{table_name}' not found"}
             
+            # One page of rows at a time
+            try:
+                limit = int(data.get("limit", self.PAGE_SIZE))
+                offset = int(data.get("offset", 0))
+            except ValueError:
+                return 400, {"error": "limit and offset must be integers"}
+            
             try:
-                results = self.db.execute_sql(f"SELECT * FROM {table_name}")
+                results = self.db.execute_sql(f"SELECT * FROM {table_name} LIMIT ? OFFSET ?", [limit, offset])
                 return 200, {
                     "table": table_name,
-                    "columns": [col.name for col in self.db.tables[table_name].columns],
-                    "rows": results
+                    "columns": [col.name for col in self.db.tables.infos[table_name].columns],
+                    "rows": results,
+                    "limit": limit,
+                    "offset": offset,
+                    "total": self.db.tables.row_count(table_name)
                 }
             except Exception as e:
                 return 400, {"error": str(e)}
@@ -738,7 +4874,8 @@ class WebHandler(BaseHTTPRequestHandler):
         elif self.path == "/style.css":
             self._serve_file("style.css")
         else:
-            status, data = self.web_db.handle_request(self.path, "GET", {})
+            url = urllib.parse.urlparse(self.path)
+            status, data = self.web_db.handle_request(url.path, "GET", dict(urllib.parse.parse_qsl(url.query)))
             self._send_json_response(status, data)
     
     def do_POST(self):
@@ -904,7 +5041,7 @@ def create_web_files():
     }
     
     async function viewTable(tableName) {
-        setQuery(`SELECT * FROM ${tableName}`);
+        setQuery(`SELECT * FROM ${tableName} LIMIT 100`);
         await executeQuery();
     }
     
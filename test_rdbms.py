@@ -0,0 +1,573 @@
+import bisect
+import os
+
+import pytest
+
+import rdbms
+from rdbms import Durability, SimpleRDBMS, parse_sql
+
+
+def count_wrong(db):
+    # Rows with id < 3000 were incremented once; the rest must be untouched
+    return db.execute_sql("SELECT COUNT(*) AS c FROM t WHERE (id < 3000 AND n <> 1) OR (id >= 3000 AND n <> 0)")[0]["c"]
+
+
+@pytest.mark.parametrize("checkpoint_interval", [1000, 100])
+@pytest.mark.parametrize("close", [True, False])
+def test_computed_update_after_delete_survives_reopen(tmp_path, checkpoint_interval, close):
+    db = SimpleRDBMS(data_dir=str(tmp_path), checkpoint_interval=checkpoint_interval)
+    db.execute_sql("CREATE TABLE t (id INTEGER PRIMARY KEY, n INTEGER)")
+    for i in range(6000):
+        db.execute_sql("INSERT INTO t VALUES (?, 0)", [i])
+    db.execute_sql("DELETE FROM t WHERE id % 2 = 0")
+
+    assert db.execute_sql("UPDATE t SET n = n + 1 WHERE id < 3000") == [{"status": "1500 row(s) updated"}]
+    assert count_wrong(db) == 0
+    if close:
+        db.close()
+    else:
+        db.wal.close()
+    assert count_wrong(SimpleRDBMS(data_dir=str(tmp_path))) == 0
+
+
+def test_upsert_is_one_log_frame(tmp_path):
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    db.execute_sql("CREATE TABLE kv (k INTEGER PRIMARY KEY, n INTEGER)")
+    db.executemany("INSERT INTO kv VALUES (?, 0)", [(i,) for i in range(100)])
+    frames = db.wal.frames_since_checkpoint
+    result = db.executemany("INSERT INTO kv VALUES (?, 1) ON CONFLICT (k) DO UPDATE SET n = n + excluded.n",
+                            [(i,) for i in range(50, 150)])
+    assert result[0]["inserted"] == 50 and result[0]["updated"] == 50
+    assert db.wal.frames_since_checkpoint == frames + 1
+    db.wal.close()
+    reopened = SimpleRDBMS(data_dir=str(tmp_path))
+    assert reopened.execute_sql("SELECT SUM(n) AS s FROM kv")[0]["s"] == 100
+
+
+def test_copy_paths_stay_in_data_dir(tmp_path):
+    db = SimpleRDBMS(data_dir=str(tmp_path / "db"))
+    db.execute_sql("CREATE TABLE t (id INTEGER PRIMARY KEY)")
+    for path in ["../outside.csv", str(tmp_path / "outside.csv"), "t.pkl", "wal.log"]:
+        with pytest.raises(ValueError, match="inside the data directory"):
+            db.execute_sql(f"COPY t TO '{path}' WITH (FORMAT csv)")
+    assert not (tmp_path / "outside.csv").exists()
+    db.execute_sql("COPY t TO 'export/../t.csv'")
+    assert (tmp_path / "db" / "t.csv").exists()
+
+
+def test_copy_csv_keeps_empty_strings_apart_from_null(tmp_path):
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    db.execute_sql("CREATE TABLE t (id INTEGER PRIMARY KEY, s TEXT, n INTEGER)")
+    db.execute_sql("INSERT INTO t VALUES (1, '', NULL), (2, NULL, 5), (3, 'x', NULL)")
+    db.execute_sql("COPY t TO 't.csv'")
+    db.execute_sql("CREATE TABLE u (id INTEGER PRIMARY KEY, s TEXT, n INTEGER)")
+    db.execute_sql("COPY u FROM 't.csv'")
+    assert db.execute_sql("SELECT * FROM u ORDER BY id") == db.execute_sql("SELECT * FROM t ORDER BY id")
+    # An empty field of a non-TEXT column is still NULL
+    (tmp_path / "plain.csv").write_text("id,s,n\n4,a,\n")
+    db.execute_sql("COPY u FROM 'plain.csv'")
+    assert db.execute_sql("SELECT s, n FROM u WHERE id = 4") == [{"s": "a", "n": None}]
+
+
+def test_failed_copy_leaves_table_unchanged(tmp_path, monkeypatch):
+    monkeypatch.setattr("rdbms.COPY_CHUNK_ROWS", 10)
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    db.execute_sql("CREATE TABLE t (id INTEGER PRIMARY KEY, n INTEGER)")
+    db.execute_sql("INSERT INTO t VALUES (1000, 0)")
+    # The duplicate sits in the third chunk, after two have been inserted
+    (tmp_path / "rows.csv").write_text("id,n\n" + "".join(f"{i},{i}\n" for i in range(25)) + "3,3\n")
+    with pytest.raises(ValueError, match="Duplicate"):
+        db.execute_sql("COPY t FROM 'rows.csv'")
+    assert db.execute_sql("SELECT COUNT(*) AS c FROM t") == [{"c": 1}]
+    db.execute_sql("UPDATE t SET n = 7 WHERE id = 1000")
+    db.execute_sql("INSERT INTO t VALUES (1, 1)")
+    expected = db.execute_sql("SELECT * FROM t ORDER BY id")
+    db.wal.close()
+    assert SimpleRDBMS(data_dir=str(tmp_path)).execute_sql("SELECT * FROM t ORDER BY id") == expected
+
+
+@pytest.mark.parametrize("load", ["executemany", "copy"])
+def test_memory_budget_holds_after_writes(tmp_path, load):
+    budget = 200 * 1024
+    db = SimpleRDBMS(data_dir=str(tmp_path), memory_budget=budget)
+    (tmp_path / "rows.csv").write_text("id,name\n" + "".join(f"{i},name {i}\n" for i in range(400)))
+    for n in range(4):
+        db.execute_sql(f"CREATE TABLE t{n} (id INTEGER PRIMARY KEY, name TEXT)")
+        if load == "copy":
+            db.execute_sql(f"COPY t{n} FROM 'rows.csv'")
+        else:
+            db.executemany(f"INSERT INTO t{n} VALUES (?, ?)", [(i, f"name {i}") for i in range(400)])
+        assert db.tables.memory_usage() <= budget
+    assert len(db.tables.loaded) < 4
+    for n in range(4):
+        assert db.execute_sql(f"SELECT COUNT(*) AS c FROM t{n} WHERE id >= 0") == [{"c": 400}]
+
+
+
+def test_eviction_saves_only_its_tables_and_keeps_the_log(tmp_path):
+    budget = 200 * 1024
+    db = SimpleRDBMS(data_dir=str(tmp_path), memory_budget=budget)
+    for n in range(3):
+        db.execute_sql(f"CREATE TABLE t{n} (id INTEGER PRIMARY KEY, name TEXT)")
+        db.executemany(f"INSERT INTO t{n} VALUES (?, ?)", [(i, f"name {i}") for i in range(400)])
+    assert "t0" not in db.tables.loaded
+    # No checkpoint ran: the log still holds every insert
+    assert db.wal.frames_since_checkpoint == 3
+    assert "t2" in db.tables.dirty
+    db.wal.close()
+    db = SimpleRDBMS(data_dir=str(tmp_path), memory_budget=budget)
+    for n in range(3):
+        assert db.execute_sql(f"SELECT COUNT(*) AS c FROM t{n} WHERE id >= 0") == [{"c": 400}]
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc to name fsynced files")
+def test_async_checkpoint_fsyncs_snapshots_before_truncating_log(tmp_path, monkeypatch):
+    db = SimpleRDBMS(data_dir=str(tmp_path), durability=Durability.ASYNC)
+    db.execute_sql("CREATE TABLE t (id INTEGER PRIMARY KEY)")
+    db.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(100)])
+    synced = []
+    fsync = os.fsync
+
+    def recording_fsync(fd):
+        synced.append(os.path.basename(os.readlink(f"/proc/self/fd/{fd}")))
+        fsync(fd)
+    monkeypatch.setattr(rdbms.os, "fsync", recording_fsync)
+    db.checkpoint()
+    assert "t.pkl.tmp" in synced and "wal.log" in synced
+    assert synced.index("t.pkl.tmp") < synced.index("wal.log")
+
+
+def test_count_min_max_do_not_load_an_evicted_table(tmp_path):
+    db = SimpleRDBMS(data_dir=str(tmp_path), memory_budget=100 * 1024)
+    db.execute_sql("CREATE TABLE t (id INTEGER PRIMARY KEY, n INTEGER)")
+    db.executemany("INSERT INTO t VALUES (?, ?)", [(i, None if i % 4 else i) for i in range(1, 401)])
+    query = db.prepare("SELECT COUNT(*) AS c, COUNT(n) AS cn, MIN(id) AS lo, MAX(n) AS hi FROM t")
+    expected = [{"c": 400, "cn": 100, "lo": 1, "hi": 400}]
+    assert query.execute() == expected
+    db.execute_sql("CREATE TABLE u (id INTEGER PRIMARY KEY, name TEXT)")
+    db.executemany("INSERT INTO u VALUES (?, ?)", [(i, f"name {i}") for i in range(400)])
+    assert not db.tables.is_loaded("t")
+    assert query.execute() == expected
+    assert not db.tables.is_loaded("t")
+
+
+def tied_table(tmp_path, index=None):
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    db.execute_sql("CREATE TABLE t (id INTEGER PRIMARY KEY, x INTEGER, y INTEGER)")
+    if index:
+        db.execute_sql(f"CREATE INDEX t_idx ON t ({index}) USING BTREE")
+    db.executemany("INSERT INTO t VALUES (?, ?, ?)", [(i, i % 5, -i) for i in range(50)])
+    # Adds row 0 to the index entry for x = 3 after rows with higher ids
+    db.execute_sql("UPDATE t SET x = 3 WHERE id = 0")
+    return db
+
+
+@pytest.mark.parametrize("index", ["x", "x, y"])
+@pytest.mark.parametrize("direction", ["ASC", "DESC"])
+def test_index_order_keeps_ties_in_scan_order(tmp_path, index, direction):
+    # x + 0 cannot use an index, so those rows are sorted
+    expected = tied_table(tmp_path / "plain").execute_sql(f"SELECT id FROM t ORDER BY x + 0 {direction}")
+    db = tied_table(tmp_path / "indexed", index)
+    assert db.execute_sql(f"SELECT id FROM t ORDER BY x {direction}") == expected
+    assert db.execute_sql(f"SELECT id FROM t WHERE x >= 1 ORDER BY x {direction}") == \
+        [row for row in expected if row["id"] % 5 >= 1 and row["id"] != 0 or row["id"] == 0]
+
+
+@pytest.mark.parametrize("direction", ["ASC", "DESC"])
+def test_limit_through_ties_is_the_same_with_and_without_index(tmp_path, direction):
+    plain = tied_table(tmp_path / "plain")
+    indexed = tied_table(tmp_path / "indexed", "x")
+    full = plain.execute_sql(f"SELECT id, x FROM t ORDER BY x {direction}")
+    # Each x value has ten rows, so these limits cut through a group
+    for limit, offset in [(3, 0), (15, 0), (7, 10), (24, 3)]:
+        clause = f"LIMIT {limit} OFFSET {offset}"
+        expected = full[offset:offset + limit]
+        # Sorted in full, kept in the top-k heap, and read off the index
+        assert plain.execute_sql(f"SELECT id, x FROM t ORDER BY x {direction}")[offset:offset + limit] == expected
+        assert plain.execute_sql(f"SELECT id, x FROM t ORDER BY x {direction} {clause}") == expected
+        assert indexed.execute_sql(f"SELECT id, x FROM t ORDER BY x {direction} {clause}") == expected
+        assert indexed.execute_sql(f"SELECT id, x FROM t WHERE x >= 0 ORDER BY x {direction} {clause}") == expected
+
+
+
+@pytest.mark.parametrize("index_type", ["BTREE", "HASH"])
+def test_composite_index_prefix_matches_a_scan(tmp_path, index_type):
+    plain = tied_table(tmp_path / "plain")
+    indexed = tied_table(tmp_path / "indexed")
+    indexed.execute_sql(f"CREATE INDEX t_xy ON t (x, y) USING {index_type}")
+    for where in ["x = 3", "x IN (1, 3)", "x = 3 AND y < -20", "x = 'a'", "x = NULL"]:
+        query = f"SELECT id, y FROM t WHERE {where}"
+        assert indexed.execute_sql(query) == plain.execute_sql(query)
+    plan = indexed._plan_select(parse_sql("SELECT id FROM t WHERE x = 3"))
+    assert plan.access.kind == ("prefix" if index_type == "BTREE" else "scan")
+
+class FailingFile:
+    # Stands in for the log file; the next write raises
+    def __init__(self, file):
+        self.file = file
+        self.fail = True
+
+    def write(self, data):
+        if self.fail:
+            self.fail = False
+            raise OSError("disk full")
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+@pytest.mark.parametrize("durability", [Durability.SYNC, Durability.GROUP])
+def test_failed_log_write_is_never_reported_durable(tmp_path, durability):
+    db = SimpleRDBMS(data_dir=str(tmp_path), durability=durability)
+    db.execute_sql("CREATE TABLE t (id INTEGER PRIMARY KEY)")
+    db.execute_sql("INSERT INTO t VALUES (1)")
+    durable = db.wal.durable_lsn
+    db.wal._file = FailingFile(db.wal._file)
+    with pytest.raises(OSError, match="disk full"):
+        db.execute_sql("INSERT INTO t VALUES (2)")
+    assert db.wal.durable_lsn == durable
+    # Later commits must not pass off the lost frame as durable
+    with pytest.raises(ValueError, match="failed to flush"):
+        db.execute_sql("INSERT INTO t VALUES (3)")
+    assert db.wal.durable_lsn == durable
+    # The failed statement stays applied in memory; a checkpoint puts it into
+    # the snapshots and clears the failure
+    db.checkpoint()
+    db.execute_sql("INSERT INTO t VALUES (4)")
+    db.wal.close()
+    reopened = SimpleRDBMS(data_dir=str(tmp_path))
+    assert reopened.execute_sql("SELECT id FROM t ORDER BY id") == [{"id": 1}, {"id": 2}, {"id": 4}]
+
+
+def test_checkpoint_from_another_thread(tmp_path):
+    import threading
+    db = SimpleRDBMS(data_dir=str(tmp_path), checkpoint_interval=10 ** 6)
+    db.execute_sql("CREATE TABLE t (id INTEGER PRIMARY KEY, n INTEGER)")
+    db.executemany("INSERT INTO t VALUES (?, 0)", [(i,) for i in range(2000)])
+    db.execute_sql("DELETE FROM t WHERE id % 2 = 0")
+    done = threading.Event()
+    errors = []
+
+    def checkpoints():
+        while not done.is_set():
+            try:
+                db.checkpoint()
+            except Exception as e:
+                errors.append(e)
+    thread = threading.Thread(target=checkpoints)
+    thread.start()
+    try:
+        for i in range(1, 2000, 2):
+            db.execute_sql("UPDATE t SET n = n + 1 WHERE id < ?", [i + 2])
+    finally:
+        done.set()
+        thread.join()
+    assert not errors
+    expected = db.execute_sql("SELECT id, n FROM t ORDER BY id")
+    assert expected[0] == {"id": 1, "n": 1000} and expected[-1] == {"id": 1999, "n": 1}
+    db.close()
+    assert SimpleRDBMS(data_dir=str(tmp_path)).execute_sql("SELECT id, n FROM t ORDER BY id") == expected
+
+
+def test_non_reserved_keywords_name_tables_and_columns(tmp_path):
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    db.execute_sql("CREATE TABLE kv (key TEXT PRIMARY KEY, value TEXT, limit INTEGER DEFAULT 3)")
+    db.execute_sql("INSERT INTO kv (key, value) VALUES ('a', 'x') ON CONFLICT (key) DO NOTHING")
+    db.execute_sql("INSERT INTO kv (key, value) VALUES ('a', 'y') ON CONFLICT (key) DO UPDATE SET limit = limit + 1")
+    assert db.execute_sql("SELECT key, value, limit FROM kv WHERE key = 'a' LIMIT 1 OFFSET 0") == \
+        [{"key": "a", "value": "x", "limit": 4}]
+    db.execute_sql("CREATE INDEX index ON kv (limit) USING BTREE")
+    db.execute_sql("CREATE TABLE IF NOT EXISTS if (to INTEGER)")
+    db.execute_sql("DROP TABLE if")
+    db.execute_sql("DROP TABLE IF EXISTS if")
+    with pytest.raises(ValueError, match="expected a name, found 'select'"):
+        db.execute_sql("CREATE TABLE select (id INTEGER)")
+
+
+def test_quoted_identifiers_lose_their_quotes(tmp_path):
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    db.execute_sql('CREATE TABLE "order items" ("select" INTEGER, "say ""hi""" TEXT)')
+    db.execute_sql("""INSERT INTO "order items" VALUES (1, 'hello')""")
+    assert db.execute_sql('SELECT "select", "say ""hi""" FROM "order items"') == \
+        [{"select": 1, 'say "hi"': "hello"}]
+    assert db.execute_sql('SELECT o."select" FROM "order items" AS o') == [{"o.select": 1}]
+
+
+def test_modulo_truncates_like_division_and_in_lists_follow_null_logic(tmp_path):
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    db.execute_sql("CREATE TABLE t (a INTEGER, f REAL)")
+    db.executemany("INSERT INTO t VALUES (?, ?)", [(-7, -7.5), (7, 7.5), (None, None)])
+    assert db.execute_sql("SELECT a / 2 AS d, a % 2 AS m, f % 2 AS fm FROM t WHERE a IS NOT NULL") == \
+        [{"d": -3, "m": -1, "fm": -1.5}, {"d": 3, "m": 1, "fm": 1.5}]
+    with pytest.raises(ValueError, match="Division by zero"):
+        db.execute_sql("SELECT f % 0 AS m FROM t")
+    assert db.execute_sql("SELECT a FROM t WHERE a NOT IN (1, NULL)") == []
+    assert db.execute_sql("SELECT a FROM t WHERE a NOT IN (1, ?)", (None,)) == []
+    assert db.execute_sql("SELECT a FROM t WHERE NOT (a IN (1, NULL))") == []
+    assert db.execute_sql("SELECT a FROM t WHERE a IN (7, NULL)") == [{"a": 7}]
+    assert db.execute_sql("SELECT a FROM t WHERE a NOT IN (1, 2)") == [{"a": -7}, {"a": 7}]
+
+
+@pytest.mark.parametrize("query, method", [
+    ("SELECT t.id, t.x FROM t WHERE x >= 0 ORDER BY x DESC", None),
+    ("SELECT t.id, u.id FROM u JOIN t ON t.id = u.id", "INDEX"),
+    ("SELECT t.id, u.id FROM t JOIN u ON u.x = t.x", "MERGE"),
+])
+def test_cursor_survives_writers_between_rows(tmp_path, query, method):
+    import threading
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    for name in ("t", "u"):
+        db.execute_sql(f"CREATE TABLE {name} (id INTEGER PRIMARY KEY, x INTEGER)")
+        db.execute_sql(f"CREATE INDEX {name}_x ON {name} (x) USING BTREE")
+        db.executemany(f"INSERT INTO {name} VALUES (?, ?)", [(i, i % 50) for i in range(200)])
+    if method:
+        assert db._plan_select(parse_sql(query)).joins[1].method.name == method
+    cursor = db.iterate_sql(query)
+    seen = [next(cursor)]
+
+    def writer():
+        db.execute_sql("DELETE FROM t WHERE id >= 20")
+        db.execute_sql("VACUUM t")
+        db.executemany("INSERT INTO t VALUES (?, ?)", [(i, i % 7) for i in range(1000, 1100)])
+    # The statement lock is free between rows, so writers get in there
+    thread = threading.Thread(target=writer)
+    thread.start()
+    thread.join()
+    seen.extend(cursor)
+    rows = [tuple(row.values()) for row in seen]
+    assert len(rows) == len(set(rows))
+    assert all(row[0] in range(200) or row[0] in range(1000, 1100) for row in rows)
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT a.id, b.id FROM a JOIN b ON a.k = b.k WHERE b.v > 10",
+    # Hashes c and probes it with b, then hashes a and probes it with those rows
+    "SELECT a.id, b.id, c.id FROM a JOIN b ON a.k = b.k JOIN c ON c.k = b.k WHERE c.id < 100",
+])
+def test_spilled_hash_join_returns_the_same_rows(tmp_path, query):
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    db.execute_sql("CREATE TABLE a (id INTEGER PRIMARY KEY, k INTEGER)")
+    db.execute_sql("CREATE TABLE b (id INTEGER PRIMARY KEY, k INTEGER, v INTEGER)")
+    db.executemany("INSERT INTO a VALUES (?, ?)", [(i, i % 97 if i % 11 else None) for i in range(600)])
+    db.executemany("INSERT INTO b VALUES (?, ?, ?)", [(i, i % 131, i % 50) for i in range(2000)])
+    db.execute_sql("CREATE TABLE c (id INTEGER PRIMARY KEY, k INTEGER)")
+    db.executemany("INSERT INTO c VALUES (?, ?)", [(i, i % 97) for i in range(300)])
+    in_memory = sorted(tuple(row.values()) for row in db.execute_sql(query))
+    assert db.join_statistics.hash_joins and not db.join_statistics.spilled_joins
+    db.work_mem = 4000
+    spilled = sorted(tuple(row.values()) for row in db.execute_sql(query))
+    assert db.join_statistics.spilled_joins >= 1
+    assert spilled == in_memory and len(spilled) > 1000
+
+
+def columnar_and_row_tables(tmp_path, rows):
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    for name, layout in (("r", ""), ("c", " USING COLUMNAR")):
+        db.execute_sql(f"CREATE TABLE {name} (id INTEGER PRIMARY KEY, n INTEGER, x REAL, "
+                       f"ok BOOLEAN, day DATE, tag TEXT){layout}")
+        db.executemany(f"INSERT INTO {name} VALUES (?, ?, ?, ?, ?, ?)", rows)
+    return db
+
+
+def test_columnar_table_matches_row_table_across_reopen(tmp_path):
+    rows = [(i, None if i % 9 == 0 else i * 1000003 - 5 * 10 ** 8, i / 4, i % 3 == 0,
+             None if i % 7 == 0 else f"2024-0{1 + i % 9}-1{i % 10}", f"tag {i % 13}" if i % 5 else None)
+            for i in range(300)]
+    db = columnar_and_row_tables(tmp_path, rows)
+    for name in ("r", "c"):
+        db.execute_sql(f"UPDATE {name} SET tag = 'changed', n = n + 1 WHERE id % 10 = 3")
+        db.execute_sql(f"DELETE FROM {name} WHERE id % 10 = 4")
+    queries = [
+        "SELECT * FROM {t} ORDER BY id",
+        "SELECT tag, COUNT(*) AS c, SUM(n) AS s, MIN(day) AS d, AVG(x) AS a FROM {t} GROUP BY tag ORDER BY tag",
+        "SELECT id, day FROM {t} WHERE ok = TRUE AND day >= '2024-05-01' ORDER BY day DESC, id",
+    ]
+    expected = [db.execute_sql(query.format(t="r")) for query in queries]
+    assert [db.execute_sql(query.format(t="c")) for query in queries] == expected
+    assert isinstance(db.tables["c"].rows, rdbms.ColumnStore)
+    db.close()
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    assert [db.execute_sql(query.format(t="c")) for query in queries] == expected
+    with pytest.raises(ValueError, match="out of range"):
+        db.execute_sql("INSERT INTO c (id, n) VALUES (1000, ?)", (1 << 70,))
+    assert db.execute_sql(queries[0].format(t="c")) == expected[0]
+
+
+def test_text_columns_switch_between_dictionary_and_plain_encoding(tmp_path, monkeypatch):
+    rows = [(i, i, 0.0, True, None, f"status {i % 4}" if i < 600 else f"unique {i}") for i in range(1200)]
+    db = columnar_and_row_tables(tmp_path, rows[:600])
+    vectors = db.tables["c"].rows.vectors
+    assert isinstance(vectors[5], rdbms.DictionaryTextVector)
+    assert sorted(vectors[5].dictionary) == [f"status {n}" for n in range(4)]
+    # Hundreds of new distinct values make codes pointless
+    for name in ("r", "c"):
+        db.executemany(f"INSERT INTO {name} VALUES (?, ?, ?, ?, ?, ?)", rows[600:])
+    assert isinstance(db.tables["c"].rows.vectors[5], rdbms.TextVector)
+    for query in ["SELECT id FROM {t} WHERE tag IN ('status 1', 'unique 700', 'missing')",
+                  "SELECT id FROM {t} WHERE tag = 'status 1' OR tag = 'unique 700'"]:
+        assert db.execute_sql(query.format(t="c")) == db.execute_sql(query.format(t="r"))
+    # Once the distinct values are gone, a checkpoint goes back to codes
+    for name in ("r", "c"):
+        db.execute_sql(f"DELETE FROM {name} WHERE id >= 600")
+    db.execute_sql("VACUUM c")
+    db.close()
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    assert isinstance(db.tables["c"].rows.vectors[5], rdbms.DictionaryTextVector)
+    matched = []
+    match = rdbms.DictionaryTextVector.match
+    monkeypatch.setattr(rdbms.DictionaryTextVector, "match",
+                        lambda self, values: matched.append(values) or match(self, values))
+    for query in ["SELECT id FROM {t} WHERE tag = 'status 2'", "SELECT id FROM {t} WHERE tag IN ('status 0', 'x')"]:
+        assert db.execute_sql(query.format(t="c")) == db.execute_sql(query.format(t="r"))
+    # Both filters compared codes
+    assert len(matched) == 2
+
+
+def test_operator_precedence_and_literals(tmp_path):
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    db.execute_sql("CREATE TABLE t (a INTEGER, b INTEGER, c INTEGER, s TEXT)")
+    db.execute_sql("INSERT INTO t VALUES (1, 2, 3, 'x, ORDER BY ''y''')")
+    assert db.execute_sql("SELECT 1 - 2 - 3 * -c % 4 AS v, (1 - 2) * b AS w, a + b * c AS z, "
+                          "s || '!' AS q FROM t") == [{"v": 0, "w": -2, "z": 7, "q": "x, ORDER BY 'y'!"}]
+    # NOT binds tighter than AND, which binds tighter than OR
+    assert db.execute_sql("SELECT a FROM t WHERE NOT a = 1 OR b = 2 AND c = 3") == [{"a": 1}]
+    assert db.execute_sql("SELECT a FROM t WHERE NOT (a = 1 OR b = 2) AND c = 3") == []
+    assert db.execute_sql("SELECT a FROM t WHERE a + 1 BETWEEN b AND c AND s LIKE 'x,%'") == [{"a": 1}]
+    assert parse_sql("SELECT a FROM t WHERE s = 'a;b'; ").where.right.value == "a;b"
+
+
+@pytest.mark.parametrize("sql, message", [
+    ("SELECT a FROM t WHERE", "Syntax error at position 21: expected an expression, found end of input"),
+    ("SELECT a, FROM t", "Syntax error at position 10: expected an expression, found 'FROM'"),
+    ("SELECT a FROM t LIMIT 1 garbage", "Syntax error at position 24: expected end of statement, found 'garbage'"),
+    ("INSERT INTO t VALUES (1", "Syntax error at position 23: expected ')', found end of input"),
+    ("SELECT a FROM t WHERE x IS 3", "Syntax error at position 27: expected NULL, found '3'"),
+    ("SELECT a FROM t WHERE x = 'abc", "Unterminated string literal at position 26"),
+    ("SELECT a FROM t WHERE x = @", "Unexpected character '@' at position 26"),
+    ("EXPLAIN SELECT a FROM t", "Unsupported SQL command: EXPLAIN SELECT a FROM t"),
+    ("SELECT FOO(a) FROM t", "Unknown function: FOO"),
+])
+def test_syntax_errors_say_where_and_what(sql, message):
+    with pytest.raises(ValueError) as error:
+        parse_sql(sql)
+    assert str(error.value) == message
+
+
+def test_hash_join_matches_a_reference_join(tmp_path):
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    db.execute_sql("CREATE TABLE a (id INTEGER PRIMARY KEY, x INTEGER)")
+    db.execute_sql("CREATE TABLE b (id INTEGER PRIMARY KEY, a_id INTEGER, v INTEGER)")
+    a = [(i, i % 7 if i % 11 else None) for i in range(300)]
+    b = [(i, (i * 37) % 350 if i % 13 else None, i % 10) for i in range(1000)]
+    db.executemany("INSERT INTO a VALUES (?, ?)", a)
+    db.executemany("INSERT INTO b VALUES (?, ?, ?)", b)
+    rows = db.execute_sql("SELECT a.id, b.id AS b_id FROM a JOIN b ON a.id = b.a_id AND b.v > a.x")
+    assert db.join_statistics.hash_joins == 1
+    # NULL keys and NULL comparisons never match
+    expected = [(ai, bi) for ai, x in a for bi, a_id, v in b if a_id == ai and x is not None and v > x]
+    assert sorted((row["a.id"], row["b_id"]) for row in rows) == sorted(expected)
+
+
+def test_star_join_order_puts_the_fact_table_last(tmp_path):
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    db.execute_sql("CREATE TABLE f (id INTEGER PRIMARY KEY, d1 INTEGER, d2 INTEGER)")
+    db.execute_sql("CREATE TABLE d1 (id INTEGER PRIMARY KEY, name TEXT)")
+    db.execute_sql("CREATE TABLE d2 (id INTEGER PRIMARY KEY, region TEXT)")
+    db.executemany("INSERT INTO f VALUES (?, ?, ?)", [(i, i % 20, i % 50) for i in range(3000)])
+    db.executemany("INSERT INTO d1 VALUES (?, ?)", [(i, f"n{i}") for i in range(20)])
+    db.executemany("INSERT INTO d2 VALUES (?, ?)", [(i, f"r{i % 5}") for i in range(50)])
+    filters = "d2.region = 'r3' AND d1.name IN ('n3', 'n8')"
+    queries = [
+        f"SELECT f.id FROM f JOIN d1 ON d1.id = f.d1 JOIN d2 ON d2.id = f.d2 WHERE {filters}",
+        f"SELECT f.id FROM d2 JOIN f ON d2.id = f.d2 JOIN d1 ON d1.id = f.d1 WHERE {filters}",
+        f"SELECT f.id FROM d1 JOIN d2 JOIN f WHERE d2.id = f.d2 AND d1.id = f.d1 AND {filters}",
+    ]
+    expected = [{"f.id": i} for i in range(3000) if i % 20 in (3, 8) and i % 50 % 5 == 3]
+    for with_index in (False, True):
+        if with_index:
+            db.execute_sql("CREATE INDEX f_d2 ON f (d2)")
+        for query in queries:
+            steps = db._plan_select(parse_sql(query)).joins
+            assert steps[-1].table == "f"
+            assert steps[-1].method.name == ("INDEX" if with_index else "HASH")
+            assert sorted(db.execute_sql(query), key=lambda row: row["f.id"]) == expected
+
+
+def test_external_sort_with_many_runs_matches_an_in_memory_sort(tmp_path, monkeypatch):
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    db.execute_sql("CREATE TABLE t (id INTEGER PRIMARY KEY, g INTEGER, s TEXT)")
+    rows = [(i, (i * 7919) % 13, None if i % 17 == 0 else f"s{(i * 31) % 101}") for i in range(3000)]
+    db.executemany("INSERT INTO t VALUES (?, ?, ?)", rows)
+    # Descending g, then ascending s with NULLs first; ties keep table order
+    expected = sorted(rows, key=lambda row: (row[2] is not None, row[2] or ""))
+    expected.sort(key=lambda row: row[1], reverse=True)
+    expected = [{"id": i, "g": g, "s": s} for i, g, s in expected]
+    query = "SELECT id, g, s FROM t ORDER BY g DESC, s"
+    assert db.execute_sql(query) == expected
+    assert db.sort_statistics.external_sorts == 0
+    db.work_mem = 20000
+    # A small fan-in forces intermediate merge passes
+    monkeypatch.setattr(rdbms.ExternalSort, "MAX_FAN_IN", 4)
+    assert db.execute_sql(query) == expected
+    stats = db.sort_statistics
+    assert stats.external_sorts == 1 and stats.runs_written > 4 and stats.merge_passes >= 1
+    assert db.execute_sql(query + " LIMIT 5 OFFSET 1000") == expected[1000:1005]
+
+
+def test_hyperloglog_stays_within_its_error_bound_and_merges_exactly():
+    import random
+    random.seed(7)
+    values = random.sample(range(10 ** 9), 50000)
+    parts = [rdbms.HyperLogLog() for _ in range(4)]
+    whole = rdbms.HyperLogLog()
+    for n, value in enumerate(values):
+        # Overlapping partitions, as parallel workers could see
+        parts[n % 4].add(value)
+        parts[(n + 1) % 4].add(value)
+        whole.add(value)
+    # Four standard errors at the default precision
+    assert abs(whole.estimate() - len(values)) < 0.033 * len(values)
+    merged = rdbms.HyperLogLog()
+    for part in parts:
+        merged.merge(part)
+    assert merged.estimate() == whole.estimate()
+    small = rdbms.HyperLogLog()
+    for value in ["a", "b", "c", "a", 1, 1.5, None] * 3:
+        small.add(value)
+    assert small.estimate() == 6 and small.registers is None
+
+
+def test_tdigest_quantiles_are_accurate_in_rank_and_merge():
+    import random
+    random.seed(11)
+    values = [random.expovariate(1.0) for _ in range(20000)]
+    ordered = sorted(values)
+    parts = [rdbms.TDigest() for _ in range(5)]
+    for n, value in enumerate(values):
+        parts[n % 5].add(value)
+    merged = rdbms.TDigest()
+    for part in parts:
+        merged.merge(part)
+    for digest, data in ((parts[0], sorted(values[::5])), (merged, ordered)):
+        for fraction in (0.001, 0.01, 0.25, 0.5, 0.9, 0.99, 0.999):
+            rank = bisect.bisect_left(data, digest.quantile(fraction)) / len(data)
+            # Rank error shrinks toward the tails
+            assert abs(rank - fraction) <= max(0.002, 0.01 * min(fraction, 1 - fraction))
+    assert merged.quantile(0) == ordered[0] and merged.quantile(1) == ordered[-1]
+    assert len(merged.centroids) <= 2 * merged.compression
+
+
+def test_approximate_aggregates_in_sql(tmp_path):
+    db = SimpleRDBMS(data_dir=str(tmp_path))
+    db.execute_sql("CREATE TABLE t (id INTEGER PRIMARY KEY, g INTEGER, u INTEGER, ms REAL)")
+    db.executemany("INSERT INTO t VALUES (?, ?, ?, ?)",
+                   [(i, i % 3, (i * 7) % 2000 if i % 10 else None, float(i % 1000)) for i in range(9000)])
+    rows = db.execute_sql("SELECT g, APPROX_COUNT_DISTINCT(u) AS users, COUNT(DISTINCT u) AS exact, "
+                          "APPROX_PERCENTILE(ms, 0.5) AS p50, APPROX_PERCENTILE(ms, 0.99) AS p99 "
+                          "FROM t GROUP BY g ORDER BY g")
+    assert [row["g"] for row in rows] == [0, 1, 2]
+    for row in rows:
+        assert abs(row["users"] - row["exact"]) <= 0.03 * row["exact"]
+        assert abs(row["p50"] - 500) < 15 and abs(row["p99"] - 990) < 5
+    with pytest.raises(ValueError):
+        db.execute_sql("SELECT APPROX_PERCENTILE(ms, 2) AS p FROM t")
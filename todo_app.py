@@ -3,33 +3,42 @@ from http.server import HTTPServer, BaseHTTPRequestHandler
 import json
 
 class TodoApp:
+    # Columns update_todo may change; names can't be bound as parameters
+    UPDATABLE_COLUMNS = ("title", "description", "completed", "priority")
+    
     def __init__(self):
         self.db = SimpleRDBMS(data_dir="todo_data")
         self._init_database()
+        
+        # Hot statements are parsed and planned once
+        self._select_todo = self.db.prepare("SELECT * FROM todos WHERE id = ?")
+        self._insert_todo = self.db.prepare("""
+            INSERT INTO todos (id, title, description, completed, created_at, priority)
+            VALUES (?, ?, ?, FALSE, ?, ?)
+        """)
+        self._delete_todo = self.db.prepare("DELETE FROM todos WHERE id = ?")
+        # Flipped in the engine, without reading the todo first
+        self._toggle_todo = self.db.prepare("UPDATE todos SET completed = NOT completed WHERE id = ?")
+        # Read off the table statistics, without scanning the todos
+        self._max_todo_id = self.db.prepare("SELECT MAX(id) AS id FROM todos")
     
     def _init_database(self):
         # Create todos table if it doesn't exist
-        try:
-            self.db.execute_sql("""
-                CREATE TABLE todos (
-                    id INTEGER PRIMARY KEY,
-                    title TEXT NOT NULL,
-                    description TEXT,
-                    completed BOOLEAN DEFAULT FALSE,
-                    created_at TEXT,
-                    priority INTEGER DEFAULT 3
-                )
-            """)
-        except:
-            pass  # Table already exists
+        self.db.execute_sql("""
+            CREATE TABLE IF NOT EXISTS todos (
+                id INTEGER PRIMARY KEY,
+                title TEXT NOT NULL,
+                description TEXT,
+                completed BOOLEAN DEFAULT FALSE,
+                created_at TEXT,
+                priority INTEGER DEFAULT 3
+            )
+        """)
     
     def get_all_todos(self):
         results = self.db.execute_sql("""
             SELECT * FROM todos 
-            ORDER BY 
-                CASE WHEN completed THEN 1 ELSE 0 END,
-                priority,
-                created_at DESC
+            ORDER BY completed, priority, created_at DESC
         """)
         return results
     
@@ -38,45 +47,38 @@ class TodoApp:
         created_at = time.strftime("%Y-%m-%d %H:%M:%S")
         
         # Get next ID
-        todos = self.get_all_todos()
-        next_id = max([t['id'] for t in todos], default=0) + 1
+        next_id = (self._max_todo_id.execute()[0]["id"] or 0) + 1
         
-        self.db.execute_sql(f"""
-            INSERT INTO todos (id, title, description, completed, created_at, priority)
-            VALUES ({next_id}, '{title}', '{description}', FALSE, '{created_at}', {priority})
-        """)
+        self._insert_todo.execute((next_id, title, description, created_at, priority))
         
         return self.get_todo(next_id)
     
     def get_todo(self, todo_id):
-        results = self.db.execute_sql(f"SELECT * FROM todos WHERE id = {todo_id}")
+        results = self._select_todo.execute((todo_id,))
         return results[0] if results else None
     
     def update_todo(self, todo_id, **updates):
+        updates = {k: v for k, v in updates.items() if k in self.UPDATABLE_COLUMNS}
         if not updates:
             return None
         
-        set_clause = ", ".join([f"{k} = '{v}'" if isinstance(v, str) else f"{k} = {v}" 
-                               for k, v in updates.items()])
+        set_clause = ", ".join(f"{k} = ?" for k in updates)
         
         self.db.execute_sql(f"""
             UPDATE todos 
             SET {set_clause}
-            WHERE id = {todo_id}
-        """)
+            WHERE id = ?
+        """, [*updates.values(), todo_id])
         
         return self.get_todo(todo_id)
     
     def delete_todo(self, todo_id):
-        self.db.execute_sql(f"DELETE FROM todos WHERE id = {todo_id}")
+        self._delete_todo.execute((todo_id,))
         return True
     
     def toggle_todo(self, todo_id):
-        todo = self.get_todo(todo_id)
-        if todo:
-            new_status = not todo['completed']
-            return self.update_todo(todo_id, completed=new_status)
-        return None
+        self._toggle_todo.execute((todo_id,))
+        return self.get_todo(todo_id)
 
 
 class TodoHandler(BaseHTTPRequestHandler):